@@ -2,6 +2,10 @@
 A collection of all important classes and functions for the cloud package.
 """
 
+from .manifest import *
 from .movies import *
-from .processing import convert_raw_files, calculate_cloud_statistics
+from .processing import convert_archive_files, convert_raw_files, \
+    calculate_cloud_statistics, process_instruments, read_rollups, \
+    recalculate_cloud_statistics, update_rollups
 from .toolbox import *
+from .workqueue import *
@@ -1,23 +1,109 @@
 from datetime import datetime
 import logging
+import os
 
-import pandas as pd
+import numpy as np
 from typhon.files import expects_file_info, FileHandler, FileInfo
-import xarray as xr
+
+from .movies import MovieBuilder
 
 __all__ = [
     "ThermalCamASCII",
 ]
 
 
+def _parse_timestamp(line, filename):
+    """Parse the timestamp from the first line of a Dumbo raw file.
+
+    Args:
+        line: The first line of the file (without line break).
+        filename: Path and name of the file (only for the error message).
+
+    Returns:
+        A datetime object or None if the line could not be parsed.
+    """
+    try:
+        # Split the line by the tabulator. Convert the second half into a
+        # datetime object and return it.
+        date_time = line.split('\t')[1]
+        return datetime.strptime(date_time, "%d.%m.%Y %H:%M:%S")
+    except Exception:
+        logging.error(
+            "Tried to derive file timestamp from Dumbo raw file '%s'. "
+            "Check whether its first line has this pattern:"
+            "'{name-of-original-file}	DD.MM.YYYY hh:mm:ss'!" %
+            filename,
+            exc_info=True
+        )
+
+
+def parse_ascii_file(filename):
+    """Read the timestamp and the image from a Dumbo raw file at once.
+
+    The file is read only once as bytes. The decimal commas are replaced in
+    one go and all numbers are converted by numpy directly.
+
+    Args:
+        filename: Path and name of the file.
+
+    Returns:
+        A tuple of the timestamp (datetime object or None) and a numpy.array
+        with the image (height x width).
+
+    Raises:
+        ValueError: If the file contains values that are not numbers or its
+            rows have not the same number of columns.
+    """
+    with open(filename, "rb") as file:
+        content = file.read()
+
+    # The first line contains the name of the original file and the
+    # timestamp, the second line the column names:
+    title, _, content = content.partition(b"\n")
+    _, _, content = content.partition(b"\n")
+    timestamp = _parse_timestamp(
+        title.rstrip(b"\r").decode("latin-1"), filename)
+
+    # The first column contains the row number, the next 384 columns the
+    # pixels:
+    rows = content.replace(b",", b".").decode("latin-1").split("\n")
+    rows = [row for row in rows if row.strip()]
+    columns = len(rows[0].split()) if rows else 0
+    tokens = " ".join(rows).split()
+    if len(tokens) != len(rows) * columns:
+        raise ValueError(
+            "The rows of '%s' have different numbers of columns (expected %d "
+            "values, found %d)!" % (filename, len(rows) * columns, len(tokens))
+        )
+
+    try:
+        values = np.fromiter(map(float, tokens), np.float64, len(tokens))
+    except ValueError as err:
+        raise ValueError(
+            "Could not parse the image of '%s': %s" % (filename, err)
+        ) from err
+    return timestamp, values.reshape(len(rows), columns)[:, 1:385]
+
+
 class ThermalCamASCII(FileHandler):
     """ This class can read thermal cam ASCII files of the Dumbo instrument.
     """
 
-    def __init__(self, **kwargs):
+    def __init__(self, cache=False, **kwargs):
+        """Initialize a ThermalCamASCII object.
+
+        Args:
+            cache: If true, each read image is saved to a binary sidecar file
+                (the name of the raw file plus *.npy*). The next time, the
+                image is read from this file unless the raw file has changed
+                (i.e. its size or modification time).
+            **kwargs: Additional keyword arguments for FileHandler base class.
+        """
         # Call the base class initializer
         super(ThermalCamASCII, self).__init__(**kwargs)
 
+        self.cache = cache
+
     @expects_file_info()
     def get_info(self, filename, **kwargs):
         """ Get info parameters from a file (time coverage, etc).
@@ -34,19 +120,40 @@ class ThermalCamASCII(FileHandler):
 
     @staticmethod
     def _get_timestamp(filename):
+        # Reads only the first line of the file:
+        with open(filename) as file:
+            return _parse_timestamp(file.readline().rstrip('\n'), filename)
+
+    def _read_cache(self, filename, stat):
+        """Read the image from the sidecar file if it is up-to-date"""
+        try:
+            cached = np.load(filename + ".npy")[0]
+        except (OSError, ValueError, IndexError):
+            return None
+
+        if cached["size"] != stat.st_size \
+                or cached["mtime"] != stat.st_mtime_ns:
+            return None
+
+        return cached["time"].astype(object), cached["images"]
+
+    def _write_cache(self, filename, stat, timestamp, image):
+        """Write the image to the sidecar file"""
+        record = np.empty(1, dtype=[
+            ("size", "i8"), ("mtime", "i8"), ("time", "M8[us]"),
+            ("images", image.dtype, image.shape),
+        ])
+        record["size"] = stat.st_size
+        record["mtime"] = stat.st_mtime_ns
+        record["time"] = np.datetime64("NaT") if timestamp is None \
+            else timestamp
+        record["images"] = image
+
         try:
-            with open(filename) as file:
-                # Reads the first line of the file and split it by the
-                # tabulator. Convert the second half into a datetime object and
-                # return it.
-                date_time = file.readline().rstrip('\n').split('\t')[1]
-                return datetime.strptime(date_time, "%d.%m.%Y %H:%M:%S")
-        except Exception:
-            logging.error(
-                "Tried to derive file timestamp from Dumbo raw file '%s'. "
-                "Check whether its first line has this pattern:"
-                "'{name-of-original-file}	DD.MM.YYYY hh:mm:ss'!" %
-                filename,
+            np.save(filename + ".npy", record)
+        except OSError:
+            logging.warning(
+                "Could not write the cache file for '%s'" % filename,
                 exc_info=True
             )
 
@@ -62,21 +169,34 @@ class ThermalCamASCII(FileHandler):
             A cloud.ThermalCamMovie object.
         """
 
-        dataframe = pd.read_csv(
-            filename.path, decimal=",", delimiter='\t',
-            # There are 384 columns but the first contains the index.
-            usecols=range(1, 385), dtype=float,
-            engine="c", header=1,
-        )
+        builder = MovieBuilder(1)
+        self.read_frame(filename.path, builder)
+        return builder.build().data
 
-        timestamp = self._get_timestamp(filename)
+    def read_frame(self, filename, builder, time=None):
+        """Read an ASCII file into the next slot of a movie.
 
-        movie = xr.Dataset()
+        Args:
+            filename: Path and name of the file.
+            builder: A cloud.MovieBuilder object.
+            time: Timestamp of the image. Will be used if the file has no
+                valid timestamp.
 
-        # We skip the first column since it only contains the row number.
-        movie["images"] = xr.DataArray(
-            [dataframe.as_matrix()], dims=["time", "height", "width"]
-        )
-        movie["time"] = [timestamp]
+        Returns:
+            None
+        """
+
+        cached = None
+        if self.cache:
+            stat = os.stat(filename)
+            cached = self._read_cache(filename, stat)
+
+        if cached is None:
+            timestamp, image = parse_ascii_file(filename)
+            if self.cache:
+                self._write_cache(filename, stat, timestamp, image)
+        else:
+            timestamp, image = cached
 
-        return movie
+        builder.reserve(image.shape, image.dtype)[...] = image
+        builder.append(time if timestamp is None else timestamp)
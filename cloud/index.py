@@ -0,0 +1,351 @@
+"""Persistent index of the files of filesets.
+
+Finding files can take a long time: directories with thousands of images have
+to be listed and - for Dumbo - each file has to be opened to read its
+timestamp. The :class:`FileIndex` saves the path, size, modification time and
+time coverage of each file to a SQLite database. :class:`IndexedFileSet` uses
+this database and only looks at directories and files that have changed since
+the last search.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+import json
+import logging
+import os
+import sqlite3
+
+from typhon.files import FileInfo, FileSet
+from typhon.trees import IntervalTree
+
+__all__ = [
+    "FileIndex",
+    "IndexedFileSet",
+]
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+def _to_text(timestamp):
+    return timestamp.isoformat(timespec="microseconds")
+
+
+def _from_text(text):
+    return datetime.strptime(text, TIME_FORMAT)
+
+
+# The size and modification time (in nanoseconds) of a file. It can be used
+# instead of an os.stat_result for the FileIndex:
+FileStat = namedtuple("FileStat", ["st_size", "st_mtime_ns"])
+
+
+def _directory(path):
+    return os.path.dirname(os.path.normpath(path))
+
+
+def _file_stat(details):
+    """Get the FileStat from the details of a file system entry
+
+    Args:
+        details: A dictionary from the info or ls methods of a file system
+            (see fsspec).
+
+    Returns:
+        A FileStat object.
+    """
+    mtime = details.get("mtime", details.get("created", 0))
+    if isinstance(mtime, datetime):
+        mtime = mtime.timestamp()
+    return FileStat(details.get("size"), int(round(float(mtime) * 1e9)))
+
+
+class FileIndex:
+    """A SQLite database with information about the files of filesets.
+
+    Each file is stored with its fileset name, path, directory, size,
+    modification time and time coverage. Additionally, the modification time of
+    each searched directory is stored.
+    """
+
+    def __init__(self, filename):
+        """Open (or create) a file index.
+
+        Args:
+            filename: Path and name of the SQLite database.
+        """
+        self.filename = filename
+        self._connection = None
+
+    def __getstate__(self):
+        # SQLite connections cannot be passed to other processes:
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        return state
+
+    @property
+    def connection(self):
+        """The connection to the database (opened when needed)"""
+        if self._connection is None:
+            # Several worker processes may search files at the same time. With
+            # write-ahead logging, they can read while another one writes:
+            self._connection = sqlite3.connect(self.filename, timeout=60)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    fileset TEXT, path TEXT, directory TEXT, size INTEGER,
+                    mtime INTEGER, start TEXT, end TEXT, attr TEXT,
+                    PRIMARY KEY (fileset, path)
+                );
+                CREATE INDEX IF NOT EXISTS files_by_time
+                    ON files (fileset, directory, start);
+                CREATE TABLE IF NOT EXISTS directories (
+                    fileset TEXT, path TEXT, mtime INTEGER,
+                    PRIMARY KEY (fileset, path)
+                );
+            """)
+        return self._connection
+
+    def commit(self):
+        self.connection.commit()
+
+    def get_directory(self, fileset, path):
+        """Get the modification time of a directory when it was indexed
+
+        Args:
+            fileset: Name of the fileset.
+            path: Path of the directory.
+
+        Returns:
+            The modification time in nanoseconds or None if the directory has
+            not been indexed yet.
+        """
+        row = self.connection.execute(
+            "SELECT mtime FROM directories WHERE fileset=? AND path=?",
+            (fileset, os.path.normpath(path))
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def set_directory(self, fileset, path, mtime, files):
+        """Replace all indexed files of a directory
+
+        This commits all changes to the index (also those of
+        :meth:`set_file`).
+
+        Args:
+            fileset: Name of the fileset.
+            path: Path of the directory.
+            mtime: Modification time of the directory in nanoseconds.
+            files: Paths of all files that are in this directory now. All
+                other files from this directory are removed from the index.
+
+        Returns:
+            None
+        """
+        path = os.path.normpath(path)
+        files = set(files)
+        indexed = {
+            row[0] for row in self.connection.execute(
+                "SELECT path FROM files WHERE fileset=? AND directory=?",
+                (fileset, path)
+            )
+        }
+        self.connection.executemany(
+            "DELETE FROM files WHERE fileset=? AND path=?",
+            ((fileset, file) for file in indexed - files)
+        )
+        self.connection.execute(
+            "INSERT OR REPLACE INTO directories VALUES (?, ?, ?)",
+            (fileset, path, mtime)
+        )
+        self.commit()
+
+    def get_file(self, fileset, path, stat):
+        """Get the information about a file if it has not changed
+
+        Args:
+            fileset: Name of the fileset.
+            path: Path of the file.
+            stat: The current os.stat_result (or FileStat) of the file.
+
+        Returns:
+            A FileInfo object or None if the file is not indexed or has
+            changed since then.
+        """
+        row = self.connection.execute(
+            "SELECT path, start, end, attr FROM files "
+            "WHERE fileset=? AND path=? AND size=? AND mtime=?",
+            (fileset, path, stat.st_size, stat.st_mtime_ns)
+        ).fetchone()
+        return None if row is None else self._to_info(row)
+
+    def set_file(self, fileset, info, stat):
+        """Add or update a file in the index
+
+        The change is not committed, call :meth:`commit` or
+        :meth:`set_directory` afterwards.
+
+        Args:
+            fileset: Name of the fileset.
+            info: A FileInfo object of the file.
+            stat: The os.stat_result (or FileStat) of the file.
+
+        Returns:
+            None
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (fileset, info.path, _directory(info.path), stat.st_size,
+             stat.st_mtime_ns, _to_text(info.times[0]),
+             _to_text(info.times[1]), json.dumps(info.attr))
+        )
+
+    def find(self, fileset, directory, start, end):
+        """Find all indexed files of a directory in a time period
+
+        Args:
+            fileset: Name of the fileset.
+            directory: Path of the directory.
+            start: Start time as datetime object.
+            end: End time as datetime object.
+
+        Yields:
+            A FileInfo object for each file that overlaps with the period.
+        """
+        rows = self.connection.execute(
+            "SELECT path, start, end, attr FROM files "
+            "WHERE fileset=? AND directory=? AND start<=? AND end>=? "
+            "ORDER BY start",
+            (fileset, os.path.normpath(directory), _to_text(end),
+             _to_text(start))
+        ).fetchall()
+        for row in rows:
+            yield self._to_info(row)
+
+    @staticmethod
+    def _to_info(row):
+        path, start, end, attr = row
+        return FileInfo(
+            path, [_from_text(start), _from_text(end)], json.loads(attr)
+        )
+
+
+class IndexedFileSet(FileSet):
+    """A FileSet that finds its files with the help of a FileIndex.
+
+    Directories that have not changed since the last search are not listed
+    again, their files are taken from the index. Files that have not changed
+    are not opened again to retrieve their information.
+    """
+
+    def __init__(self, *args, index=None, recheck=False, **kwargs):
+        """Initialize an IndexedFileSet object.
+
+        Args:
+            *args: Positional arguments for the FileSet base class.
+            index: A FileIndex object. If not given, this behaves like a
+                normal FileSet.
+            recheck: Files can be modified in place without changing the
+                modification time of their directory. If this is true, the
+                size and modification time of each indexed file are checked
+                when searching (and changed files are read again). Otherwise,
+                the index is trusted as long as the directory has not changed.
+            **kwargs: Additional keyword arguments for the FileSet base class.
+        """
+        super(IndexedFileSet, self).__init__(*args, **kwargs)
+        self.index = index
+        self.recheck = recheck
+
+    def _get_details(self, path):
+        """Get the details of a path from the file system or None"""
+        try:
+            return self.file_system.info(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    def get_info(self, file_info, retrieve_via=None):
+        path = getattr(file_info, "path", file_info)
+
+        # Only files on the disk are indexed. Others (e.g. the members of
+        # archives) or information from the filename only are not worth it:
+        details = None
+        if self.index is not None and retrieve_via != "filename":
+            details = self._get_details(path)
+        if details is None or details["type"] != "file":
+            return super(IndexedFileSet, self).get_info(
+                file_info, retrieve_via)
+
+        info = self._get_indexed_info(
+            file_info, _file_stat(details), retrieve_via)
+        self.index.commit()
+        return info
+
+    def _get_indexed_info(self, file_info, stat, retrieve_via=None):
+        """Get the information of a file from the index or the file itself
+
+        Args:
+            file_info: A path or FileInfo object.
+            stat: The current FileStat of the file.
+            retrieve_via: See :meth:`FileSet.get_info`.
+
+        Returns:
+            A FileInfo object. If the file has not been indexed with this size
+            and modification time, it is added to the index (without
+            committing it).
+        """
+        path = getattr(file_info, "path", file_info)
+
+        # Returns None if the file has changed since it was indexed:
+        info = self.index.get_file(self.name, path, stat)
+        if info is None:
+            # Do not take it from the in-memory cache of FileSet either:
+            self.info_cache.pop(path, None)
+            info = super(IndexedFileSet, self).get_info(
+                file_info, retrieve_via)
+            self.index.set_file(self.name, info, stat)
+        return info
+
+    def _get_matching_files(self, path, regex, start, end,):
+        if self.index is None:
+            yield from super(IndexedFileSet, self)._get_matching_files(
+                path, regex, start, end)
+            return
+
+        mtime = _file_stat(self.file_system.info(path)).st_mtime_ns
+        if self.index.get_directory(self.name, path) != mtime:
+            # The directory has changed since we indexed it. Update all files
+            # from it (unchanged files are still taken from the index). The
+            # listing contains the sizes and modification times already:
+            logging.debug("Update the index of %s" % path)
+            files = [
+                self._get_indexed_info(
+                    FileInfo(details["name"], fs=self.file_system),
+                    _file_stat(details))
+                for details in sorted(
+                    self.file_system.ls(path, detail=True),
+                    key=lambda details: details["name"])
+                if details["type"] == "file" and regex.match(details["name"])
+            ]
+            # Commits also the updated files:
+            self.index.set_directory(
+                self.name, path, mtime, (info.path for info in files))
+
+        files = list(self.index.find(self.name, path, start, end))
+        if self.recheck:
+            # Read the files again that have been modified in place:
+            checked = []
+            for file_info in files:
+                details = self._get_details(file_info.path)
+                if details is not None:
+                    checked.append(self._get_indexed_info(
+                        file_info, _file_stat(details)))
+            self.index.commit()
+            files = checked
+
+        for file_info in files:
+            # Test whether the file is overlapping the interval between
+            # start and end date.
+            if regex.match(file_info.path) \
+                    and IntervalTree.interval_overlaps(
+                        file_info.times, (start, end)) \
+                    and not self.is_excluded(file_info):
+                yield file_info
@@ -0,0 +1,134 @@
+"""Manifest of all processed bundles.
+
+The manifest records for each bundle (e.g. one hour of images) and processing
+stage (extract, convert, stats) a fingerprint of all inputs (the input files
+with their sizes and modification times, the mask, the calibration, the lapse
+rate, etc.) and the output that has been written. When processing the same
+period again, bundles whose inputs have not changed and whose output still
+exists are skipped. Hence, an aborted run can be resumed and reprocessing a
+cruise touches only new or changed bundles.
+"""
+
+from datetime import datetime
+import hashlib
+import json
+import os
+import sqlite3
+
+__all__ = [
+    "Manifest",
+    "file_stats",
+]
+
+
+def file_stats(paths):
+    """Get the size and modification time of files
+
+    Args:
+        paths: A list of paths.
+
+    Returns:
+        A list of tuples with path, size and modification time (in
+        nanoseconds) for each file. Missing files get None as size and
+        modification time.
+    """
+    stats = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stats.append((path, stat.st_size, stat.st_mtime_ns))
+        except OSError:
+            stats.append((path, None, None))
+    return stats
+
+
+class Manifest:
+    """A SQLite database with the fingerprints of all processed bundles."""
+
+    def __init__(self, filename):
+        """Open (or create) a manifest.
+
+        Args:
+            filename: Path and name of the SQLite database.
+        """
+        self.filename = filename
+        self._connection = None
+
+    def __getstate__(self):
+        # SQLite connections cannot be passed to other processes:
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        return state
+
+    @property
+    def connection(self):
+        """The connection to the database (opened when needed)"""
+        if self._connection is None:
+            # Several worker processes may write at the same time:
+            self._connection = sqlite3.connect(self.filename, timeout=60)
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS bundles (
+                    stage TEXT, bundle TEXT, fingerprint TEXT, inputs TEXT,
+                    output TEXT, processed TEXT,
+                    PRIMARY KEY (stage, bundle)
+                )
+            """)
+        return self._connection
+
+    @staticmethod
+    def fingerprint(inputs):
+        """Calculate the fingerprint of inputs
+
+        Args:
+            inputs: A JSON-serializable object with all inputs of a bundle
+                (e.g. the results of :func:`file_stats` and configuration
+                values).
+
+        Returns:
+            A tuple of the fingerprint (a hex string) and the inputs as JSON.
+        """
+        text = json.dumps(inputs, sort_keys=True, default=str)
+        return hashlib.sha1(text.encode()).hexdigest(), text
+
+    def is_done(self, stage, bundle, inputs):
+        """Check whether a bundle is up-to-date
+
+        Args:
+            stage: The name of the processing stage (e.g. *convert*).
+            bundle: The name of the bundle (e.g. instrument and start time).
+            inputs: The inputs of this bundle (see :meth:`fingerprint`).
+
+        Returns:
+            True if the bundle has been processed with the same inputs and
+            its output still exists.
+        """
+        row = self.connection.execute(
+            "SELECT fingerprint, output FROM bundles WHERE stage=? AND bundle=?",
+            (stage, bundle)
+        ).fetchone()
+        if row is None:
+            return False
+
+        fingerprint, output = row
+        return fingerprint == self.fingerprint(inputs)[0] \
+            and (output is None or os.path.exists(output))
+
+    def record(self, stage, bundle, inputs, output=None):
+        """Record that a bundle has been processed
+
+        Args:
+            stage: The name of the processing stage (e.g. *convert*).
+            bundle: The name of the bundle (e.g. instrument and start time).
+            inputs: The inputs of this bundle (see :meth:`fingerprint`).
+            output: The path of the written output.
+
+        Returns:
+            None
+        """
+        fingerprint, text = self.fingerprint(inputs)
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO bundles VALUES (?, ?, ?, ?, ?, ?)",
+                (stage, bundle, fingerprint, text, output,
+                 datetime.now().isoformat())
+            )
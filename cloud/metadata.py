@@ -1,5 +1,12 @@
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
 import pandas as pd
 from typhon.files import CSV, expects_file_info
+import xarray as xr
 
 __all__ = [
     "ShipMSM",
@@ -12,18 +19,40 @@ class ShipMSM(CSV):
     Merian in CSV format.
     """
 
-    def __init__(self):
+    def __init__(self, cache_dir=None):
+        """Initialize a ShipMSM object.
+
+        Args:
+            cache_dir: Parsing a DShip file of a whole cruise takes long. If
+                this is set to a directory, the parsed (renamed and filtered)
+                data is saved there as one binary file per field. Further
+                reads load only the requested fields and time period from
+                those files. The cache is rebuilt when the DShip file changes.
+                Without a cache directory, the data of the last parsed file
+                is kept in memory as long as the file does not change.
+        """
         # Call the base class initializer
         super(ShipMSM, self).__init__()
 
+        self.cache_dir = cache_dir
+        self._parsed = {}
+
+    def __getstate__(self):
+        # Do not pass the parsed data to other processes:
+        state = self.__dict__.copy()
+        state["_parsed"] = {}
+        return state
+
     @expects_file_info()
-    def read(self, filename, fields=None, **read_csv):
+    def read(self, filename, fields=None, start=None, end=None, **read_csv):
         """Read a file in CSV format coming from DShip of RV Maria S. Merian.
 
         Args:
             filename: Path and name of file or FileInfo object.
             fields: Field that you want to extract from the file. If not given,
                 all fields are going to be extracted.
+            start: Only read the data from this time on (including).
+            end: Only read the data until this time (including).
             **read_csv: Additional keyword arguments for the pandas function
                 `pandas.read_csv`. See for more details:
                 https://pandas.pydata.org/pandas-docs/stable/generated/pandas.read_csv.html
@@ -31,6 +60,36 @@ class ShipMSM(CSV):
         Returns:
             A xarray.Dataset object.
         """
+        if self.cache_dir is not None:
+            try:
+                return self._read_cache(filename, fields, start, end)
+            except Exception:
+                logging.warning(
+                    "Could not use the cache of '%s', read it directly:"
+                    % filename.path, exc_info=True
+                )
+
+        data = self._parse_in_memory(filename)
+
+        if fields is not None:
+            data = data[fields]
+
+        return data.sel(time=slice(start, end))
+
+    def _parse_in_memory(self, filename):
+        """Parse a file or take its data from the last call if unchanged"""
+        stat = os.stat(filename.path)
+        key = stat.st_size, stat.st_mtime_ns
+
+        if filename.path not in self._parsed \
+                or self._parsed[filename.path][0] != key:
+            # Keep only the last file in memory:
+            self._parsed = {filename.path: (key, self._parse(filename))}
+
+        return self._parsed[filename.path][1]
+
+    def _parse(self, filename):
+        """Parse the whole file and apply the renaming and filtering"""
         read_csv = {
            "delimiter": "\t",
            # This should be the column where the date time string is,
@@ -57,11 +116,91 @@ class ShipMSM(CSV):
         data = data.isel(
             time=(data.air_temperature < 99) & (data.air_pressure > 500))
 
-        if fields is not None:
-            data = data[fields]
-
         return data.sortby("time")
 
+    def _get_cache(self, filename):
+        """Get the cache directory of a file (and build it if necessary)
+
+        Args:
+            filename: A FileInfo object.
+
+        Returns:
+            A tuple of the cache directory and its description (a dictionary
+            with the size and modification time of the original file and the
+            file names of the fields).
+        """
+        stat = os.stat(filename.path)
+        cache = os.path.join(
+            self.cache_dir, os.path.basename(filename.path) + ".cache"
+        )
+
+        try:
+            with open(os.path.join(cache, "description.json")) as file:
+                description = json.load(file)
+            if description["size"] == stat.st_size \
+                    and description["mtime"] == stat.st_mtime_ns:
+                return cache, description
+        except (OSError, ValueError, KeyError):
+            pass
+
+        logging.info("Build the cache of %s" % filename.path)
+        data = self._parse(filename)
+
+        # Write everything to a temporary directory first, so no one reads an
+        # incomplete cache:
+        tmpdir = "%s.%d" % (cache, os.getpid())
+        os.makedirs(tmpdir, exist_ok=True)
+        description = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "fields": {},
+        }
+        np.save(
+            os.path.join(tmpdir, "time.npy"),
+            data["time"].values.astype("M8[ns]")
+        )
+        for i, field in enumerate(data.data_vars):
+            column = "field%d.npy" % i
+            np.save(os.path.join(tmpdir, column), data[field].values)
+            description["fields"][field] = column
+
+        with open(os.path.join(tmpdir, "description.json"), "w") as file:
+            json.dump(description, file)
+
+        shutil.rmtree(cache, ignore_errors=True)
+        os.rename(tmpdir, cache)
+
+        return cache, description
+
+    def _read_cache(self, filename, fields, start, end):
+        """Read fields from the cache of a file
+
+        The time column is sorted, hence the requested time period is found
+        via binary search. Only this period is loaded from the fields.
+        """
+        cache, description = self._get_cache(filename)
+
+        time = np.load(os.path.join(cache, "time.npy"), mmap_mode="r")
+        first = 0 if start is None else np.searchsorted(
+            time, np.datetime64(pd.Timestamp(start)), side="left")
+        last = len(time) if end is None else np.searchsorted(
+            time, np.datetime64(pd.Timestamp(end)), side="right")
+
+        if fields is None:
+            fields = list(description["fields"])
+
+        data = xr.Dataset(coords={"time": np.array(time[first:last])})
+        for field in fields:
+            path = os.path.join(cache, description["fields"][field])
+            try:
+                column = np.load(path, mmap_mode="r")
+            except ValueError:
+                # Text columns cannot be memory-mapped:
+                column = np.load(path, allow_pickle=True)
+            data[field] = "time", np.array(column[first:last])
+
+        return data
+
 
 # This is an example how to create another file reader:
 class ShipPS(CSV):
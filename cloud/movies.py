@@ -5,7 +5,7 @@ Every thermal camera image will be converted to a ThermalCamMovie object by the
 file handlers of Pinocchio or Dumbo.
 """
 
-from collections import defaultdict
+import threading
 import warnings
 
 import numpy as np
@@ -14,10 +14,600 @@ import xarray as xr
 
 
 __all__ = [
+    "clip_to_encoding",
+    "histogram_cloud_parameters",
+    "histogram_statistics",
     "Movie",
+    "MovieBuilder",
+    "PixelSample",
+    "sweep_statistics",
+    "temperature_histograms",
     "ThermalCamMovie",
 ]
 
+# The level statistics are calculated on chunks of frames with roughly this
+# number of pixels. This keeps the temporary arrays small (and in the cache)
+# instead of allocating copies of the whole movie:
+KERNEL_CHUNK_PIXELS = 2 ** 20
+
+# The integer types for compact movie files: the minimum and maximum valid
+# value and the fill value for NaN (masked) pixels.
+INTEGER_ENCODINGS = {
+    "int16": (-32767, 32767, -32768),
+    "uint8": (0, 254, 255),
+}
+
+# The quantile of the normal distribution for the confidence intervals of the
+# approximate statistics (1.96 for 95%):
+CONFIDENCE_Z = 1.96
+
+# The name of the temperature histograms in the cloud statistics:
+HISTOGRAM = "temperature_histogram"
+
+# The attributes of the cloud statistics:
+# TODO: The cloud inhomogeneity does not seem to work right now, it has some
+# TODO: broadcasting issues. Hence, it is not calculated.
+CLOUD_PARAMETERS = {
+    "cloud_coverage": {
+        "description": "cloud coverage",
+        "units": "coverage [0-1]",
+    },
+    "cloud_mean_temperature": {
+        "description": "cloud mean temperature",
+        "units": "temperature [°C]",
+    },
+    "cloud_max_temperature": {
+        "description": "cloud max. temperature",
+        "units": "temperature [°C]",
+    },
+    "cloud_min_temperature": {
+        "description": "cloud min. temperature",
+        "units": "temperature [°C]",
+    },
+}
+
+
+def _reduce_levels(pixels, thresholds, squares=False, edges=False):
+    """Classify each pixel to its height level and reduce them per level.
+
+    Args:
+        pixels: See :func:`level_statistics`.
+        thresholds: See :func:`level_statistics`.
+        squares: If true, the sums of the squared pixels are gathered as
+            well.
+        edges: If true, the pixels that lie exactly on a threshold are
+            gathered as well (as additional levels after the normal ones).
+
+    Returns:
+        A dictionary with the numpy.arrays *counts*, *sums*, *minimums* and
+        *maximums* (and *squares*) of the pixels in each level, each with the
+        shape (time, level) or (time, 2*level) with *edges*. Empty levels
+        have the minimum inf and the maximum -inf. *valid* is the number of
+        valid pixels with the shape (time, 1).
+    """
+    n_times = pixels.shape[0]
+    pixels = pixels.reshape(n_times, -1)
+    thresholds = np.asarray(thresholds, dtype=float).reshape(n_times, -1)
+    n_levels = thresholds.shape[1]
+
+    # Each pixel gets a label: the height level (0 to n_levels-1), clear sky
+    # (n_levels) or invalid (n_levels+1). With *edges*, the pixels on a
+    # threshold get their own labels after these ones.
+    clear, invalid = n_levels, n_levels + 1
+    n_bins = n_levels + 2
+    n_reduced = n_levels
+    if edges:
+        n_bins += n_levels
+        n_reduced += n_levels
+
+    reduced = {
+        "counts": np.zeros(n_times * n_bins, dtype=int),
+        "sums": np.zeros(n_times * n_bins),
+        "minimums": np.full(n_times * n_bins, np.inf),
+        "maximums": np.full(n_times * n_bins, -np.inf),
+    }
+    if squares:
+        reduced["squares"] = np.zeros(n_times * n_bins)
+
+    chunk_size = max(1, KERNEL_CHUNK_PIXELS // max(1, pixels.shape[1]))
+    for start in range(0, n_times, chunk_size):
+        chunk = pixels[start:start+chunk_size]
+        limits = thresholds[start:start+chunk_size]
+
+        labels = np.full(chunk.shape, clear, dtype=np.min_scalar_type(n_bins))
+        labels[np.isnan(chunk)] = invalid
+        for level in range(n_levels):
+            in_level = chunk > limits[:, level, None]
+            if level > 0:
+                in_level &= chunk < limits[:, level-1, None]
+            in_level &= labels == clear
+            labels[in_level] = level
+            if edges:
+                on_edge = chunk == limits[:, level, None]
+                on_edge &= labels == clear
+                labels[on_edge] = invalid + 1 + level
+
+        # One bin for each frame and label:
+        keys = labels + n_bins * np.arange(
+            start, start+len(chunk))[:, None]
+        keys = keys.ravel()
+        values = chunk.ravel()
+
+        reduced["counts"] += np.bincount(keys, minlength=n_times * n_bins)
+        reduced["sums"] += np.bincount(
+            keys, weights=values, minlength=n_times * n_bins)
+        # ufunc.at is slow, hence the minimums and maximums are gathered only
+        # for the cloud pixels (this skips the NaN of the invalid ones, too):
+        clouds = labels.ravel()
+        clouds = (clouds != clear) & (clouds != invalid)
+        np.minimum.at(reduced["minimums"], keys[clouds], values[clouds])
+        np.maximum.at(reduced["maximums"], keys[clouds], values[clouds])
+        if squares:
+            reduced["squares"] += np.bincount(
+                keys, weights=values**2, minlength=n_times * n_bins)
+
+    for name, values in reduced.items():
+        values = values.reshape(n_times, n_bins)
+        reduced[name] = np.concatenate(
+            [values[:, :n_levels], values[:, invalid+1:]], axis=1)
+        if name == "counts":
+            valid = values.sum(axis=1)[:, None] - values[:, invalid, None]
+    reduced["valid"] = valid
+
+    return reduced
+
+
+def _temperature_type(pixels):
+    """Get the type of the temperature statistics of pixels
+
+    Like numpy.nanmean, the temperatures keep the type of float pixels.
+    """
+    if np.issubdtype(pixels.dtype, np.floating):
+        return pixels.dtype
+    return np.dtype(np.float64)
+
+
+def _level_results(reduced, sample_fraction=None, dtype=np.float64):
+    """Calculate the cloud statistics from the reduced pixels of each level
+
+    Args:
+        reduced: A dictionary from :func:`_reduce_levels`.
+        sample_fraction: See :func:`level_statistics`.
+        dtype: The type of the temperatures (see :func:`_temperature_type`).
+            The pixels are summed up in float64 in any case.
+
+    Returns:
+        A dictionary like :func:`level_statistics`.
+    """
+    clouds = reduced["counts"]
+    no_clouds = clouds == 0
+    sums = reduced["sums"]
+    valid = reduced["valid"]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        coverage = clouds / valid
+        mean = sums / clouds
+
+    minimums = reduced["minimums"].copy()
+    maximums = reduced["maximums"].copy()
+    mean[no_clouds] = np.nan
+    minimums[no_clouds] = np.nan
+    maximums[no_clouds] = np.nan
+
+    results = {
+        "cloud_coverage": coverage,
+        "cloud_mean_temperature": mean,
+        "cloud_min_temperature": minimums,
+        "cloud_max_temperature": maximums,
+    }
+
+    if sample_fraction is not None:
+        # The sample is drawn without replacement, hence the finite
+        # population correction:
+        correction = 1 - min(sample_fraction, 1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            variance = (reduced["squares"] - sums * mean) / (clouds - 1)
+            results["cloud_coverage_error"] = CONFIDENCE_Z * np.sqrt(
+                coverage * (1 - coverage) / valid * correction)
+            results["cloud_mean_temperature_error"] = CONFIDENCE_Z * np.sqrt(
+                np.clip(variance, 0, None) / clouds * correction)
+        results["cloud_mean_temperature_error"][clouds < 2] = np.nan
+
+    for parameter, values in results.items():
+        if "temperature" in parameter:
+            results[parameter] = values.astype(dtype, copy=False)
+
+    return results
+
+
+def level_statistics(pixels, thresholds, sample_fraction=None):
+    """Calculate the cloud statistics for all height levels in one pass.
+
+    Each pixel is classified once to its height level. Afterwards, the number,
+    sum, minimum and maximum of the pixels per frame and level are gathered at
+    once. No masked copies of the whole movie are created.
+
+    Args:
+        pixels: A numpy.array with the shape (time, ...), e.g. (time, height,
+            width). Invalid (masked) pixels must be NaN.
+        thresholds: A numpy.array with the shape (time, level) containing the
+            lower temperature boundary of each level. The upper boundary of a
+            level is the lower boundary of the previous level (the first level
+            has no upper boundary). Pixels on a boundary are not counted.
+        sample_fraction: If the pixels are a random sample of all valid
+            pixels (see :class:`PixelSample`), this is the sampled fraction
+            (0-1). Then, also the half widths of the confidence intervals of
+            the coverage and mean temperature are returned.
+
+    Returns:
+        A dictionary with the numpy.arrays *cloud_coverage*,
+        *cloud_mean_temperature*, *cloud_min_temperature* and
+        *cloud_max_temperature*, each with the shape (time, level). Levels
+        without any cloud pixel get NaN as temperature. The temperatures have
+        the type of the pixels (if they are floats). If *sample_fraction* is
+        given, it contains also *cloud_coverage_error* and
+        *cloud_mean_temperature_error*.
+    """
+    return _level_results(
+        _reduce_levels(pixels, thresholds, sample_fraction is not None),
+        sample_fraction, _temperature_type(pixels)
+    )
+
+
+def sweep_statistics(pixels, surface, levels, sample_fraction=None):
+    """Calculate the cloud statistics for several level configurations.
+
+    All configurations are evaluated in one pass over the pixels: the pixels
+    are classified into the intervals between all distinct thresholds of all
+    configurations. The levels of each configuration are then joined from
+    these intervals (numbers and sums are added, minimums and maximums
+    combined).
+
+    Args:
+        pixels: See :func:`level_statistics`.
+        surface: A numpy.array with the shape (time, ) containing the surface
+            temperature of each frame.
+        levels: A numpy.array with the shape (config, level) containing the
+            lower boundary of each level relative to the surface temperature
+            (the levels of a configuration must be sorted in descending
+            order).
+        sample_fraction: See :func:`level_statistics`.
+
+    Returns:
+        A dictionary like :func:`level_statistics` but with numpy.arrays of
+        the shape (time, config, level).
+    """
+    levels = np.asarray(levels, dtype=float)
+    n_configs, n_levels = levels.shape
+    if np.any(np.diff(levels, axis=1) >= 0):
+        raise ValueError("The levels of each configuration must be sorted in "
+                         "descending order!")
+
+    # The distinct thresholds in descending order. Interval i lies between
+    # threshold i and the previous one (interval 0 has no upper boundary):
+    boundaries = np.unique(levels)[::-1]
+    upper_boundaries = np.concatenate([[np.inf], boundaries[:-1]])
+    lowers = levels.reshape(-1, 1)
+    uppers = np.concatenate(
+        [np.full((n_configs, 1), np.inf), levels[:, :-1]], axis=1
+    ).reshape(-1, 1)
+    # Which intervals make up each level of each configuration (and which
+    # thresholds of other configurations lie inside the level):
+    joins = np.concatenate([
+        (boundaries >= lowers) & (upper_boundaries <= uppers),
+        (boundaries > lowers) & (boundaries < uppers),
+    ], axis=1)
+
+    reduced = _reduce_levels(
+        pixels,
+        np.asarray(surface, dtype=float)[:, None] + boundaries[None, :],
+        sample_fraction is not None, edges=True,
+    )
+    for name in ("counts", "sums", "squares"):
+        if name in reduced:
+            reduced[name] = reduced[name] @ joins.T
+    reduced["minimums"] = np.where(
+        joins, reduced["minimums"][:, None, :], np.inf).min(axis=2)
+    reduced["maximums"] = np.where(
+        joins, reduced["maximums"][:, None, :], -np.inf).max(axis=2)
+
+    results = _level_results(
+        reduced, sample_fraction, _temperature_type(pixels))
+    return {
+        name: values.reshape(-1, n_configs, n_levels)
+        for name, values in results.items()
+    }
+
+
+def clip_to_encoding(data):
+    """Clip the images of a movie to the range of their integer encoding.
+
+    Values outside of this range would overflow when saving the movie. The
+    images are copied only if they contain such values, the original dataset
+    is never changed (so the cloud statistics can still be calculated from
+    it).
+
+    Args:
+        data: A xarray.Dataset with the movie (see
+            :meth:`Movie.set_encoding`).
+
+    Returns:
+        The dataset itself or a shallow copy with clipped images.
+    """
+    images = data["images"]
+    if images.encoding.get("dtype") not in INTEGER_ENCODINGS:
+        return data
+
+    first, last, _ = INTEGER_ENCODINGS[images.encoding["dtype"]]
+    scale_factor = float(images.encoding["scale_factor"])
+    add_offset = float(images.encoding["add_offset"])
+    minimum = add_offset + first * scale_factor
+    maximum = add_offset + last * scale_factor
+    if not images.size or (np.nanmin(images.values) >= minimum
+                           and np.nanmax(images.values) <= maximum):
+        return data
+
+    clipped = data.copy()
+    clipped["images"] = images.copy(
+        data=np.clip(images.values, minimum, maximum))
+    clipped["images"].encoding = images.encoding.copy()
+    return clipped
+
+
+def temperature_histograms(pixels, bins):
+    """Count the pixels of each frame in fixed-width temperature bins.
+
+    Args:
+        pixels: A numpy.array with the shape (time, ...), e.g. (time, height,
+            width). Invalid (masked) pixels must be NaN and are not counted.
+        bins: A tuple of the lower edge of the first bin, the upper edge of
+            the last bin and the width of the bins (all in °C). Pixels below
+            or above are counted in two additional bins (underflow and
+            overflow).
+
+    Returns:
+        A numpy.array with the shape (time, bin) containing the number of
+        pixels in each bin. The first and last column are the underflow and
+        overflow bin.
+    """
+    first_edge, last_edge, width = bins
+    # With the underflow and overflow bin:
+    n_bins = _histogram_size(bins) + 2
+    n_times = pixels.shape[0]
+    pixels = pixels.reshape(n_times, -1)
+
+    counts = np.zeros(n_times * n_bins, dtype=np.int64)
+    chunk_size = max(1, KERNEL_CHUNK_PIXELS // max(1, pixels.shape[1]))
+    for start in range(0, n_times, chunk_size):
+        chunk = pixels[start:start+chunk_size]
+        valid = ~np.isnan(chunk)
+
+        # One bin for each frame and temperature bin (the infinite ones land
+        # in the underflow or overflow bin as well):
+        indices = np.clip(
+            np.floor((chunk[valid] - first_edge) / width) + 1, 0, n_bins - 1
+        ).astype(int)
+        frames = np.broadcast_to(
+            np.arange(start, start+len(chunk))[:, None], chunk.shape)[valid]
+        counts += np.bincount(
+            indices + n_bins * frames, minlength=counts.size)
+
+    return counts.reshape(n_times, n_bins).astype(np.int32)
+
+
+def _histogram_size(bins):
+    """Get the number of bins without the underflow and overflow bin"""
+    first_edge, last_edge, width = bins
+    return int(np.ceil((last_edge - first_edge) / width))
+
+
+def histogram_statistics(histograms, bins, thresholds):
+    """Approximate the cloud statistics of all height levels from histograms.
+
+    The pixels are assumed to be spread evenly within each temperature bin.
+    A bin that is cut by a level boundary contributes only with the part of
+    its pixels that lies inside the level. The minimum and maximum are the
+    centres of these parts of the outermost bins of a level, hence they are
+    at most half a bin width away from the true values.
+
+    The pixels of the underflow (overflow) bin are counted in the level of
+    the lower (upper) edge of the bins. Since their temperatures are unknown,
+    the mean and minimum (maximum) temperature of this level are NaN.
+
+    Args:
+        histograms: A numpy.array with the shape (time, bin) from
+            :func:`temperature_histograms`.
+        bins: The bins of the histograms (see :func:`temperature_histograms`).
+        thresholds: A numpy.array with the shape (time, level) containing the
+            lower temperature boundary of each level (see
+            :func:`level_statistics`).
+
+    Returns:
+        A dictionary with the same numpy.arrays as :func:`level_statistics`.
+    """
+    first_edge, _, width = bins
+    n_bins = _histogram_size(bins)
+    histograms = np.asarray(histograms, dtype=float)
+    n_times = histograms.shape[0]
+    underflow, overflow = histograms[:, 0], histograms[:, -1]
+    histograms = histograms[:, 1:-1]
+    thresholds = np.asarray(thresholds, dtype=float).reshape(n_times, -1)
+    n_levels = thresholds.shape[1]
+
+    lower_edges = first_edge + width * np.arange(n_bins)
+    upper_edges = lower_edges + width
+    # The upper boundary of each level (the first level has none):
+    uppers = np.concatenate(
+        [np.full((n_times, 1), np.inf), thresholds[:, :-1]], axis=1)
+    valid = histograms.sum(axis=1) + underflow + overflow
+
+    # The pixels outside of the bins with the shape (time, level):
+    underflows = np.where(
+        (thresholds < lower_edges[0]) & (lower_edges[0] <= uppers),
+        underflow[:, None], 0)
+    overflows = np.where(
+        (thresholds <= upper_edges[-1]) & (upper_edges[-1] < uppers),
+        overflow[:, None], 0)
+
+    results = {
+        parameter: np.full((n_times, n_levels), np.nan)
+        for parameter in CLOUD_PARAMETERS
+    }
+
+    chunk_size = max(1, KERNEL_CHUNK_PIXELS // max(1, n_levels * n_bins))
+    for start in range(0, n_times, chunk_size):
+        frames = slice(start, start+chunk_size)
+
+        # The part of each bin that lies inside each level with the shape
+        # (time, level, bin):
+        lower = np.maximum(lower_edges, thresholds[frames, :, None])
+        upper = np.minimum(upper_edges, uppers[frames, :, None])
+        counts = np.clip(upper - lower, 0, None) / width \
+            * histograms[frames, None, :]
+        centres = (lower + upper) / 2
+
+        clouds = counts.sum(axis=2)
+        in_level = counts > 0
+        first_bin = in_level.argmax(axis=2)[..., None]
+        last_bin = n_bins - 1 - in_level[..., ::-1].argmax(axis=2)[..., None]
+        no_clouds = clouds == 0
+        below = underflows[frames] > 0
+        above = overflows[frames] > 0
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            coverage = (clouds + underflows[frames] + overflows[frames]) \
+                / valid[frames, None]
+            mean = (counts * centres).sum(axis=2) / clouds
+        minimums = np.take_along_axis(centres, first_bin, axis=2)[..., 0]
+        maximums = np.take_along_axis(centres, last_bin, axis=2)[..., 0]
+        mean[no_clouds | below | above] = np.nan
+        minimums[no_clouds | below] = np.nan
+        maximums[no_clouds | above] = np.nan
+
+        results["cloud_coverage"][frames] = coverage
+        results["cloud_mean_temperature"][frames] = mean
+        results["cloud_min_temperature"][frames] = minimums
+        results["cloud_max_temperature"][frames] = maximums
+
+    return results
+
+
+def _level_thresholds(temperatures, time, levels):
+    """Get the lower temperature boundary of each level for each image"""
+    return np.asarray(temperatures(time))[:, np.newaxis] \
+        + np.asarray(levels, dtype=float)[np.newaxis, :]
+
+
+def _statistics_dataset(time, results, parameters, dims=("time", "level")):
+    """Create a xarray.Dataset with all parameters from the results"""
+    cloud_stats = xr.Dataset()
+    cloud_stats["time"] = time
+    for parameter, attrs in parameters.items():
+        cloud_stats[parameter] = xr.DataArray(
+            results[parameter], attrs=attrs, dims=list(dims),
+        )
+    return cloud_stats
+
+
+def histogram_cloud_parameters(data, temperatures, levels):
+    """Calculate cloud parameters from temperature histograms only.
+
+    Instead of reading the movies again, the cloud statistics for other
+    surface temperatures or level thresholds are approximated from the
+    temperature histograms that were saved with the statistics (see
+    :meth:`ThermalCamMovie.cloud_parameters` and
+    :func:`histogram_statistics`).
+
+    Args:
+        data: A xarray.Dataset with the variable *temperature_histogram*.
+        temperatures: Temperature of the clear sky (see
+            :meth:`ThermalCamMovie.cloud_parameters`).
+        levels: A list of different temperature thresholds.
+
+    Returns:
+        A xarray.Dataset like :meth:`ThermalCamMovie.cloud_parameters`.
+    """
+    histograms = data[HISTOGRAM]
+    bins = tuple(
+        float(histograms.attrs[key])
+        for key in ("bin_start", "bin_end", "bin_width")
+    )
+
+    results = histogram_statistics(
+        histograms.values, bins,
+        _level_thresholds(temperatures, data["time"], levels)
+    )
+    return _statistics_dataset(data["time"], results, CLOUD_PARAMETERS)
+
+
+class PixelSample:
+    """A fixed stratified random sample of the valid pixels of a mask.
+
+    The statistics of a movie can be approximated by looking only at a sample
+    of its pixels (see :meth:`ThermalCamMovie.cloud_parameters`). The image
+    is divided into *grid* x *grid* blocks and the same fraction of valid
+    pixels is drawn from each block, so the sample covers the whole sky
+    evenly. The sample depends only on the mask, the fraction and the seed,
+    hence it can be drawn once and used for all movies with this mask.
+    """
+
+    def __init__(self, mask, fraction, grid=16, seed=0):
+        """Draw a sample from a mask.
+
+        Args:
+            mask: A numpy.array of boolean values with the shape (height,
+                width). Only pixels where this mask is true are drawn.
+            fraction: The fraction of the valid pixels that is drawn (0-1).
+                Each block with valid pixels gets at least one.
+            grid: The number of blocks along each axis.
+            seed: The seed of the random generator.
+        """
+        mask = np.asarray(mask, dtype=bool)
+        self.shape = mask.shape
+        self.fraction = fraction
+
+        height, width = mask.shape
+        rows, columns = np.nonzero(mask)
+        blocks = rows * grid // height * grid + columns * grid // width
+        valid = rows * width + columns
+
+        random = np.random.RandomState(seed)
+        indices = []
+        for block in np.unique(blocks):
+            pixels = valid[blocks == block]
+            size = max(1, int(round(fraction * len(pixels))))
+            indices.append(random.choice(pixels, size, replace=False))
+
+        #: The flat indices (row * width + column) of the drawn pixels
+        self.indices = np.sort(np.concatenate(indices)) if indices \
+            else np.zeros(0, dtype=int)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def take(self, images):
+        """Get the drawn pixels from images
+
+        Args:
+            images: A xarray.DataArray with the shape (time, height, width)
+                or a packed one with the shape (time, pixel) (see
+                :meth:`Movie.pack`). Packed images must contain all drawn
+                pixels, i.e. must have been packed with the same mask.
+
+        Returns:
+            A numpy.array with the shape (time, number of drawn pixels).
+        """
+        if "pixel" in images.dims:
+            # The packed pixels are ordered row by row like the indices:
+            positions = np.searchsorted(
+                images["row"].values * self.shape[1]
+                + images["column"].values,
+                self.indices
+            )
+            return images.values[:, positions]
+
+        return images.values.reshape(len(images), -1)[:, self.indices]
+
 
 class Movie:
     """A movie is a sequence of images and their timestamps.
@@ -25,21 +615,143 @@ class Movie:
     def __init__(self, data):
         self.data = data
 
-    def apply_mask(self, mask):
+    def apply_mask(self, mask, packed=False):
         """ Applies a mask on this movie.
 
         Args:
             mask: A numpy.array of boolean values. Where this mask
                 is false the pixels of the image will be covered (i.e. replaced
                 with NaN).
+            packed: If true, the covered pixels are not kept at all but the
+                movie is packed (see :meth:`pack`).
 
         Returns:
             None
         """
 
+        if packed:
+            self.pack(mask)
+            return
+
         mask = xr.DataArray(mask, dims=("height", "width"))
         self.data["images"] = self.data["images"].where(mask)
 
+    @property
+    def is_packed(self):
+        """True if the images are stored as (time, pixel) array"""
+        return "pixel" in self.data["images"].dims
+
+    def pack(self, mask):
+        """Keep only the pixels of the images that lie inside a mask.
+
+        The images are stored afterwards as (time, pixel) array. The position
+        of each pixel in the original images is kept in the coordinates *row*
+        and *column*, the original image size in the attributes *height* and
+        *width*. All cloud statistics can be calculated on packed movies
+        directly; use :meth:`unpack` to get the full images back.
+
+        Args:
+            mask: A numpy.array of boolean values with the shape (height,
+                width). Only the pixels where this mask is true are kept.
+
+        Returns:
+            None
+        """
+        if self.is_packed:
+            raise ValueError("This movie is already packed!")
+
+        images = self.data["images"]
+        height, width = images.shape[1:]
+        rows, columns = np.nonzero(np.asarray(mask, dtype=bool))
+
+        attrs = dict(images.attrs)
+        attrs.update(height=height, width=width)
+
+        del self.data["images"]
+        self.data["images"] = xr.DataArray(
+            images.values[:, rows, columns], dims=("time", "pixel"),
+            coords={
+                "time": images["time"],
+                "row": ("pixel", rows),
+                "column": ("pixel", columns),
+            },
+            attrs=attrs,
+        )
+
+    def unpack(self):
+        """Expand a packed movie to full images again.
+
+        Pixels that were outside the mask become NaN.
+
+        Returns:
+            None
+        """
+        if not self.is_packed:
+            return
+
+        images = self.data["images"]
+        attrs = dict(images.attrs)
+        shape = (len(images), attrs.pop("height"), attrs.pop("width"))
+
+        full = np.full(shape, np.nan, dtype=np.promote_types(
+            images.dtype, np.float32))
+        full[:, images["row"].values, images["column"].values] = images.values
+
+        del self.data["images"]
+        del self.data["row"]
+        del self.data["column"]
+        self.data["images"] = xr.DataArray(
+            full, dims=("time", "height", "width"),
+            coords={"time": images["time"]}, attrs=attrs,
+        )
+
+    def set_encoding(self, dtype=None, valid_range=None, complevel=4):
+        """Set how the images are encoded when saving them to a netCDF file.
+
+        The images are compressed with zlib (and shuffle) in chunks of single
+        frames. Integer types store the images with a scale factor and an
+        offset, masked pixels get a fill value.
+
+        Args:
+            dtype: Either None (keep the type of the images), *float32*,
+                *int16* or *uint8*.
+            valid_range: A tuple of the minimum and maximum value that should
+                be stored. Needed for integer types; all values outside of
+                this range are clipped when saving the movie (see
+                :func:`clip_to_encoding`, the images in memory are not
+                changed). The precision is then (max - min) / 65534 for int16
+                and (max - min) / 254 for uint8.
+            complevel: The level of the zlib compression (0 means no
+                compression).
+
+        Returns:
+            None
+        """
+        images = self.data["images"]
+        encoding = {
+            "chunksizes": (1,) + images.shape[1:],
+        }
+        if complevel:
+            encoding.update(zlib=True, shuffle=True, complevel=complevel)
+
+        if dtype in INTEGER_ENCODINGS:
+            if valid_range is None:
+                raise ValueError(
+                    "The encoding %s needs a valid range!" % dtype)
+            minimum, maximum = map(float, valid_range)
+            first, last, fill_value = INTEGER_ENCODINGS[dtype]
+            scale_factor = (maximum - minimum) / (last - first)
+            # The images are decoded to the type of the scale factor:
+            encoding.update(
+                dtype=dtype, _FillValue=fill_value,
+                scale_factor=np.float32(scale_factor),
+                add_offset=np.float32(minimum - first * scale_factor),
+            )
+        elif dtype is not None:
+            encoding["dtype"] = dtype
+
+        images.encoding.update(encoding)
+
     @staticmethod
     def count_edges(array):
         v_edges = np.nansum(Movie.edge_mask(array, "v"), axis=(1, 2))
@@ -87,6 +799,8 @@ class Movie:
 
     @property
     def height(self):
+        if self.is_packed:
+            return self.data["images"].attrs["height"]
         return self.data["images"].shape[1]
 
     # def to_gray_scale(self):
@@ -119,9 +833,170 @@ class Movie:
 
     @property
     def width(self):
+        if self.is_packed:
+            return self.data["images"].attrs["width"]
         return self.data["images"].shape[0]
 
 
+class MovieBuilder:
+    """Join single frames to a movie without creating a Dataset per frame.
+
+    The buffer for all frames is allocated once when the first frame is
+    reserved. The file handlers decode each frame directly into its slot (see
+    :meth:`reserve` and :meth:`append`). Several threads can decode frames
+    at the same time, each into its own slot (see :meth:`slot`). A mask is
+    applied in place when building the movie.
+
+    Examples:
+
+    .. code-block:: python
+
+        builder = MovieBuilder(len(files))
+        for file in files:
+            handler.read_frame(file, builder)
+        movie = builder.build(mask)
+    """
+
+    def __init__(self, n_frames):
+        """Initialize a MovieBuilder object.
+
+        Args:
+            n_frames: The maximum number of frames of the movie.
+        """
+        self.n_frames = n_frames
+        self.images = None
+        self.times = []
+        self._allocation = threading.Lock()
+
+    def __len__(self):
+        return len(self.times)
+
+    def reserve(self, shape, dtype=np.float32, index=None):
+        """Get the slot for the next frame.
+
+        The slot is only used after calling :meth:`append`. Otherwise (e.g.
+        if the decoding has failed), the next call returns the same slot.
+
+        Args:
+            shape: The shape of the frame.
+            dtype: The data type of the frame.
+            index: The index of the slot. Default is the next free slot.
+
+        Returns:
+            A numpy.array (a view on the buffer) where the frame should be
+            written to.
+        """
+        shape = tuple(shape)
+        if index is None:
+            index = len(self)
+
+        # Threads that decode into slots (see slot()) must not allocate the
+        # buffer twice:
+        with self._allocation:
+            if self.images is None:
+                self.images = np.empty((self.n_frames,) + shape, dtype=dtype)
+
+        if self.images.shape[1:] != shape:
+            raise ValueError(
+                "The frame has the shape %s but the movie %s!" % (
+                    shape, self.images.shape[1:]))
+        elif index >= self.n_frames:
+            raise ValueError(
+                "The movie is full (%d frames)!" % self.n_frames)
+
+        return self.images[index]
+
+    def append(self, time, index=None):
+        """Add the frame in the last reserved slot to the movie.
+
+        Args:
+            time: The timestamp of the frame.
+            index: The index of the slot if the frame has been decoded into
+                a slot from :meth:`slot`. The frames must be appended in the
+                order of their slots. If frames before have failed, the frame
+                is moved to the next free slot.
+
+        Returns:
+            None
+        """
+        if index is not None and index != len(self):
+            self.images[len(self)] = self.images[index]
+        self.times.append(time)
+
+    def slot(self, index):
+        """Get a fixed slot of the movie to decode a frame into it.
+
+        This is useful if the frames are decoded in other threads: each gets
+        its own slot (e.g. the next slots in the order of the files) and the
+        frames are appended with :meth:`append` afterwards.
+
+        Args:
+            index: The index of the slot (not smaller than the number of
+                appended frames).
+
+        Returns:
+            A FrameSlot object that can be passed to the file handlers
+            instead of the builder.
+        """
+        return FrameSlot(self, index)
+
+    def build(self, mask=None, packed=False):
+        """Build the movie from all appended frames.
+
+        The frames are sorted by their time. After calling this, the builder
+        should not be used any longer since the movie shares its buffer.
+
+        Args:
+            mask: A numpy.array of boolean values (see
+                :meth:`Movie.apply_mask`).
+            packed: If true, the movie is packed (see :meth:`Movie.pack`).
+
+        Returns:
+            A Movie object or None if no frame was appended.
+        """
+        if not self.times:
+            return None
+
+        images = self.images[:len(self)]
+        times = np.array(self.times, dtype="datetime64[ns]")
+        if np.any(times[1:] < times[:-1]):
+            order = np.argsort(times, kind="stable")
+            times, images = times[order], images[order]
+
+        if mask is not None and not packed:
+            # The covered pixels are set to NaN directly in the buffer:
+            images[:, ~np.asarray(mask, dtype=bool)] = np.nan
+
+        dims = ("time", "height", "width", "channel")[:images.ndim]
+        movie = Movie(xr.Dataset(
+            {"images": (dims, images)}, coords={"time": times},
+        ))
+
+        if mask is not None and packed:
+            movie.pack(mask)
+
+        return movie
+
+
+class FrameSlot:
+    """A single slot of a MovieBuilder (see :meth:`MovieBuilder.slot`).
+
+    It has the same interface for the file handlers as the builder but
+    :meth:`append` only records the time of the frame.
+    """
+
+    def __init__(self, builder, index):
+        self.builder = builder
+        self.index = index
+        self.time = None
+
+    def reserve(self, shape, dtype=np.float32):
+        return self.builder.reserve(shape, dtype, self.index)
+
+    def append(self, time):
+        self.time = time
+
+
 class ThermalCamMovie(Movie):
     """An object that can hold a sequence of thermal cam images and calculate
     cloud statistics from them.
@@ -131,6 +1006,11 @@ class ThermalCamMovie(Movie):
 
     clouds = None
 
+    @property
+    def _pixel_axes(self):
+        # All axes besides time, i.e. (height, width) or (pixel, ) if packed:
+        return tuple(range(1, self.data["images"].ndim))
+
     def cloud_coverage(self,):
         """Calculates the cloud coverage of this image.
 
@@ -142,10 +1022,10 @@ class ThermalCamMovie(Movie):
                              "call ThermalCamMovie.find_clouds() first!")
 
         all_cloud_pixels = np.count_nonzero(
-            ~np.isnan(self.clouds), axis=(1, 2,))
+            ~np.isnan(self.clouds), axis=self._pixel_axes)
 
         all_pixels = np.count_nonzero(
-            ~np.isnan(self.data["images"]), axis=(1, 2,))
+            ~np.isnan(self.data["images"]), axis=self._pixel_axes)
 
         return all_cloud_pixels / all_pixels
 
@@ -162,7 +1042,7 @@ class ThermalCamMovie(Movie):
             raise ValueError("Cannot calculate cloud parameter! You have to "
                              "call ThermalCamMovie.find_clouds() first!")
 
-        return np.nanmax(self.clouds, axis=(1, 2,))
+        return np.nanmax(self.clouds, axis=self._pixel_axes)
 
     def cloud_min_temperature(self, ):
         """Calculates the cloud min temperature.
@@ -177,7 +1057,7 @@ class ThermalCamMovie(Movie):
             raise ValueError("Cannot calculate cloud parameter! You have to "
                              "call ThermalCamMovie.find_clouds() first!")
 
-        return np.nanmin(self.clouds, axis=(1, 2,))
+        return np.nanmin(self.clouds, axis=self._pixel_axes)
 
     def cloud_mean_temperature(self,):
         """Calculates the cloud min temperature.
@@ -192,7 +1072,7 @@ class ThermalCamMovie(Movie):
             raise ValueError("Cannot calculate cloud parameter! You have to "
                              "call ThermalCamMovie.find_clouds() first!")
 
-        return np.nanmean(self.clouds, axis=(1, 2,))
+        return np.nanmean(self.clouds, axis=self._pixel_axes)
 
     def cloud_inhomogeneity(self,):
         """Calculates the cloud inhomogeneity.
@@ -214,9 +1094,12 @@ class ThermalCamMovie(Movie):
         if self.clouds is None:
             raise ValueError("Cannot calculate cloud parameter! You have to "
                              "call ThermalCamMovie.find_clouds() first!")
+        if self.is_packed:
+            raise ValueError("The cloud inhomogeneity needs the full images! "
+                             "Call ThermalCamMovie.unpack() first!")
 
         cloud_mask = ~np.isnan(self.clouds)
-        size = np.nansum(cloud_mask, axis=(1, 2,)).astype("float")
+        size = np.nansum(cloud_mask, axis=self._pixel_axes).astype("float")
 
         # We cannot divide by zero
         size[size < 1] = np.nan
@@ -303,80 +1186,108 @@ class ThermalCamMovie(Movie):
 
             return self.clouds
 
-    def cloud_parameters(self, temperatures, levels=None):
+    def cloud_parameters(self, temperatures, levels=None, sample=None,
+                         histogram_bins=None):
         """Calculates the cloud parameters of this image.
 
+        All height levels are processed in one pass over the images (see
+        :func:`level_statistics`). Packed movies (see :meth:`Movie.pack`) are
+        processed without expanding them.
+
+        If a *sample* is given, only its pixels are looked at. This is much
+        faster but the results are approximations: the coverage and mean
+        temperature come with the half widths of their 95% confidence
+        intervals (*cloud_coverage_error* and *cloud_mean_temperature_error*).
+        The minimum and maximum temperature of the sample tend to lie inside
+        the true range and have no error estimate.
+
+        With *histogram_bins*, the temperature histogram of each image (of
+        the sampled pixels if *sample* is given) is saved as well
+        (*temperature_histogram*). It is much smaller than the
+        images and allows to recalculate the statistics for other thresholds
+        (see :func:`histogram_cloud_parameters`).
+
+        Several level configurations (e.g. for different lapse rates) can be
+        evaluated at once by passing a list of threshold lists as *levels*
+        (see :func:`sweep_statistics`). The statistics then get the
+        additional dimension *config*.
+
         Args:
             temperatures: Temperature of the clear sky that will be
                 used as threshold to decide between cloud and non-cloud. Should
                 be a interpolation function (eg. a scipy.interpolate.interp1d).
-            levels: A list of different temperature thresholds
+            levels: A list of different temperature thresholds or a list of
+                such lists (one for each configuration, all with the same
+                number of levels).
+            sample: A :class:`PixelSample` object of the mask of this movie.
+            histogram_bins: The bins of the temperature histograms (see
+                :func:`temperature_histograms`). If None, no histograms are
+                calculated.
 
         Returns:
             A xarray.Dataset with the values for the different parameters
             (coverage, inhomogeneity, etc.)
         """
+        parameters = dict(CLOUD_PARAMETERS)
 
-        parameters = {
-            "cloud_coverage": [
-                self.cloud_coverage,
-                {"description": "cloud coverage",
-                 "units": "coverage [0-1]"},
-            ],
-            "cloud_mean_temperature": [
-                self.cloud_mean_temperature,
-                {"description": "cloud mean temperature",
-                 "units": "temperature [°C]"},
-            ],
-            # TODO: The cloud inhomogeneity does not seem to work right now,
-            # TODO: it has some broadcasting issues.
-            # "cloud_inhomogeneity": [
-            #     self.cloud_inhomogeneity,
-            #     {"description": "cloud inhomogeneity",
-            #      "units": "coverage [0-1]"},
-            # ],
-            "cloud_max_temperature": [
-                self.cloud_max_temperature,
-                {"description": "cloud max. temperature",
-                 "units": "temperature [°C]"},
-            ],
-            "cloud_min_temperature": [
-                self.cloud_min_temperature,
-                {"description": "cloud min. temperature",
-                 "units": "temperature [°C]"},
-            ]
-        }
-
-        results = defaultdict(list)
-
-        for level, decrement in enumerate(levels):
-            # We need a cloud mask before calculating the cloud statistics.
-            if level == 0:
-                self.find_clouds(
-                    temperatures(self.data["time"]) + decrement,
-                    None,
-                )
-            else:
-                self.find_clouds(
-                    temperatures(self.data["time"]) + decrement,
-                    temperatures(self.data["time"]) + levels[level-1],
-                )
-
-            # Calculate the cloud parameters (we ignore warnings because when
-            # we do not find clouds many messages are triggered)
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                for parameter, func in parameters.items():
-                    results[parameter].append(func[0]())
-
-        # Create an xarray Dataset with all parameters:
-        cloud_stats = xr.Dataset()
-        cloud_stats["time"] = self.data["time"]
-        for parameter, result in results.items():
-            cloud_stats[parameter] = xr.DataArray(
-                np.column_stack(result),
-                attrs=parameters[parameter][1],
-                dims=["time", "level"],
+        if sample is None:
+            pixels = self.data["images"].values
+            fraction = None
+        else:
+            pixels = sample.take(self.data["images"])
+            fraction = sample.fraction
+
+        levels = np.asarray(levels, dtype=float)
+        if levels.ndim == 2:
+            results = sweep_statistics(
+                pixels, np.asarray(temperatures(self.data["time"])), levels,
+                fraction
+            )
+            dims = ("time", "config", "level")
+        else:
+            results = level_statistics(
+                pixels,
+                _level_thresholds(temperatures, self.data["time"], levels),
+                fraction
+            )
+            dims = ("time", "level")
+
+        if sample is not None:
+            parameters["cloud_coverage_error"] = {
+                "description": "half width of the 95% confidence interval "
+                               "of the cloud coverage",
+                "units": "coverage [0-1]",
+            }
+            parameters["cloud_mean_temperature_error"] = {
+                "description": "half width of the 95% confidence interval "
+                               "of the cloud mean temperature",
+                "units": "temperature [°C]",
+            }
+
+        cloud_stats = _statistics_dataset(
+            self.data["time"], results, parameters, dims)
+
+        if histogram_bins is not None:
+            first_edge, last_edge, width = histogram_bins
+            histograms = temperature_histograms(pixels, histogram_bins)
+            # The underflow bin has no lower edge:
+            lower_edges = first_edge \
+                + width * np.arange(-1, histograms.shape[1] - 1)
+            lower_edges[0] = -np.inf
+            cloud_stats[HISTOGRAM] = xr.DataArray(
+                histograms, dims=["time", "temperature_bin"],
+                coords={"temperature_bin": lower_edges},
+                attrs={
+                    "description": "number of pixels per temperature bin "
+                                   "(temperature_bin is the lower edge, the "
+                                   "first and last bin count the pixels "
+                                   "below and above the other bins)",
+                    "bin_start": first_edge,
+                    "bin_end": last_edge,
+                    "bin_width": width,
+                },
             )
+            # Most bins are empty:
+            cloud_stats[HISTOGRAM].encoding.update(zlib=True, complevel=4)
 
         return cloud_stats
@@ -1,17 +1,28 @@
 import datetime
+import io
+import struct
 
 from typhon.files import expects_file_info, FileHandler, FileInfo
 import numpy as np
 import PIL.Image
 from PIL.ExifTags import TAGS
 from scipy.optimize import curve_fit
-import xarray as xr
+
+from .movies import MovieBuilder
 
 __all__ = [
     "ThermalCam",
     #"WebCam"
 ]
 
+# The numbers of the EXIF tags are looked up only once:
+EXIF_TAG_NUMBERS = {name: number for number, name in TAGS.items()}
+EXIF_IFD_TAG = EXIF_TAG_NUMBERS["ExifOffset"]
+EXIF_TIME_TAG = EXIF_TAG_NUMBERS["DateTimeOriginal"]
+
+# JPEG markers: start of image, start of scan, end of image and APP1 (EXIF)
+JPEG_SOI, JPEG_SOS, JPEG_EOI, JPEG_APP1 = 0xD8, 0xDA, 0xD9, 0xE1
+
 
 def polynom_second(x, a, b, c):
     return a * np.square(x) + b * x + c
@@ -44,10 +55,114 @@ def brightness_to_temperature(brightness, calibration_coefficients):
     return polynom_second(brightness, *calibration_coefficients)
 
 
+def get_calibration_table(calibration_coefficients):
+    """Get a lookup table from brightness to temperature
+
+    Pinocchio images have only 256 different grey values. Hence, we can
+    calculate the temperature for each of them once and convert the images by
+    indexing this table with their pixel values.
+
+    The temperatures are calculated in float64 and rounded once to float32.
+    Before, the images were calculated pixel by pixel from float32 grey
+    values, which gave float32 with numpy before version 2 but float64 with
+    newer versions. Now they are always float32.
+
+    Args:
+        calibration_coefficients: The calibration coefficients from
+            :func:`get_calibration`.
+
+    Returns:
+        A numpy.array with 256 temperatures (float32).
+    """
+    return np.float32(
+        brightness_to_temperature(
+            np.arange(256, dtype=np.float64), calibration_coefficients
+        )
+    )
+
+
+def _exif_time(tiff):
+    """Get DateTimeOriginal from the TIFF structure of an EXIF segment"""
+    order = {b"II": "<", b"MM": ">"}.get(tiff[:2])
+    if order is None:
+        return None
+
+    def entries(offset):
+        count, = struct.unpack_from(order + "H", tiff, offset)
+        for i in range(count):
+            # Each entry has a tag, type, count and value (or an offset to
+            # the value if it is longer than four bytes):
+            yield struct.unpack_from(order + "HHI4s", tiff, offset + 2 + 12*i)
+
+    ifds = [struct.unpack_from(order + "I", tiff, 4)[0]]
+    seen = set()
+    while ifds:
+        offset = ifds.pop(0)
+        if offset in seen:
+            # A corrupt header whose IFDs reference each other
+            continue
+        seen.add(offset)
+
+        for tag, _, count, value in entries(offset):
+            if tag == EXIF_IFD_TAG:
+                ifds.append(struct.unpack(order + "I", value)[0])
+            elif tag == EXIF_TIME_TAG:
+                offset, = struct.unpack(order + "I", value)
+                time_string = tiff[offset:offset+count].rstrip(b"\0 ")
+                return datetime.datetime.strptime(
+                    time_string.decode("ascii"), "%Y:%m:%d %H:%M:%S")
+
+    return None
+
+
+def _is_seekable(file):
+    """Check whether a file object can seek backwards"""
+    try:
+        return file.seekable()
+    except AttributeError:
+        # The members of archives opened as stream have no seekable method
+        return False
+
+
+def read_exif_time(file):
+    """Read the time of a JPG image from its EXIF header.
+
+    Only the header segments of the image are read, the image itself is
+    neither read nor decoded.
+
+    Args:
+        file: A file object (opened in binary mode) at the start of the
+            image.
+
+    Returns:
+        A datetime object with the time from the *DateTimeOriginal* EXIF tag
+        or None if the image has no such tag.
+    """
+    if file.read(2) != bytes([0xFF, JPEG_SOI]):
+        return None
+
+    try:
+        while True:
+            header = file.read(4)
+            if len(header) < 4 or header[0] != 0xFF \
+                    or header[1] in (JPEG_SOS, JPEG_EOI):
+                # The image data starts, there is no EXIF segment:
+                return None
+
+            length, = struct.unpack(">H", header[2:])
+            segment = file.read(length - 2)
+            if header[1] == JPEG_APP1 and segment.startswith(b"Exif\0\0"):
+                return _exif_time(segment[6:])
+    except (struct.error, ValueError):
+        # The header is corrupt
+        return None
+
+
 class ThermalCam(FileHandler):
     calibration_coefficients = None
+    calibration_table = None
 
-    def __init__(self, calibration_file=None, to_temperatures=True,
+    def __init__(self, calibration_file=None, to_temperatures=True, scale=1,
                  **kwargs):
         """ This class can read thermal cam images of the Pinocchio instrument.
 
@@ -58,6 +173,12 @@ class ThermalCam(FileHandler):
                 255) and the second denotes the corresponding temperature. This
                 reader will fit a curve to those calibration values and convert
                 all pixels of a thermal cam image according to it.
+            scale: Decode the images with a reduced resolution: 1 (full
+                resolution), 2, 4 or 8 (1/8 of the width and height). The
+                JPEG decoder scales the images while decoding them (on the
+                DCT coefficients), which is much faster than decoding them in
+                full resolution. Use masks with the same scale (see
+                :func:`cloud.load_mask`).
             **kwargs: Additional keyword arguments for FileHandler base class.
         """
         # Call the base class initializer
@@ -65,6 +186,10 @@ class ThermalCam(FileHandler):
 
         self.to_temperatures = to_temperatures
 
+        if scale not in (1, 2, 4, 8):
+            raise ValueError("The scale must be 1, 2, 4 or 8!")
+        self.scale = scale
+
         if self.to_temperatures and calibration_file is None:
                 raise ValueError(
                     "For converting to temperatures a calibration file is "
@@ -82,27 +207,33 @@ class ThermalCam(FileHandler):
             )
             ThermalCam.calibration_coefficients, _ = \
                 get_calibration(data[:, 0], data[:, 1])
+            ThermalCam.calibration_table = get_calibration_table(
+                ThermalCam.calibration_coefficients)
 
     @expects_file_info()
     def get_info(self, filename, **kwargs):
         """Get the time coverage from a Pinocchio JPG image.
 
+        Only the EXIF header of the image is read (see
+        :func:`read_exif_time`).
+
         Args:
-            filename: Path and name of file or FileInfo object.
+            filename: Path and name of file or FileInfo object. If the image
+                has no EXIF time, the times of this FileInfo object (e.g.
+                parsed from the filename) are used.
 
         Returns:
             A FileInfo object.
         """
 
-        # read image
-        image = PIL.Image.open(filename, 'r')
+        with open(filename.path, "rb") as file:
+            time = read_exif_time(file)
 
-        name2tagnum = dict((name, num) for num, name in TAGS.items())
-        time_string = image._getexif()[name2tagnum["DateTimeOriginal"]]
-        time = datetime.datetime.strptime(time_string, "%Y:%m:%d %H:%M:%S")
+        if time is None:
+            return FileInfo(filename.path, filename.times)
 
         return FileInfo(
-            filename
+            filename.path,
             [time, time],
         )
 
@@ -111,39 +242,104 @@ class ThermalCam(FileHandler):
         """Read an JPG image and convert it to a cloud.ThermalCamMovie object.
 
         Args:
-            file: Path and name of file or FileInfo object.
+            file: Path and name of file or FileInfo object. Its start time
+                (e.g. parsed from the filename) is used if the image has no
+                EXIF time.
+
+        Returns:
+            Either a cloud.ThermalCamMovie or a cloud.Movie object.
+        """
+
+        return self.read_image(file.path, file.times[0])
+
+    def read_image(self, image_file, time=None):
+        """Read an JPG image from a path or a file object.
+
+        This can be used to read images without having them on the disk, e.g.
+        directly from an archive file.
+
+        Args:
+            image_file: Path and name of the file or a file object.
+            time: Timestamp of the image. Will be used if the image has no
+                EXIF tag with its time.
 
         Returns:
             Either a cloud.ThermalCamMovie or a cloud.Movie object.
         """
 
-        # read image
-        image = PIL.Image.open(file.path, 'r')
-
-        # Retrieve the time via EXIF tags
-        name2tagnum = dict((name, num) for num, name in TAGS.items())
-        if image._getexif() is None:
-            time = None
-        else:
-            time_string = image._getexif()[name2tagnum["DateTimeOriginal"]]
-            time = datetime.datetime.strptime(time_string, "%Y:%m:%d %H:%M:%S")
-
-        if self.to_temperatures:
-            # convert it to a grey scale image
-            data = np.float32(np.array(image.convert('L')))
-            data = np.flipud(data)
-            data = brightness_to_temperature(
-                data, self.calibration_coefficients)
-        else:
-            data = np.float32(np.array(image.convert('RGB')))
-
-        movie = xr.Dataset()
-        movie["images"] = xr.DataArray(
-            [data], dims=["time", "height", "width"]
+        builder = MovieBuilder(1)
+        self.read_frame(image_file, builder, time)
+        return builder.build().data
+
+    def read_frame(self, image_file, builder, time=None):
+        """Decode an JPG image directly into the next slot of a movie.
+
+        Args:
+            image_file: Path and name of the file or a file object. A file
+                object is read from its current position and is not closed.
+            builder: A cloud.MovieBuilder object.
+            time: Timestamp of the image. Will be used if the image has no
+                EXIF tag with its time.
+
+        Returns:
+            None
+        """
+
+        close = isinstance(image_file, str)
+        if close:
+            image_file = open(image_file, "rb")
+        elif not _is_seekable(image_file) or image_file.tell() != 0:
+            # Files from archives cannot always seek backwards. PIL reads the
+            # image from the start of the file object:
+            image_file = io.BytesIO(image_file.read())
+
+        try:
+            # Retrieve the time via EXIF tags
+            exif_time = read_exif_time(image_file)
+            if exif_time is not None:
+                time = exif_time
+
+            # read image
+            image_file.seek(0)
+            image = PIL.Image.open(image_file, 'r')
+            if self.scale > 1:
+                image = self._reduce(image)
+
+            width, height = image.size
+            if self.to_temperatures:
+                # convert it to a grey scale image and look up the temperature
+                # of each pixel (the flipped image is only a view):
+                data = np.flipud(np.asarray(image.convert('L')))
+                np.take(
+                    self.calibration_table, data,
+                    out=builder.reserve((height, width), np.float32)
+                )
+            else:
+                builder.reserve((height, width, 3), np.float32)[...] = \
+                    np.asarray(image.convert('RGB'))
+        finally:
+            if close:
+                image_file.close()
+
+        builder.append(time)
+
+    def _reduce(self, image):
+        """Decode an image with a reduced resolution"""
+        width, _ = image.size
+
+        # Let the JPEG decoder do the scaling (it chooses the largest scale
+        # that still gives at least the requested size):
+        image.draft(
+            'L' if self.to_temperatures else 'RGB',
+            (width // self.scale, image.size[1] // self.scale)
         )
-        movie["time"] = "time", [time]
 
-        return movie
+        # Not a JPEG or not scaled enough (e.g. the height is not divisible
+        # by the scale):
+        remaining = self.scale // round(width / image.size[0])
+        if remaining > 1:
+            image = image.reduce(remaining)
+        return image
 
 
 # class WebCam(FileHandler):
@@ -5,61 +5,675 @@ them. A second function can calculate the cloud statistics of those converted
 files.
 """
 
+from collections import defaultdict, deque
+from concurrent.futures import \
+    as_completed, ProcessPoolExecutor, ThreadPoolExecutor
+import io
 import logging
 import os.path
+import struct
+import tarfile
 
+import numpy as np
+import pandas as pd
 import xarray as xr
 from scipy.interpolate import interp1d
-from typhon.files import NoFilesError
+from typhon.files import FileInfo, NoFilesError
 
 import cloud
+from cloud.manifest import file_stats, Manifest
 
 __all__ = [
     "calculate_cloud_statistics",
+    "convert_archive_files",
     "convert_raw_files",
+    "process_instruments",
+    "read_rollups",
+    "recalculate_cloud_statistics",
+    "update_rollups",
 ]
 
+# The loaded mask of each instrument together with the file stats and scale it
+# was loaded with (only the latest one is kept):
+_masks = {}
 
-def _apply_mask(images, mask):
-    """Small helper function to apply a mask onto a movie.
+# The drawn pixel sample of each instrument together with the file stats and
+# scale of its mask and the sampled fraction (only the latest one is kept):
+_samples = {}
+
+
+def _build_movie(builder, mask, packed=False, encoding=None):
+    """Small helper function to build a movie and apply a mask onto it.
 
     Args:
-        images: A list with xarray.Dataset objects.
-        mask: A mask that should be applied on those movies
+        builder: A cloud.MovieBuilder object with all frames of the movie.
+        mask: A mask that should be applied on this movie
+        packed: If true, only the pixels inside the mask are kept (see
+            :meth:`cloud.Movie.pack`).
+        encoding: A dictionary with keyword arguments for
+            :meth:`cloud.Movie.set_encoding`.
 
     Returns:
-        One concatenated long movie out of *movies*.
+        A xarray.Dataset with the movie or None.
     """
 
-    if not images:
+    if not len(builder):
         return None
 
-    # Join all single images to one movie:
-    movie = cloud.Movie(xr.concat(images, dim="time"))
-
-    start, end = movie.time_coverage
-    logging.info(f"Apply mask on images from {start} to {end}")
-
     try:
-        # Apply the mask on the movie
-        if mask is not None:
-            movie.apply_mask(mask)
+        # The mask is applied in place while building the movie:
+        movie = builder.build(mask, packed=packed)
+        if encoding is not None:
+            movie.set_encoding(**encoding)
+
+        start, end = movie.time_coverage
+        logging.info(f"Applied mask on images from {start} to {end}")
 
         # Return only the xarray.Dataset from the movie
         return movie.data
-    except NoFilesError as err:
-        logging.error(str(err))
     except Exception:
         logging.error("during converting:", exc_info=True)
 
     return None
 
 
-def convert_raw_files(filesets, instrument, config, start, end,):
+def _save_bundle(movie, files, output, statistics=None):
+    """Save a converted movie and/or its cloud statistics.
+
+    If both are requested, the movie is written in the background while the
+    statistics are calculated from the movie in memory.
+
+    Args:
+        movie: A xarray.Dataset with the movie.
+        files: A list of FileInfo objects of the frames of the movie.
+        output: The FileSet object where the movie should be saved. If None,
+            the movie is not saved.
+        statistics: A dictionary with the keys *output* (the FileSet object
+            of the statistics), *temperatures*, *config* and *sample* (see
+            :func:`_cloud_parameters`). If None, no statistics are
+            calculated.
+
+    Returns:
+        A tuple with the filename of the movie and of the statistics. Each of
+        them is None if it was not written.
+    """
+    movie_file = stats_file = None
+
+    with ThreadPoolExecutor(max_workers=1) as writer:
+        if output is not None:
+            movie_file = _get_output_filename(output, files)
+            # The statistics need the original (not clipped) images:
+            written = writer.submit(
+                output.write, cloud.clip_to_encoding(movie), movie_file)
+
+        if statistics is not None:
+            parameters = _cloud_parameters(
+                movie, statistics["temperatures"], statistics["config"],
+                statistics.get("sample"))
+            if parameters is not None:
+                stats_file = _get_output_filename(
+                    statistics["output"], files)
+                statistics["output"].write(parameters, stats_file)
+
+        if output is not None:
+            # Raises the exception of the writer (if any):
+            written.result()
+
+    return movie_file, stats_file
+
+
+def _decode_frame(handler, path, time, slot):
+    """Decode one frame into its slot (used by the prefetch threads)"""
+    handler.read_frame(path, slot, time)
+    return slot
+
+
+def _read_frames(files, raw, builder, prefetch=None):
+    """Read all frames of raw files into a builder.
+
+    Args:
+        files: A list of FileInfo objects.
+        raw: The FileSet object of the raw files.
+        builder: A cloud.MovieBuilder object.
+        prefetch: A tuple of the number of frames that are decoded ahead and
+            the number of threads decoding them (see :func:`_get_prefetch`).
+            If None, the frames are decoded one after another.
+
+    Returns:
+        None
+    """
+    if prefetch is None:
+        for info in files:
+            try:
+                raw.handler.read_frame(info.path, builder, info.times[0])
+            except Exception:
+                logging.error("Could not read %s:" % info.path, exc_info=True)
+        return
+
+    # Reading files and decoding images (PIL, numpy) release the GIL. Hence,
+    # some threads decode the upcoming frames directly into their slots of the
+    # movie (in the order of the files) while the earlier ones are appended.
+    # At most *depth* frames are decoded ahead:
+    depth, threads = prefetch
+    files = enumerate(files, len(builder))
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        def submit_next():
+            index, info = next(files, (None, None))
+            if info is not None:
+                pending.append((info, pool.submit(
+                    _decode_frame, raw.handler, info.path, info.times[0],
+                    builder.slot(index))))
+
+        for _ in range(depth):
+            submit_next()
+
+        while pending:
+            info, frame = pending.popleft()
+            submit_next()
+            try:
+                slot = frame.result()
+                if slot.time is not None:
+                    # Moves the frame only if earlier frames have failed:
+                    builder.append(slot.time, slot.index)
+            except Exception:
+                logging.error("Could not read %s:" % info.path, exc_info=True)
+
+
+def _convert_files(
+        files, raw, mask, packed=False, encoding=None, output=None,
+        statistics=None, prefetch=None):
+    """Join raw files to one movie, apply a mask onto it and save it.
+
+    The frames are decoded directly into one preallocated buffer (see
+    :class:`cloud.MovieBuilder`).
+
+    Args:
+        files: A list of FileInfo objects.
+        raw: The FileSet object of the raw files.
+        mask: A mask that should be applied on this movie
+        packed: If true, only the pixels inside the mask are kept.
+        encoding: A dictionary with keyword arguments for
+            :meth:`cloud.Movie.set_encoding`.
+        output: The FileSet object where the movie should be saved.
+        statistics: Calculate also the cloud statistics of the movie (see
+            :func:`_save_bundle`).
+        prefetch: Decode the frames ahead in threads (see
+            :func:`_read_frames`).
+
+    Returns:
+        A tuple with the filename of the movie and of the statistics (see
+        :func:`_save_bundle`).
+    """
+
+    builder = cloud.MovieBuilder(len(files))
+    _read_frames(files, raw, builder, prefetch)
+
+    movie = _build_movie(builder, mask, packed, encoding)
+    if movie is None:
+        return None, None
+
+    return _save_bundle(movie, files, output, statistics)
+
+
+def _load_mask(config, instrument):
+    """Load the mask of an instrument if it is set in *config*.
+
+    The mask is kept in memory as long as its file does not change (e.g.
+    for processor.py --watch).
+
+    Args:
+        config: A dictionary-like object with configuration keys.
+        instrument: The name of the instrument.
+
+    Returns:
+        A numpy.array with the mask or None.
+    """
+    if "mask" not in config[instrument]:
+        return None
+
+    filename = os.path.join(
+        config["General"]["basedir"], config[instrument]["mask"]
+    )
+    scale = int(config[instrument].get("scale", 1))
+    key = file_stats([filename])[0], scale
+    if _masks.get(instrument, (None, None))[0] != key:
+        logging.info("Load the mask")
+        _masks[instrument] = key, cloud.load_mask(filename, scale)
+    return _masks[instrument][1]
+
+
+def _get_sample_fraction(config):
+    """Get the fraction of pixels for the approximate statistics
+
+    Args:
+        config: A dictionary-like object with configuration keys.
+
+    Returns:
+        [General][sample_fraction] or 1 if it is not set (all pixels).
+    """
+    return float(config["General"].get("sample_fraction", 1))
+
+
+def _get_pixel_sample(config, instrument):
+    """Get the pixel sample for the approximate statistics of an instrument
+
+    The sample is drawn only once for each mask (see
+    :class:`cloud.PixelSample`) and reused for all bundles.
+
+    Args:
+        config: A dictionary-like object with configuration keys.
+        instrument: The name of the instrument.
+
+    Returns:
+        A cloud.PixelSample object or None if all pixels should be used.
+    """
+    fraction = _get_sample_fraction(config)
+    if fraction >= 1:
+        return None
+
+    mask = _load_mask(config, instrument)
+    if mask is None:
+        logging.warning(
+            "%s has no mask, hence the exact statistics are calculated "
+            "(sample_fraction needs a mask)" % instrument)
+        return None
+
+    filename = os.path.join(
+        config["General"]["basedir"], config[instrument]["mask"]
+    )
+    scale = int(config[instrument].get("scale", 1))
+    key = file_stats([filename])[0], scale, fraction
+    if _samples.get(instrument, (None, None))[0] != key:
+        _samples[instrument] = key, cloud.PixelSample(mask, fraction)
+        logging.info("Calculate approximate statistics from %d pixels per "
+                     "image" % len(_samples[instrument][1]))
+    return _samples[instrument][1]
+
+
+def _get_histogram_bins(config):
+    """Get the bins of the temperature histograms from *config*.
+
+    Args:
+        config: A dictionary-like object with configuration keys.
+
+    Returns:
+        A tuple of the lower edge of the first bin, the upper edge of the last
+        bin and the bin width ([General][histogram_bins]) or None if no
+        histograms should be saved.
+    """
+    if "histogram_bins" not in config["General"]:
+        return None
+
+    return tuple(
+        float(value)
+        for value in config["General"]["histogram_bins"].split(",")
+    )
+
+
+def _get_levels(config, lapse_rate=None):
+    """Get the temperature thresholds of the height levels
+
+    Args:
+        config: A dictionary-like object with configuration keys.
+        lapse_rate: The lapse rate [K / km]. If None, [General][lapse_rate]
+            is used.
+
+    Returns:
+        A list with the temperature difference to the surface of the lower
+        boundary of each level (2, 4 and 6 km).
+    """
+    if lapse_rate is None:
+        lapse_rate = config["General"]["lapse_rate"]
+    return [float(lapse_rate) * 2., float(lapse_rate) * 4.,
+            float(lapse_rate) * 6.]
+
+
+def _sweep_levels(config, sweep):
+    """Get the temperature thresholds of all configurations of a sweep
+
+    Args:
+        config: A dictionary-like object with configuration keys.
+        sweep: A list of configurations. Each configuration is a dictionary
+            with either the key *lapse_rate* (see :func:`_get_levels`) or
+            *levels* (a list with the temperature thresholds) and optionally
+            a *name*.
+
+    Returns:
+        A tuple with a list of the configuration names and a numpy.array with
+        the shape (config, level) containing the thresholds.
+    """
+    names, levels = [], []
+    for configuration in sweep:
+        if "levels" in configuration:
+            levels.append([float(level) for level in configuration["levels"]])
+            name = "levels=" + ",".join("%g" % level for level in levels[-1])
+        else:
+            levels.append(_get_levels(config, configuration["lapse_rate"]))
+            name = "lapse_rate=%g" % float(configuration["lapse_rate"])
+        names.append(configuration.get("name", name))
+
+    if len({len(thresholds) for thresholds in levels}) != 1:
+        raise ValueError("All configurations of a sweep must have the same "
+                         "number of levels!")
+    return names, np.array(levels)
+
+
+def _statistics_inputs(config):
+    """Get all settings that change the cloud statistics
+
+    Args:
+        config: A dictionary-like object with configuration keys.
+
+    Returns:
+        A dictionary for the inputs of a bundle in the manifest.
+    """
+    inputs = {
+        "lapse_rate": config["General"]["lapse_rate"],
+    }
+    fraction = _get_sample_fraction(config)
+    if fraction < 1:
+        inputs["sample_fraction"] = fraction
+    if "histogram_bins" in config["General"]:
+        inputs["histogram_bins"] = _get_histogram_bins(config)
+    return inputs
+
+
+def _is_packed(config, instrument):
+    """Check whether the movies of an instrument should be packed.
+
+    Args:
+        config: A dictionary-like object with configuration keys.
+        instrument: The name of the instrument.
+
+    Returns:
+        True if [instrument][packed] is set and a mask is available.
+    """
+    return "mask" in config[instrument] \
+        and config[instrument].getboolean("packed", False)
+
+
+def _get_encoding(config, instrument):
+    """Get the encoding of the converted movies of an instrument.
+
+    Args:
+        config: A dictionary-like object with configuration keys.
+        instrument: The name of the instrument.
+
+    Returns:
+        A dictionary with keyword arguments for
+        :meth:`cloud.Movie.set_encoding` or None if [instrument][encoding] is
+        not set.
+    """
+    section = config[instrument]
+    if "encoding" not in section:
+        return None
+
+    encoding = {
+        "dtype": None if section["encoding"] == "float"
+        else section["encoding"],
+        "complevel": int(section.get("complevel", 4)),
+    }
+    if "encoding_range" in section:
+        encoding["valid_range"] = [
+            float(value) for value in section["encoding_range"].split(",")
+        ]
+    return encoding
+
+
+def _load_manifest(config):
+    """Load the manifest of processed bundles if it is set in *config*.
+
+    Args:
+        config: A dictionary-like object with configuration keys.
+
+    Returns:
+        A cloud.manifest.Manifest object or None.
+    """
+    if "manifest" not in config["General"]:
+        return None
+
+    return Manifest(
+        os.path.join(
+            config["General"]["basedir"], config["General"]["manifest"]
+        )
+    )
+
+
+def _conversion_inputs(config, instrument):
+    """Get all settings that change the converted movies of an instrument.
+
+    Args:
+        config: A dictionary-like object with configuration keys.
+        instrument: The name of the instrument.
+
+    Returns:
+        A dictionary for the inputs of a bundle in the manifest.
+    """
+    inputs = {
+        "packed": _is_packed(config, instrument),
+        "encoding": _get_encoding(config, instrument),
+    }
+    scale = int(config[instrument].get("scale", 1))
+    if scale != 1:
+        inputs["scale"] = scale
+    for option in ("mask", "calibration"):
+        if option in config[instrument]:
+            inputs[option] = file_stats([
+                os.path.join(
+                    config["General"]["basedir"], config[instrument][option]
+                )
+            ])
+    return inputs
+
+
+def _bundle_name(instrument, time, bundle="1h"):
+    """Get the name of a bundle in the manifest"""
+    return "%s %s" % (
+        instrument,
+        pd.Timestamp(time).floor(pd.Timedelta(bundle)).isoformat())
+
+
+def _get_output_filename(output, files):
+    """Get the filename that FileSet.map uses for the output of files"""
+    if isinstance(files, FileInfo):
+        files = [files]
+
+    return output.get_filename(
+        (min(info.times[0] for info in files),
+         max(info.times[1] for info in files)),
+        fill=files[0].attr,
+    )
+
+
+def _metadata_fingerprint(metadata, start, end):
+    """Get the fingerprint of the air temperatures used for a period
+
+    The metadata file may grow during a cruise. Hence, we take only the air
+    temperatures that are used for this period (up to one hour around it)
+    into account.
+
+    Args:
+        metadata: A xarray.Dataset with the air temperature.
+        start: Start time of the period.
+        end: End time of the period.
+
+    Returns:
+        A fingerprint string.
+    """
+    times = metadata["time"].values
+    used = \
+        (times >= np.datetime64(pd.Timestamp(start) - pd.Timedelta("1H"))) \
+        & (times <= np.datetime64(pd.Timestamp(end) + pd.Timedelta("1H")))
+    return Manifest.fingerprint([
+        times[used].astype("M8[ns]").astype("int").tolist(),
+        metadata["air_temperature"].values[used].tolist(),
+    ])[0]
+
+
+def _load_temperatures(filesets, config, start, end):
+    """Load the air temperature for classifying the clouds by their height
+
+    Args:
+        filesets: A FileSetManager object.
+        config: A dictionary-like object with configuration keys.
+        start: Start time as string.
+        end: End time as string.
+
+    Returns:
+        A tuple of the metadata (a xarray.Dataset with the air temperature)
+        and a function that interpolates the air temperature (see
+        :func:`_cloud_parameters`).
+    """
+    # For classifying the clouds by their height, we need the air
+    # temperature from a metadata dataset (usually DShip)
+    logging.info(
+        "Get air temperature from %s dataset" % config["General"]["metadata"])
+
+    # A list with a data object for each metadata file. We read a little bit
+    # more than needed, so the images at the borders can still be
+    # interpolated:
+    metadata = xr.concat(
+        filesets[config["General"]["metadata"]].collect(
+            start, end, read_args={
+                "fields": ["air_temperature"],
+                "start": pd.Timestamp(start) - pd.Timedelta("1H"),
+                "end": pd.Timestamp(end) + pd.Timedelta("1H"),
+            },
+        ), dim="time"
+    )
+
+    # Interpolate the ground temperature from ship data. Note: the data will be
+    # extrapolated outside of the time coverage of the DShip data (hence, we
+    # should not use the data outside from the time coverage):
+    temperatures = interp1d(
+        metadata["time"].data.astype("M8[s]").astype("int"),
+        metadata["air_temperature"].data, fill_value="extrapolate"
+    )
+
+    return metadata, temperatures
+
+
+def _fused_stats_inputs(inputs, config, metadata, start, end):
+    """Get the manifest inputs of statistics calculated during conversion"""
+    return {
+        "bundle": inputs,
+        "metadata": _metadata_fingerprint(metadata, start, end),
+        **_statistics_inputs(config),
+    }
+
+
+def _statistics_kwargs(filesets, instrument, config, metadata, temperatures):
+    """Get the arguments for calculating statistics during the conversion
+
+    Args:
+        filesets: A FileSetManager object.
+        instrument: The name of the instrument.
+        config: A dictionary-like object with configuration keys.
+        metadata: A xarray.Dataset with the air temperature.
+        temperatures: A function that interpolates the air temperature.
+
+    Returns:
+        A dictionary for the *statistics* argument of :func:`_save_bundle`.
+    """
+    return {
+        "output": filesets[instrument+"-stats"],
+        "temperatures": temperatures,
+        "metadata": metadata,
+        "config": config,
+        "sample": _get_pixel_sample(config, instrument),
+    }
+
+
+def _find_raw_bundles(
+        raw, instrument, config, start, end, manifest=None, force=False,
+        metadata=None, save_movies=True):
+    """Find all bundles of raw files that have to be converted
+
+    Args:
+        raw: The FileSet object of the raw files.
+        instrument: The name of the instrument.
+        config: A dictionary-like object with configuration keys.
+        start: Start time as string.
+        end: End time as string.
+        manifest: A cloud.manifest.Manifest object. Bundles that are
+            up-to-date are skipped.
+        force: If true, also bundles that are up-to-date are returned.
+        metadata: A xarray.Dataset with the air temperature if the cloud
+            statistics are calculated during the conversion.
+        save_movies: If false, bundles whose statistics are up-to-date are
+            skipped even if their movie is not.
+
+    Returns:
+        A list of tuples with the bundle name, the FileInfo objects of the
+        raw files and the manifest inputs of the conversion and of the
+        statistics (None without *metadata*).
+    """
+    settings = _conversion_inputs(config, instrument)
+
+    # Join all files to hourly bundles and skip those that have been converted
+    # already with the same inputs:
+    bundles = []
+    for files in raw.find(start, end, bundle="1H"):
+        name = _bundle_name(instrument, files[0].times[0])
+        inputs = {
+            "files": file_stats(info.path for info in files),
+            "settings": settings,
+        }
+        stats_inputs = None
+        if metadata is not None:
+            stats_inputs = _fused_stats_inputs(
+                inputs, config, metadata,
+                files[0].times[0], files[-1].times[1])
+        if not force and manifest is not None \
+                and (not save_movies
+                     or manifest.is_done("convert", name, inputs)) \
+                and (stats_inputs is None
+                     or manifest.is_done("stats", name, stats_inputs)):
+            continue
+        bundles.append((name, files, inputs, stats_inputs))
+
+    return bundles
+
+
+def _record_bundle(manifest, name, inputs, stats_inputs, results):
+    """Record the written files of a converted bundle in the manifest"""
+    movie_file, stats_file = results
+    if manifest is None:
+        return
+    if movie_file is not None:
+        manifest.record("convert", name, inputs, movie_file)
+    if stats_file is not None:
+        manifest.record("stats", name, stats_inputs, stats_file)
+
+
+def _raw_kwargs(filesets, instrument, config, statistics, save_movies):
+    """Get the keyword arguments of :func:`_convert_files`"""
+    return {
+        "raw": filesets[instrument+"-raw"],
+        "mask": _load_mask(config, instrument),
+        "packed": _is_packed(config, instrument),
+        "encoding": _get_encoding(config, instrument),
+        # the converted images will be saved into this dataset:
+        "output": filesets[instrument+"-netcdf"] if save_movies else None,
+        "statistics": statistics,
+        "prefetch": _get_prefetch(config),
+    }
+
+
+def convert_raw_files(
+        filesets, instrument, config, start, end, force=False,
+        statistics=False, save_movies=True, rollups=True):
     """Convert the raw files from an instrument to netCDF format.
 
     If a mask file is set for this instrument in *config*, then the mask will
-    be applied on its images.
+    be applied on its images. If additionally [instrument][packed] is set,
+    only the pixels inside the mask are saved (see :meth:`cloud.Movie.pack`).
+
+    With *statistics*, the cloud statistics are calculated directly from the
+    converted movies in memory instead of reading them again afterwards (see
+    :func:`calculate_cloud_statistics`). The movies are then written in the
+    background or - without *save_movies* - not at all.
 
     Args:
         filesets: A FileSetManager object.
@@ -67,41 +681,539 @@ def convert_raw_files(filesets, instrument, config, start, end,):
         config: A dictionary-like object with configuration keys.
         start: Start time as string.
         end: End time as string.
+        force: If true, also bundles that are up-to-date according to the
+            manifest ([General][manifest]) are converted again.
+        statistics: If true, calculate also the cloud statistics.
+        save_movies: If false (and *statistics* is true), the converted
+            movies are not saved.
+        rollups: If false, the rollups are not updated (see
+            :func:`update_rollups`).
 
     Returns:
         None
     """
 
-    mask = None
     if "mask" in config[instrument]:
-        logging.info("Load the mask")
-        mask = cloud.load_mask(
-            os.path.join(
-                config["General"]["basedir"], config[instrument]["mask"]
-            )
-        )
-
         logging.info("Convert the raw files to netcdf and apply mask")
     else:
         logging.info("Convert the raw files to netcdf")
 
-    # Convert all pinocchio files and join them to hourly netcdf files.
-    # Apply also a mask if available.
-    filesets[instrument+"-raw"].map(
-        func=_apply_mask, kwargs={"mask": mask},
-        on_content=True, start=start, end=end,
-        # join files to hourly bundles
-        bundle="1H",
-        # the converted images will be saved into this dataset:
-        output=filesets[instrument+"-netcdf"],
+    raw = filesets[instrument+"-raw"]
+    manifest = _load_manifest(config)
+
+    metadata = stats_kwargs = None
+    if statistics:
+        metadata, temperatures = _load_temperatures(
+            filesets, config, start, end)
+        stats_kwargs = _statistics_kwargs(
+            filesets, instrument, config, metadata, temperatures)
+    else:
+        save_movies = True
+
+    bundles = _find_raw_bundles(
+        raw, instrument, config, start, end, manifest, force, metadata,
+        save_movies
+    )
+
+    logging.info("%d bundles to convert" % len(bundles))
+
+    # Convert all files and join them to hourly netcdf files. Apply also a
+    # mask if available.
+    results = raw.imap(
+        func=_convert_files, files=[bundle[1] for bundle in bundles],
+        kwargs=_raw_kwargs(
+            filesets, instrument, config, stats_kwargs, save_movies),
+    )
+
+    # Record each bundle as soon as it is written, so an aborted run can be
+    # resumed:
+    for (name, _, inputs, stats_inputs), written in zip(bundles, results):
+        _record_bundle(manifest, name, inputs, stats_inputs, written)
+
+    if statistics and rollups and bundles:
+        update_rollups(
+            filesets, instrument, config,
+            min(bundle[1][0].times[0] for bundle in bundles),
+            max(bundle[1][-1].times[1] for bundle in bundles),
+        )
+
+
+def _archive_members(archive_file, extract_dir, raw, start, end, bundle):
+    """Iterate over the images of an opened archive in a time period
+
+    Args:
+        archive_file: A tarfile.TarFile object opened as stream.
+        extract_dir: The directory where the archive would be extracted to.
+        raw: The FileSet object of the extracted raw files.
+        start: Start time as pandas.Timestamp.
+        end: End time as pandas.Timestamp.
+        bundle: The time period of one bundle (e.g. "1h").
+
+    Yields:
+        A tuple of the tarfile.TarInfo object of the image, its FileInfo
+        object and the start of its bundle.
+    """
+    for member in archive_file:
+        if not member.isfile():
+            continue
+
+        try:
+            info = raw.get_info(
+                FileInfo(os.path.join(extract_dir, member.name)),
+                retrieve_via="filename",
+            )
+        except ValueError:
+            # This member does not match the pattern of raw files
+            continue
+
+        if not start <= info.times[0] < end or raw.is_excluded(info):
+            continue
+
+        yield member, info, \
+            pd.Timestamp(info.times[0]).floor(pd.Timedelta(bundle))
+
+
+def _count_archive_runs(archive, raw, start, end, bundle):
+    """Count the runs of each bundle in an archive
+
+    A run is a sequence of images of the same bundle that are stored one
+    after another. Only the member headers are read, no image is decoded.
+
+    Args:
+        archive: A FileInfo object of the archive.
+        raw, start, end, bundle: See :func:`_read_archive_bundles`.
+
+    Returns:
+        A dictionary with the number of runs of each bundle start.
+    """
+    extract_dir = os.path.splitext(archive.path)[0]
+
+    runs = defaultdict(int)
+    current = None
+    with tarfile.open(archive.path, mode="r|gz") as archive_file:
+        for _, _, bundle_start in _archive_members(
+                archive_file, extract_dir, raw, start, end, bundle):
+            if bundle_start != current:
+                runs[bundle_start] += 1
+                current = bundle_start
+    return runs
+
+
+def _read_archive_bundles(archive, raw, start, end, bundle):
+    """Read the images of an archive that lie in the requested time period.
+
+    The archive is read in one pass. The images are grouped by their bundles
+    in the order of the archive, i.e. a bundle appears several times if its
+    images are not stored one after another. Only the encoded images are
+    kept in memory.
+
+    Args:
+        archive: A FileInfo object of the archive.
+        raw: The FileSet object of the extracted raw files. It is used to
+            retrieve the timestamps from the member names and to check the
+            logbook.
+        start: Start time as pandas.Timestamp.
+        end: End time as pandas.Timestamp.
+        bundle: The time period of one bundle (e.g. "1h").
+
+    Yields:
+        A tuple of the bundle start and a list of the images of this bundle
+        (each as tuple of the member name, its FileInfo object and its
+        content).
+    """
+
+    # The raw fileset describes where the images would have been extracted to:
+    extract_dir = os.path.splitext(archive.path)[0]
+
+    current, images = None, []
+    with tarfile.open(archive.path, mode="r|gz") as archive_file:
+        for member, info, bundle_start in _archive_members(
+                archive_file, extract_dir, raw, start, end, bundle):
+            if bundle_start != current:
+                if images:
+                    yield current, images
+                current, images = bundle_start, []
+
+            images.append((
+                member.name, info, archive_file.extractfile(member).read()))
+
+    if images:
+        yield current, images
+
+
+def _convert_archive_bundle(
+        archive, raw, output, mask, bundle_start, bundle, images, packed=False,
+        encoding=None, manifest=None, settings=None, force=False,
+        statistics=None):
+    """Convert the images of one bundle from an archive to a netCDF file.
+
+    Args:
+        archive: A FileInfo object of the archive.
+        raw: The FileSet object of the extracted raw files.
+        output: The FileSet object where the movie should be saved. If None,
+            the movie is not saved.
+        mask: A mask that should be applied on the movie.
+        bundle_start: The start of the bundle as pandas.Timestamp.
+        bundle: The time period of one bundle (e.g. "1h").
+        images: All images of this bundle (see
+            :func:`_read_archive_bundles`).
+        packed, encoding, manifest, settings, force, statistics: See
+            :func:`_convert_archive`.
+
+    Returns:
+        True if the bundle was converted, False if it was up-to-date or none
+        of its images could be read.
+    """
+    bundle_name = _bundle_name("Pinocchio", bundle_start, bundle)
+    inputs = stats_inputs = None
+    if manifest is not None:
+        inputs = {
+            "archive": file_stats([archive.path]),
+            "members": sorted(name for name, _, _ in images),
+            "settings": settings,
+        }
+        if statistics is not None:
+            stats_inputs = _fused_stats_inputs(
+                inputs, statistics["config"], statistics["metadata"],
+                bundle_start, bundle_start + pd.Timedelta(bundle)
+            )
+        if not force \
+                and (output is None or manifest.is_done(
+                    "convert", bundle_name, inputs)) \
+                and (statistics is None or manifest.is_done(
+                    "stats", bundle_name, stats_inputs)):
+            return False
+
+    builder = cloud.MovieBuilder(len(images))
+    infos = []
+    for name, info, content in images:
+        try:
+            raw.handler.read_frame(
+                io.BytesIO(content), builder, info.times[0])
+            infos.append(info)
+        except Exception:
+            logging.error(
+                "Could not read %s from %s:" % (name, archive.path),
+                exc_info=True
+            )
+
+    # The builder sorts the images by their time:
+    movie = _build_movie(builder, mask, packed, encoding)
+    if movie is None:
+        return False
+
+    movie_file, stats_file = _save_bundle(movie, infos, output, statistics)
+    _record_bundle(
+        manifest, bundle_name, inputs, stats_inputs, (movie_file, stats_file))
+    return True
+
+
+def _convert_archive(
+        archive, raw, output, mask, start, end, bundle, packed=False,
+        encoding=None, manifest=None, settings=None, force=False,
+        statistics=None):
+    """Convert all images of one archive to netCDF files.
+
+    The images are kept encoded in memory until their bundle is complete.
+    Then they are decoded and joined to a movie. The images of one bundle are
+    normally stored one after another, i.e. the bundle is complete when the
+    next one begins. Archives that are not sorted like this are detected
+    beforehand by reading only the member headers: the images of their split
+    bundles are kept until the last of them has been read. Hence, no movie is
+    saved with only a part of its images.
+
+    Args:
+        archive: A FileInfo object of the archive.
+        raw: The FileSet object of the extracted raw files.
+        output: The FileSet object where the movies should be saved. If
+            None, the movies are not saved.
+        mask: A mask that should be applied on those movies
+        start: Start time as pandas.Timestamp.
+        end: End time as pandas.Timestamp.
+        bundle: The time period of one bundle (e.g. "1h").
+        packed: If true, only the pixels inside the mask are kept.
+        encoding: A dictionary with keyword arguments for
+            :meth:`cloud.Movie.set_encoding`.
+        manifest: A cloud.manifest.Manifest object. Bundles that are
+            up-to-date are skipped, converted bundles are recorded in it.
+        settings: The conversion settings for the manifest.
+        force: If true, also bundles that are up-to-date are converted.
+        statistics: Calculate also the cloud statistics of the movies (see
+            :func:`_save_bundle`). Needs additionally the key *metadata* for
+            the manifest.
+
+    Returns:
+        A list with the starts of the converted bundles.
+    """
+
+    logging.info("Convert all files from %s" % archive.path)
+
+    # Bundles with more than one run are split in the archive:
+    runs = _count_archive_runs(archive, raw, start, end, bundle)
+    split = sum(count > 1 for count in runs.values())
+    if split:
+        logging.warning(
+            "The images in %s are not sorted by time, %d bundles are kept in "
+            "memory until they are complete" % (archive.path, split))
+
+    pending = defaultdict(list)
+    converted = []
+    for bundle_start, images in _read_archive_bundles(
+            archive, raw, start, end, bundle):
+        pending[bundle_start].extend(images)
+        runs[bundle_start] -= 1
+        if runs[bundle_start] > 0:
+            # More images of this bundle follow later in the archive:
+            continue
+
+        if _convert_archive_bundle(
+                archive, raw, output, mask, bundle_start, bundle,
+                pending.pop(bundle_start), packed, encoding, manifest,
+                settings, force, statistics):
+            converted.append(bundle_start)
+
+    return converted
+
+
+def _archive_kwargs(
+        filesets, config, start, end, bundle, force, statistics, save_movies):
+    """Get the keyword arguments of :func:`_convert_archive`"""
+    return {
+        "raw": filesets["Pinocchio-raw"],
+        "output": filesets["Pinocchio-netcdf"] if save_movies else None,
+        "mask": _load_mask(config, "Pinocchio"),
+        "start": pd.Timestamp(start),
+        "end": pd.Timestamp(end),
+        "bundle": bundle,
+        "packed": _is_packed(config, "Pinocchio"),
+        "encoding": _get_encoding(config, "Pinocchio"),
+        "manifest": _load_manifest(config),
+        "settings": _conversion_inputs(config, "Pinocchio"),
+        "force": force,
+        "statistics": statistics,
+    }
+
+
+def convert_archive_files(
+        filesets, config, start, end, bundle="1h", force=False,
+        statistics=False, save_movies=True, rollups=True):
+    """Convert the images from the Pinocchio archives to netCDF format.
+
+    Works like :func:`convert_raw_files` but reads the images directly from
+    the archive files (set by [Pinocchio][archive_files]). Nothing is
+    extracted to the disk and only those images that lie between *start* and
+    *end* are decoded.
+
+    Args:
+        filesets: A FileSetManager object.
+        config: A dictionary-like object with configuration keys.
+        start: Start time as string.
+        end: End time as string.
+        bundle: The time period of one movie. Default is one hour.
+        force: If true, also bundles that are up-to-date according to the
+            manifest ([General][manifest]) are converted again.
+        statistics: If true, calculate also the cloud statistics (see
+            :func:`convert_raw_files`).
+        save_movies: If false (and *statistics* is true), the converted
+            movies are not saved.
+        rollups: If false, the rollups are not updated (see
+            :func:`update_rollups`).
+
+    Returns:
+        None
+    """
+
+    logging.info("Convert the images from the archives to netcdf")
+
+    stats_kwargs = None
+    if statistics:
+        metadata, temperatures = _load_temperatures(
+            filesets, config, start, end)
+        stats_kwargs = _statistics_kwargs(
+            filesets, "Pinocchio", config, metadata, temperatures)
+    else:
+        save_movies = True
+
+    # Each archive contains the images of one day, i.e. each worker processes
+    # one archive:
+    filesets["Pinocchio-archive"].map(
+        func=_convert_archive, start=start, end=end,
+        kwargs=_archive_kwargs(
+            filesets, config, start, end, bundle, force, stats_kwargs,
+            save_movies
+        ),
     )
 
+    if statistics and rollups:
+        update_rollups(filesets, "Pinocchio", config, start, end)
+
+
+def _uncompressed_size(path):
+    """Get the uncompressed size of a gzip file (e.g. a .tgz archive)
+
+    gzip saves the size modulo 4 GiB in its last four bytes. The images in
+    the archives can hardly be compressed, hence we take the first size
+    with this remainder that is not smaller than the compressed size.
+
+    Args:
+        path: Path of the file.
+
+    Returns:
+        The uncompressed size in bytes (the size of the file if it is not
+        compressed with gzip).
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        if file.read(2) != b"\x1f\x8b":
+            return size
+        file.seek(-4, os.SEEK_END)
+        remainder = struct.unpack("<I", file.read(4))[0]
+
+    wraps = max(0, -(-(size - remainder) // 2**32))
+    return remainder + wraps * 2**32
+
+
+def process_instruments(
+        filesets, instruments, config, start, end, force=False,
+        statistics=True, save_movies=True, archives=False, rollups=True):
+    """Convert the files of several instruments in one shared worker pool.
+
+    Works like :func:`convert_raw_files` (or :func:`convert_archive_files`)
+    for each instrument but the air temperature is read only once and all
+    bundles of all instruments are processed by one pool of
+    [General][processes] worker processes. The largest bundles are started
+    first, so the pool stays busy until the end and the instruments finish at
+    roughly the same time.
+
+    Args:
+        filesets: A FileSetManager object.
+        instruments: A list of instrument names.
+        config: A dictionary-like object with configuration keys.
+        start: Start time as string.
+        end: End time as string.
+        force: If true, also bundles that are up-to-date according to the
+            manifest ([General][manifest]) are converted again.
+        statistics: If true, calculate also the cloud statistics.
+        save_movies: If false (and *statistics* is true), the converted
+            movies are not saved.
+        archives: If true, the Pinocchio images are read directly from the
+            archives (one job per archive).
+        rollups: If false, the rollups are not updated (see
+            :func:`update_rollups`).
+
+    Returns:
+        None
+    """
+    manifest = _load_manifest(config)
+
+    metadata = temperatures = None
+    if statistics:
+        metadata, temperatures = _load_temperatures(
+            filesets, config, start, end)
+    else:
+        save_movies = True
+
+    # Collect the jobs of all instruments. Each job is a tuple of its size in
+    # bytes (of the uncompressed raw files), the instrument, the function with
+    # its arguments and the manifest entries of its bundle:
+    jobs = []
+    archive_bundle = "1h"
+    for instrument in instruments:
+        stats_kwargs = None
+        if statistics:
+            stats_kwargs = _statistics_kwargs(
+                filesets, instrument, config, metadata, temperatures)
 
-def _cloud_parameters(images, temperatures, config):
+        try:
+            if archives and instrument == "Pinocchio":
+                # Each archive records its bundles by itself:
+                kwargs = _archive_kwargs(
+                    filesets, config, start, end, archive_bundle, force,
+                    stats_kwargs, save_movies
+                )
+                for archive in filesets["Pinocchio-archive"].find(start, end):
+                    jobs.append((
+                        _uncompressed_size(archive.path), instrument,
+                        _convert_archive, (archive,), kwargs, None
+                    ))
+                continue
+
+            kwargs = _raw_kwargs(
+                filesets, instrument, config, stats_kwargs, save_movies)
+            for bundle in _find_raw_bundles(
+                    filesets[instrument+"-raw"], instrument, config, start,
+                    end, manifest, force, metadata, save_movies):
+                size = sum(
+                    stat[1] or 0 for stat in bundle[2]["files"])
+                jobs.append((
+                    size, instrument, _convert_files, (bundle[1],), kwargs,
+                    bundle
+                ))
+        except NoFilesError as err:
+            logging.info(str(err))
+
+    logging.info("%d jobs to process for %s" % (
+        len(jobs), ", ".join(instruments)))
+    if not jobs:
+        return
+
+    # Longest jobs first, otherwise one large bundle at the end could keep
+    # all other workers waiting:
+    jobs.sort(key=lambda job: job[0], reverse=True)
+
+    processed = defaultdict(list)
+    with ProcessPoolExecutor(
+            max_workers=int(config["General"]["processes"])) as pool:
+        futures = {
+            pool.submit(func, *args, **kwargs): (instrument, bundle)
+            for _, instrument, func, args, kwargs, bundle in jobs
+        }
+
+        for future in as_completed(futures):
+            instrument, bundle = futures[future]
+            try:
+                written = future.result()
+            except Exception:
+                logging.error(
+                    "Could not process a job of %s:" % instrument,
+                    exc_info=True
+                )
+                continue
+
+            if bundle is None:
+                # An archive job returns the starts of its converted bundles:
+                for bundle_start in written:
+                    processed[instrument].extend([
+                        bundle_start,
+                        bundle_start + pd.Timedelta(archive_bundle)])
+                continue
+
+            name, files, inputs, stats_inputs = bundle
+            _record_bundle(manifest, name, inputs, stats_inputs, written)
+            processed[instrument].extend(
+                [files[0].times[0], files[-1].times[1]])
+
+    if statistics and rollups:
+        for instrument, times in processed.items():
+            update_rollups(
+                filesets, instrument, config,
+                min(pd.Timestamp(time) for time in times),
+                max(pd.Timestamp(time) for time in times),
+            )
+
+
+def _cloud_parameters(images, temperatures, config, sample=None, sweep=None):
     """Helper function for calculating cloud statistics.
 
     Args:
         images: A list with xarray.Dataset objects.
+        temperatures: The interpolation function of the air temperature.
+        config: A dictionary-like object with configuration keys.
+        sample: A cloud.PixelSample object for approximate statistics (see
+            :meth:`cloud.ThermalCamMovie.cloud_parameters`).
+        sweep: A list of level configurations (see :func:`_sweep_levels`).
+            If given, the statistics are calculated for all of them and get
+            the additional dimension *config*.
 
     Returns:
         A xarray.Dataset object with cloud parameters
@@ -112,11 +1224,22 @@ def _cloud_parameters(images, temperatures, config):
     logging.info("Calculate cloud parameters between %s and %s" % (start, end))
 
     try:
+        if sweep is None:
+            return movie.cloud_parameters(
+                temperatures, _get_levels(config), sample=sample,
+                histogram_bins=_get_histogram_bins(config),
+            )
+
+        names, levels = _sweep_levels(config, sweep)
         parameters = movie.cloud_parameters(
-            temperatures,
-            [float(config["General"]["lapse_rate"]) * 2.,
-             float(config["General"]["lapse_rate"]) * 4.,
-             float(config["General"]["lapse_rate"]) * 6.]
+            temperatures, levels, sample=sample)
+        parameters["config"] = names
+        parameters.coords["level_threshold"] = xr.DataArray(
+            levels, dims=["config", "level"], attrs={
+                "description": "lower boundary of the level relative to the "
+                               "surface temperature",
+                "units": "temperature [K]",
+            }
         )
         return parameters
     except Exception:  # noqa
@@ -125,10 +1248,153 @@ def _cloud_parameters(images, temperatures, config):
     return None
 
 
-def calculate_cloud_statistics(filesets, instrument, config, start, end,):
+def _get_memory_budget(config):
+    """Get the memory budget for one worker process from *config*.
+
+    Args:
+        config: A dictionary-like object with configuration keys.
+
+    Returns:
+        The memory budget in bytes or None if [General][memory_budget] is not
+        set.
+    """
+    if "memory_budget" not in config["General"]:
+        return None
+
+    return int(float(config["General"]["memory_budget"]) * 2**20)
+
+
+def _get_prefetch(config):
+    """Get the prefetch settings for reading raw files from *config*.
+
+    Args:
+        config: A dictionary-like object with configuration keys.
+
+    Returns:
+        A tuple of the queue depth ([General][prefetch]) and the number of
+        threads ([General][prefetch_threads]) or None if prefetching is
+        disabled.
+    """
+    depth = int(config["General"].get("prefetch", 0))
+    if depth <= 0:
+        return None
+
+    threads = int(config["General"].get("prefetch_threads", 2))
+    return depth, max(1, min(threads, depth))
+
+
+def _cloud_parameters_chunked(
+        file_info, temperatures, config, memory_budget, sample=None,
+        sweep=None):
+    """Calculate the cloud statistics of a movie file slice by slice.
+
+    The movie is opened lazily and only as many images are loaded at once as
+    fit into *memory_budget*. Hence, the memory usage does not depend on the
+    length of the movie.
+
+    Args:
+        file_info: A FileInfo object of the movie file.
+        temperatures: The interpolation function of the air temperature.
+        config: A dictionary-like object with configuration keys.
+        memory_budget: The maximum size of the loaded images in bytes.
+        sample: A cloud.PixelSample object for approximate statistics.
+        sweep: A list of level configurations (see :func:`_sweep_levels`).
+
+    Returns:
+        A xarray.Dataset object with cloud parameters
+    """
+    # The movies can also be saved to Zarr stores (see cloud.store):
+    engine = "zarr" if file_info.path.endswith(".zarr") else None
+
+    parameters = []
+    with xr.open_dataset(file_info.path, engine=engine) as movie:
+        images = movie["images"]
+        frame_size = images.dtype.itemsize * int(np.prod(images.shape[1:]))
+        frames = max(1, memory_budget // max(1, frame_size))
+
+        for start in range(0, images.shape[0], frames):
+            parameters.append(_cloud_parameters(
+                movie.isel(time=slice(start, start + frames)).load(),
+                temperatures, config, sample, sweep
+            ))
+            if parameters[-1] is None:
+                return None
+
+    if not parameters:
+        return None
+
+    return xr.concat(parameters, dim="time")
+
+
+def _find_outdated_movies(
+        filesets, instrument, config, start, end, metadata, force,
+        sweep=None):
+    """Find all movies whose cloud statistics have to be calculated.
+
+    Args:
+        filesets: A FileSetManager object.
+        instrument: The name of the instrument that should be processed.
+        config: A dictionary-like object with configuration keys.
+        start: Start time as string.
+        end: End time as string.
+        metadata: A xarray.Dataset with the air temperature.
+        force: If true, all movies are returned.
+        sweep: A list of level configurations (see :func:`_sweep_levels`).
+            If given, the movies are checked against the *sweep* stage of
+            the manifest.
+
+    Returns:
+        A list of tuples with the bundle name, the FileInfo object of the
+        movie and the inputs for the manifest.
+    """
+    manifest = _load_manifest(config)
+
+    movies = []
+    for movie in filesets[instrument+"-netcdf"].find(start, end):
+        name = _bundle_name(instrument, movie.times[0])
+
+        inputs = {
+            "movie": file_stats([movie.path]),
+            "metadata": _metadata_fingerprint(
+                metadata, movie.times[0], movie.times[1]),
+            **_statistics_inputs(config),
+        }
+        if sweep is not None:
+            inputs["sweep"] = sweep
+        if not force and manifest is not None \
+                and manifest.is_done(
+                    "stats" if sweep is None else "sweep", name, inputs):
+            continue
+        movies.append((name, movie, inputs))
+
+    return movies
+
+
+def calculate_cloud_statistics(
+        filesets, instrument, config, start, end, force=False, rollups=True,
+        sweep=None):
     """Calculate cloud statistics for a period of thermal cam images.
 
-    Uses the netcdf files from a instrument.
+    Uses the netcdf files from a instrument. If [General][manifest] is set,
+    only movies that are new or have changed since the last calculation are
+    processed.
+
+    With *sweep*, the statistics are calculated for several lapse rates or
+    level thresholds at once. Each movie is read only once and all
+    configurations are evaluated in one pass over its images. The results
+    get the additional dimension *config* and are saved to the fileset
+    "INSTRUMENT-sweep" (see [INSTRUMENT][sweep]) instead of the normal
+    statistics. No rollups are made from them.
+
+    Example:
+
+    .. code-block:: python
+
+        calculate_cloud_statistics(
+            filesets, "Pinocchio", config, "2017-11-02", "2017-11-03",
+            sweep=[{"lapse_rate": -4}, {"lapse_rate": -5},
+                   {"lapse_rate": -6.5}, {"levels": [-10, -20, -30]}],
+        )
 
     Args:
         filesets: A FileSetManager object.
@@ -136,6 +1402,16 @@ def calculate_cloud_statistics(filesets, instrument, config, start, end,):
         config: A dictionary-like object with configuration keys.
         start: Start time as string.
         end: End time as string.
+        force: If true, also bundles that are up-to-date according to the
+            manifest are calculated again.
+        rollups: If false, the rollups are not updated (see
+            :func:`update_rollups`).
+        sweep: A list of configurations. Each configuration is a dictionary
+            with either the key *lapse_rate* (in K / km) or *levels* (a list
+            with the temperature thresholds of the levels relative to the
+            surface temperature) and optionally a *name* for the coordinate
+            *config*. All configurations must have the same number of
+            levels.
 
     Returns:
         None
@@ -143,35 +1419,270 @@ def calculate_cloud_statistics(filesets, instrument, config, start, end,):
     logging.info(
         f"Prepare calculation of cloud parameters between {start} and {end}")
 
-    # For classifying the clouds by their height, we need the air
-    # temperature from a metadata dataset (usually DShip)
-    logging.info(
-        "Get air temperature from %s dataset" % config["General"]["metadata"])
+    if sweep is None:
+        stage, output = "stats", filesets[instrument+"-stats"]
+    else:
+        stage, output = "sweep", filesets[instrument+"-sweep"]
+        # Fail before reading any movie:
+        _sweep_levels(config, sweep)
 
-    # A list with a data object for each metadata file:
-    metadata = xr.concat(
-        filesets[config["General"]["metadata"]].collect(
-            start, end, read_args={"fields": ["air_temperature"]},
-        ), dim="time"
+    metadata, temperatures = _load_temperatures(filesets, config, start, end)
+
+    movies = _find_outdated_movies(
+        filesets, instrument, config, start, end, metadata, force, sweep)
+    logging.info("%d movies to process" % len(movies))
+    if not movies:
+        return
+
+    # Calculate the cloud parameters for each image and store them to the
+    # fileset "INSTRUMENT-stats" (or "INSTRUMENT-sweep") where INSTRUMENT is
+    # the name of the instrument:
+    memory_budget = _get_memory_budget(config)
+    sample = _get_pixel_sample(config, instrument)
+    if memory_budget is None:
+        results = filesets[instrument+"-netcdf"].imap(
+            func=_cloud_parameters, files=[movie for _, movie, _ in movies],
+            kwargs={
+                "temperatures": temperatures,
+                "config": config,
+                "sample": sample,
+                "sweep": sweep,
+            },
+            on_content=True, output=output,
+        )
+    else:
+        # Do not load whole movies at once but process them in time slices:
+        results = filesets[instrument+"-netcdf"].imap(
+            func=_cloud_parameters_chunked,
+            files=[movie for _, movie, _ in movies],
+            kwargs={
+                "temperatures": temperatures,
+                "config": config,
+                "memory_budget": memory_budget,
+                "sample": sample,
+                "sweep": sweep,
+            },
+            output=output,
+        )
+
+    # Record each bundle as soon as it is written, so an aborted run can be
+    # resumed:
+    manifest = _load_manifest(config)
+    for (name, movie, inputs), written in zip(movies, results):
+        if written and manifest is not None:
+            manifest.record(
+                stage, name, inputs, _get_output_filename(output, movie)
+            )
+
+    # The coarser versions of the statistics have to be updated as well (only
+    # for the days that have been processed now):
+    if not rollups or sweep is not None:
+        return
+    update_rollups(
+        filesets, instrument, config,
+        min(movie.times[0] for _, movie, _ in movies),
+        max(movie.times[1] for _, movie, _ in movies),
     )
 
-    # Interpolate the ground temperature from ship data. Note: the data will be
-    # extrapolated outside of the time coverage of the DShip data (hence, we
-    # should not use the data outside from the time coverage):
-    temperatures = interp1d(
-        metadata["time"].data.astype("M8[s]").astype("int"),
-        metadata["air_temperature"].data, fill_value="extrapolate"
+
+def _get_rollup_resolutions(config):
+    """Get the resolutions of the rollups sorted from fine to coarse"""
+    return sorted(
+        (resolution.strip()
+         for resolution in config["General"]["rollups"].split(",")),
+        key=pd.to_timedelta
     )
 
-    # Calculate the cloud parameters for each image and store them to the
-    # fileset "INSTRUMENT-stats" where INSTRUMENT is the name of the
-    # instrument:
-    filesets[instrument+"-netcdf"].map(
-        func=_cloud_parameters, start=start, end=end,
-        kwargs={
-            "temperatures": temperatures,
-            "config": config,
-        },
-        on_content=True, output=filesets[instrument+"-stats"],
+
+def _rollup(data, resolution):
+    """Aggregate cloud statistics to a coarser time resolution.
+
+    Args:
+        data: A xarray.Dataset with cloud statistics.
+        resolution: The new time resolution (e.g. "10min").
+
+    Returns:
+        A xarray.Dataset with the mean of each variable (under its original
+        name) and its number of values, minimum and maximum (with the suffixes
+        *_count*, *_min* and *_max*). Time bins without any data are dropped.
+    """
+    rollup = cloud.resample(data, resolution)
+    for how in ("count", "min", "max"):
+        aggregated = cloud.resample(data, resolution, how)
+        for var in data.data_vars:
+            rollup[var + "_" + how] = aggregated[var]
+
+    has_data = np.zeros(rollup["time"].size, dtype=bool)
+    for var in data.data_vars:
+        rollup[var].attrs = data[var].attrs
+        # The time is the first dimension of all statistics. Empty bins have
+        # the count 0 or (with newer xarray versions) NaN:
+        counts = rollup[var + "_count"].values
+        has_data |= (counts.reshape(counts.shape[0], -1) > 0).any(axis=1)
+
+    return rollup.isel(time=has_data)
+
+
+def update_rollups(filesets, instrument, config, start, end):
+    """Update the rollups of the cloud statistics of an instrument.
+
+    The rollups are the cloud statistics aggregated to the coarser time
+    resolutions set by [General][rollups] (with count, mean, minimum and
+    maximum). They are saved to one file per day and resolution in the fileset
+    "INSTRUMENT-rollups". All days between *start* and *end* are rebuilt from
+    their statistics files.
+
+    Args:
+        filesets: A FileSetManager object.
+        instrument: The name of the instrument that should be processed.
+        config: A dictionary-like object with configuration keys.
+        start: Start time as string.
+        end: End time as string.
+
+    Returns:
+        None
+    """
+    if instrument+"-rollups" not in filesets:
+        return
+
+    stats = filesets[instrument+"-stats"]
+    rollups = filesets[instrument+"-rollups"]
+    resolutions = _get_rollup_resolutions(config)
+    end = pd.Timestamp(end)
+
+    for day in pd.date_range(pd.Timestamp(start).floor("D"), end, freq="D"):
+        if day >= end:
+            break
+
+        logging.info("Update the rollups of %s for %s" % (instrument, day))
+        next_day = day + pd.Timedelta("1D")
+        try:
+            data = xr.concat(stats.collect(day, next_day), dim="time")
+        except NoFilesError:
+            continue
+
+        data = data.sortby("time").sel(
+            time=slice(day, next_day - pd.Timedelta("1ns")))
+        # Only the statistics of the levels are aggregated (not the
+        # temperature histograms):
+        data = data[[
+            var for var in data.data_vars if "level" in data[var].dims
+        ]]
+        for resolution in resolutions:
+            filename = rollups.get_filename(
+                (day, next_day), fill={"resolution": resolution}
+            )
+            rollups.write(_rollup(data, resolution), filename)
+
+
+def read_rollups(fileset, config, start, end, resolution):
+    """Read cloud statistics from the rollups in a time resolution
+
+    The coarsest rollup that divides *resolution* is used. If it is finer than
+    *resolution*, its means are aggregated again (weighted by their number of
+    values).
+
+    Args:
+        fileset: The FileSet object with the rollups of an instrument.
+        config: A dictionary-like object with configuration keys.
+        start: Start time as string.
+        end: End time as string.
+        resolution: The requested time resolution (e.g. "1H").
+
+    Returns:
+        A xarray.Dataset with the mean cloud statistics or None if there is no
+        rollup that fits to *resolution*.
+    """
+    requested = pd.to_timedelta(resolution)
+    usable = [
+        rollup for rollup in _get_rollup_resolutions(config)
+        if pd.to_timedelta(rollup) <= requested
+        and requested % pd.to_timedelta(rollup) == pd.Timedelta(0)
+    ]
+    if not usable:
+        return None
+
+    rollup = usable[-1]
+    data = xr.concat(
+        [fileset.read(file)
+         for file in fileset.find(start, end,
+                                  filters={"resolution": rollup})],
+        dim="time"
     )
+    data = data.sortby("time").sel(time=slice(start, end))
+    variables = [var for var in data.data_vars if var+"_count" in data]
+
+    if pd.to_timedelta(rollup) == requested:
+        return data[variables]
+
+    result = xr.Dataset()
+    for var in variables:
+        counts = data[var+"_count"]
+        sums = cloud.resample(
+            (data[var] * counts).fillna(0), resolution, "sum")
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result[var] = sums / cloud.resample(counts, resolution, "sum")
+        result[var].attrs = data[var].attrs
+
+    return result
+
+
+def recalculate_cloud_statistics(
+        filesets, instrument, config, start, end, lapse_rate=None,
+        levels=None, temperatures=None):
+    """Recalculate cloud statistics for other thresholds without the movies
+
+    Needs the temperature histograms in the cloud statistics (see
+    [General][histogram_bins]). The coverage, mean, minimum and maximum
+    temperature are approximated from them (see
+    :func:`cloud.histogram_statistics`). Nothing is written, hence this can
+    be used to study how sensitive the statistics are to the thresholds.
+
+    Args:
+        filesets: A FileSetManager object.
+        instrument: The name of the instrument.
+        config: A dictionary-like object with configuration keys.
+        start: Start time as string.
+        end: End time as string.
+        lapse_rate: The lapse rate [K / km] for the height levels. If None,
+            [General][lapse_rate] is used.
+        levels: A list with the temperature thresholds of the levels
+            (relative to the surface temperature). Overrides *lapse_rate*.
+        temperatures: The surface temperature, either as number (in °C) or as
+            function of the time (see
+            :meth:`cloud.ThermalCamMovie.cloud_parameters`). If None, the air
+            temperature from the metadata is used.
+
+    Returns:
+        A xarray.Dataset with the cloud statistics.
+    """
+    histograms = []
+    for data in filesets[instrument+"-stats"].collect(start, end):
+        if cloud.movies.HISTOGRAM not in data:
+            logging.warning(
+                "Skip statistics from %s to %s without temperature "
+                "histograms" % (data["time"].values[0],
+                                data["time"].values[-1]))
+            continue
+        histograms.append(data[[cloud.movies.HISTOGRAM]])
+
+    if not histograms:
+        raise ValueError(
+            "The statistics of %s contain no temperature histograms! Set "
+            "[General][histogram_bins] and calculate them again." % instrument)
+
+    data = xr.concat(histograms, dim="time").sortby("time").sel(
+        time=slice(start, end))
+
+    if temperatures is None:
+        _, temperatures = _load_temperatures(filesets, config, start, end)
+    elif not callable(temperatures):
+        surface_temperature = float(temperatures)
+
+        def temperatures(time):
+            return np.full(len(time), surface_temperature)
+
+    if levels is None:
+        levels = _get_levels(config, lapse_rate)
 
+    return cloud.histogram_cloud_parameters(data, temperatures, levels)
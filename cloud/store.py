@@ -0,0 +1,234 @@
+"""Time-partitioned Zarr stores for movies and cloud statistics.
+
+Instead of one netCDF file per bundle that has to be found by searching the
+directories, each bundle (e.g. one hour) is saved to its own Zarr store below
+one root directory. Its location is calculated from the start of the bundle,
+so readers know where the data of a period is without listing any directory.
+Workers write to different stores and hence need no locks. However, each
+store must not have more than one writer at a time (the bundles are split
+between the workers, see cloud.WorkQueue).
+
+The bundles are not appended to one large store along the time axis:
+appending resizes the arrays, which is not safe with several writers, and a
+bundle that is converted again would have to be replaced inside the
+arrays. Hence, writing a bundle replaces its whole store.
+
+Zarr must be installed to use this (xarray loads it when needed).
+"""
+
+import os
+import shutil
+
+import pandas as pd
+import xarray as xr
+from typhon.files import FileInfo, FileSet, NoFilesError
+
+__all__ = [
+    "ZarrFileSet",
+]
+
+# The encoding keys of netCDF that have an equivalent for Zarr:
+ZARR_ENCODING_KEYS = ("dtype", "scale_factor", "add_offset", "_FillValue")
+
+
+def _zarr_encoding(data):
+    """Translate the netCDF encoding of all variables to Zarr
+
+    Args:
+        data: A xarray.Dataset object.
+
+    Returns:
+        A dictionary with the encoding for each variable.
+    """
+    encoding = {}
+    for name, variable in data.variables.items():
+        encoding[name] = {
+            key: value for key, value in variable.encoding.items()
+            if key in ZARR_ENCODING_KEYS
+        }
+        if "chunksizes" in variable.encoding:
+            encoding[name]["chunks"] = variable.encoding["chunksizes"]
+    return encoding
+
+
+class ZarrFileSet(FileSet):
+    """A FileSet that saves each bundle to a Zarr store.
+
+    The stores are saved below *path* as *YYYY/MM/DD/hhmmss.zarr* where the
+    timestamp is the start of the bundle. This class supports the methods of
+    FileSet that the cloud toolbox needs (:meth:`find`, :meth:`read`,
+    :meth:`write`, :meth:`get_filename` and therefore also :meth:`map` and
+    :meth:`collect`).
+    """
+
+    def __init__(self, path, bundle="1H", **kwargs):
+        """Initialize a ZarrFileSet object.
+
+        Args:
+            path: The root directory of all stores.
+            bundle: The time period of one store (e.g. "1H" for hourly
+                stores).
+            **kwargs: Additional keyword arguments for the FileSet base class.
+        """
+        super(ZarrFileSet, self).__init__(path, **kwargs)
+        self.bundle = pd.Timedelta(bundle)
+
+    def _bundle_path(self, bundle_start):
+        return os.path.join(
+            self.path, bundle_start.strftime("%Y/%m/%d/%H%M%S.zarr")
+        )
+
+    def find(self, start=None, end=None, sort=True, only_path=False,
+             bundle=None, filters=None, no_files_error=True):
+        """Find all stores in a time period
+
+        Args:
+            start: Start date either as datetime object or as string.
+            end: End date (exclusive). Same format as "start".
+            sort: Ignored, the stores are always sorted.
+            only_path: If true, only the paths are yielded (not the FileInfo
+                objects).
+            bundle: Bundle the stores like :meth:`FileSet.find` does.
+            filters: Ignored.
+            no_files_error: If true, a NoFilesError is raised if no store
+                was found.
+
+        Yields:
+            A FileInfo object for each store (or a list of them if *bundle*
+            is set).
+        """
+        if start is None or end is None:
+            raise ValueError("ZarrFileSet.find needs a start and end date!")
+
+        # The end is exclusive like in FileSet.find, i.e. the store that
+        # starts at *end* belongs to the next period:
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        bundle_starts = pd.date_range(
+            start.floor(self.bundle), end, freq=self.bundle,
+            inclusive="left")
+
+        files = (
+            FileInfo(
+                self._bundle_path(bundle_start),
+                [bundle_start.to_pydatetime(),
+                 (bundle_start + self.bundle).to_pydatetime()],
+            )
+            for bundle_start in bundle_starts
+            if os.path.isdir(self._bundle_path(bundle_start))
+        )
+
+        found = False
+        for file in self._prepare_find_return(
+                files, True, only_path, bundle):
+            found = True
+            if only_path:
+                file = [info.path for info in file] \
+                    if isinstance(file, list) else file.path
+            yield file
+
+        if not found and no_files_error:
+            raise NoFilesError(self, start, end)
+
+    def get_filename(self, times, template=None, fill=None):
+        """Get the path of the store for a time period
+
+        Args:
+            times: A tuple of start and end time of the data.
+            template: Ignored.
+            fill: Ignored.
+
+        Returns:
+            The path of the store that contains the start of *times*.
+        """
+        if not isinstance(times, (tuple, list)):
+            times = [times]
+        return self._bundle_path(pd.Timestamp(times[0]).floor(self.bundle))
+
+    def read(self, file_info, fields=None, **read_args):
+        """Read a store into memory
+
+        Args:
+            file_info: Path of the store or FileInfo object.
+            fields: The names of the variables that should be read. If not
+                given, all variables are read.
+            **read_args: Additional keyword arguments for
+                xarray.open_zarr.
+
+        Returns:
+            A xarray.Dataset object.
+        """
+        path = getattr(file_info, "path", file_info)
+        with xr.open_zarr(path, chunks=None, **read_args) as data:
+            if fields is not None:
+                data = data[fields]
+            return data.load()
+
+    def read_period(self, start, end, fields=None):
+        """Read only the data of a time period
+
+        The stores are opened lazily and only the requested time slice of
+        each store is loaded.
+
+        Args:
+            start: Start date either as datetime object or as string.
+            end: End date. Same format as "start".
+            fields: The names of the variables that should be read. If not
+                given, all variables are read.
+
+        Returns:
+            A xarray.Dataset object.
+        """
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+
+        slices = []
+        for file_info in self.find(start, end):
+            with xr.open_zarr(file_info.path, chunks=None) as data:
+                if fields is not None:
+                    data = data[fields]
+                slices.append(
+                    data.sel(time=slice(start, end)).load()
+                )
+
+        return xr.concat(slices, dim="time")
+
+    def write(self, data, file_info, in_background=False, **write_args):
+        """Write a xarray.Dataset to a store
+
+        An existing store is replaced. The data is first written to a
+        temporary store and then renamed, hence readers never see a half
+        written store. Since directories cannot be replaced atomically, there
+        is a short moment between moving the old store away and renaming the
+        new one in which readers find no store at all. Only one process may
+        write to a store at a time.
+
+        Args:
+            data: A xarray.Dataset object.
+            file_info: Path of the store or FileInfo object.
+            in_background: Ignored.
+            **write_args: Additional keyword arguments for
+                xarray.Dataset.to_zarr.
+
+        Returns:
+            None
+        """
+        path = getattr(file_info, "path", file_info)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        temporary = "%s.%d.tmp" % (path, os.getpid())
+        data.to_zarr(
+            temporary, mode="w", encoding=_zarr_encoding(data), **write_args
+        )
+
+        # os.rename cannot replace directories, hence move the old store
+        # away first:
+        old = "%s.%d.old" % (path, os.getpid())
+        try:
+            os.rename(path, old)
+        except FileNotFoundError:
+            # There is no old store (anymore):
+            old = None
+
+        os.rename(temporary, path)
+        if old is not None:
+            shutil.rmtree(old, ignore_errors=True)
+
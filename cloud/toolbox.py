@@ -17,6 +17,8 @@ from typhon.files import FileSet, FileSetManager
 from typhon.files import Plotter
 
 from cloud import dumbo, pinocchio, metadata
+from cloud.index import FileIndex, IndexedFileSet
+from cloud.store import ZarrFileSet
 
 __all__ = [
     "DEFAULT_PARAM",
@@ -26,6 +28,7 @@ __all__ = [
     "load_filesets",
     "load_logbook",
     "load_mask",
+    "resample",
 ]
 
 
@@ -139,6 +142,40 @@ def load_config(filename=None):
     return config
 
 
+def _movie_fileset(config, instrument, product, option, store_option):
+    """Create the fileset for the movies or statistics of an instrument.
+
+    Depending on [General][storage], the data is saved to netCDF files or to
+    Zarr stores (see :class:`cloud.store.ZarrFileSet`).
+
+    Args:
+        config: Dictionary with configuration keys and values.
+        instrument: The name of the instrument.
+        product: Either *netcdf* (the movies), *stats* or *sweep* (the
+            statistics of a parameter sweep).
+        option: The config option with the path of the netCDF files.
+        store_option: The config option with the path of the Zarr stores.
+
+    Returns:
+        A FileSet object.
+    """
+    basedir = config["General"]["basedir"]
+    name = instrument + "-" + product
+
+    if config["General"].get("storage", "netcdf") == "zarr":
+        return ZarrFileSet(
+            name=name,
+            path=os.path.join(basedir, config[instrument][store_option]),
+            max_processes=int(config["General"]["processes"]),
+        )
+
+    return FileSet(
+        name=name,
+        path=os.path.join(basedir, config[instrument][option]),
+        max_processes=int(config["General"]["processes"]),
+    )
+
+
 def load_filesets(config):
     """Load all filesets into one FileSetManager object
 
@@ -154,19 +191,24 @@ def load_filesets(config):
     # This FileSetManager can handle all dataset objects:
     filesets = FileSetManager()
 
+    # The raw filesets contain many files. Searching them is much faster with
+    # a persistent index:
+    index = None
+    recheck = config["General"].getboolean("file_index_recheck", False)
+    if "file_index" in config["General"]:
+        index = FileIndex(
+            os.path.join(basedir, config["General"]["file_index"])
+        )
+
     ###########################################################################
     # Pinocchio - FileSets:
-    filesets += FileSet(
-        name="Pinocchio-netcdf",
-        path=os.path.join(
-            config["General"]["basedir"],
-            config["Pinocchio"]["nc_files"],
-        ),
-        max_processes=int(config["General"]["processes"]),
-    )
+    filesets += _movie_fileset(
+        config, "Pinocchio", "netcdf", "nc_files", "movies_store")
     filesets += FileSet(
         name="Pinocchio-archive",
         path=os.path.join(basedir, config["Pinocchio"]["archive_files"]),
+        # Each archive contains the images of one day:
+        time_coverage="24 hours",
         max_processes=int(config["General"]["processes"]),
     )
 
@@ -182,7 +224,7 @@ def load_filesets(config):
         config["General"]["basedir"],
         config["Pinocchio"]["calibration"],
     )
-    filesets += FileSet(
+    filesets += IndexedFileSet(
         name="Pinocchio-raw",
         path=os.path.join(
             config["General"]["basedir"],
@@ -191,30 +233,35 @@ def load_filesets(config):
         ),
         # Set the pinocchio file handler with the calibration file
         handler=pinocchio.ThermalCam(
-            calibration_file=pinocchio_calibration
+            calibration_file=pinocchio_calibration,
+            scale=int(config["Pinocchio"].get("scale", 1)),
         ),
         max_processes=int(config["General"]["processes"]),
         # Exclude the time intervals from the logbook when searching for files:
         exclude=logbook,
+        index=index,
+        recheck=recheck,
     )
 
-    filesets += FileSet(
-        path=os.path.join(basedir, config["Pinocchio"]["stats"]),
-        name="Pinocchio-stats",
-        max_processes=int(config["General"]["processes"]),
-    )
+    filesets += _movie_fileset(
+        config, "Pinocchio", "stats", "stats", "stats_store")
+    if "rollups" in config["Pinocchio"]:
+        filesets += FileSet(
+            path=os.path.join(basedir, config["Pinocchio"]["rollups"]),
+            name="Pinocchio-rollups",
+            # Each file contains the statistics of one day:
+            time_coverage="24 hours",
+            max_processes=int(config["General"]["processes"]),
+        )
+    if "sweep" in config["Pinocchio"]:
+        filesets += _movie_fileset(
+            config, "Pinocchio", "sweep", "sweep", "sweep_store")
     ###########################################################################
 
     ###########################################################################
     # Dumbo - FileSets:
-    filesets += FileSet(
-        name="Dumbo-netcdf",
-        path=os.path.join(
-            config["General"]["basedir"],
-            config["Dumbo"]["nc_files"],
-        ),
-        max_processes=int(config["General"]["processes"]),
-    )
+    filesets += _movie_fileset(
+        config, "Dumbo", "netcdf", "nc_files", "movies_store")
 
     # Load logbook from Dumbo:
     logbook = None
@@ -223,25 +270,37 @@ def load_filesets(config):
             os.path.join(basedir, config["Dumbo"]["logbook"])
         )
 
-    filesets += FileSet(
+    filesets += IndexedFileSet(
         name="Dumbo-raw",
         path=os.path.join(
             config["General"]["basedir"],
             config["Dumbo"]["raw_files"],
         ),
-        handler=dumbo.ThermalCamASCII(),
+        handler=dumbo.ThermalCamASCII(
+            cache=config["Dumbo"].getboolean("cache", False),
+        ),
         # Since the raw files have no temporal information in their filename,
         # we have to retrieve it from by their handler.
         info_via="handler",
         max_processes=int(config["General"]["processes"]),
         # Exclude the time intervals from the logbook when searching for files:
         exclude=logbook,
+        index=index,
+        recheck=recheck,
     )
-    filesets += FileSet(
-        path=os.path.join(basedir, config["Dumbo"]["stats"]),
-        name="Dumbo-stats",
-        max_processes=int(config["General"]["processes"]),
-    )
+    filesets += _movie_fileset(
+        config, "Dumbo", "stats", "stats", "stats_store")
+    if "rollups" in config["Dumbo"]:
+        filesets += FileSet(
+            path=os.path.join(basedir, config["Dumbo"]["rollups"]),
+            name="Dumbo-rollups",
+            # Each file contains the statistics of one day:
+            time_coverage="24 hours",
+            max_processes=int(config["General"]["processes"]),
+        )
+    if "sweep" in config["Dumbo"]:
+        filesets += _movie_fileset(
+            config, "Dumbo", "sweep", "sweep", "sweep_store")
     ###########################################################################
 
     filesets += FileSet(
@@ -251,9 +310,12 @@ def load_filesets(config):
         time_coverage="24 hours",
         max_processes=int(config["General"]["processes"]),
     )
+    dship_cache = None
+    if "cache" in config["DShip"]:
+        dship_cache = os.path.join(basedir, config["DShip"]["cache"])
     filesets += FileSet(
         path=os.path.join(basedir, config["DShip"]["files"]),
-        handler=metadata.ShipMSM(),
+        handler=metadata.ShipMSM(cache_dir=dship_cache),
         name="DShip",
         max_processes=int(config["General"]["processes"]),
     )
@@ -306,7 +368,23 @@ def load_logbook(filename):
     return data.astype("O")
 
 
-def load_mask(filename):
+def _downscale_mask(mask, scale):
+    """Reduce the resolution of a mask by an integer factor
+
+    A pixel of the reduced mask is only valid if all pixels of its block are
+    valid. The blocks start in the first row and column (like the blocks of
+    the JPEG decoder).
+    """
+    height, width = mask.shape
+    padded = np.zeros(
+        (-(-height // scale) * scale, -(-width // scale) * scale), dtype=bool)
+    padded[:height, :width] = mask
+    return padded.reshape(
+        padded.shape[0] // scale, scale, padded.shape[1] // scale, scale
+    ).all(axis=(1, 3))
+
+
+def load_mask(filename, scale=1):
     """Loads a mask file and returns it as a numpy array where the masked
     values are False.
 
@@ -314,6 +392,10 @@ def load_mask(filename):
 
     Args:
         filename: Path and name of the mask file
+        scale: Reduce the resolution of the mask by this factor (e.g. for
+            images decoded with a reduced resolution, see
+            :class:`cloud.pinocchio.ThermalCam`). A reduced pixel is only
+            valid if all its original pixels are valid.
 
     Returns:
         numpy.array with w x h dimensions.
@@ -329,8 +411,12 @@ def load_mask(filename):
 
         # convert it to a grey scale image
         mask = np.float32(np.array(image.convert('L')))
-        mask = np.flipud(mask)
         mask = mask == 255
+        if scale > 1:
+            # Before flipping, so the blocks match those of the images:
+            mask = _downscale_mask(mask, scale)
+            scale = 1
+        mask = np.flipud(mask)
     elif filename.endswith(".txt"):
         # Count the number of columns in that mask file.
         with open(filename, "r") as f:
@@ -345,4 +431,32 @@ def load_mask(filename):
 
         mask = mask == 1
 
+    if scale > 1:
+        mask = _downscale_mask(mask, scale)
+
     return mask
+
+
+def resample(data, resolution, how="mean"):
+    """Resample data along the time dimension
+
+    Works with the resample API of xarray before version 0.10 (with the
+    arguments *dim* and *how*) and with the newer one (with a resampler
+    object).
+
+    Args:
+        data: A xarray.Dataset or xarray.DataArray object with the dimension
+            *time*.
+        resolution: The new time resolution (e.g. "10min").
+        how: The name of the aggregation method (e.g. *mean*, *sum*,
+            *count*, *min* or *max*).
+
+    Returns:
+        A xarray object of the same type like *data*.
+    """
+    try:
+        resampler = data.resample(time=resolution)
+    except TypeError:
+        # Old xarray versions know only the resample method with *how*:
+        return data.resample(resolution, dim="time", how=how)
+    return getattr(resampler, how)(keep_attrs=False)
@@ -0,0 +1,259 @@
+"""A work queue on a shared filesystem.
+
+Several workers (e.g. processor.py on different nodes) can cooperate on the
+same jobs without any broker: a worker claims a job by creating its lock file
+atomically (only one worker can create it), keeps the lock file fresh while
+working on it and leaves a done file behind when it has finished. Lock files
+that have not been refreshed for a while belong to dead workers and are
+reclaimed by others.
+
+The age of a lock file is measured with the clock of the filesystem (the
+modification time of a file touched just now), not with the local clock.
+Hence, the clocks of the nodes do not need to be synchronized.
+"""
+
+from datetime import datetime
+import logging
+import os
+import re
+import socket
+import threading
+
+__all__ = [
+    "WorkQueue",
+]
+
+
+class WorkQueue:
+    """Claim jobs via lock files in a shared directory.
+
+    The jobs are identified by their names. For each job, the directory may
+    contain a *NAME.lock* file (the job is processed by a worker right now)
+    and a *NAME.done* file (the job has been processed).
+
+    Example:
+
+    .. code-block:: python
+
+        queue = WorkQueue("/work/queue", timeout=600)
+        queue.process(["job1", "job2"], print)
+    """
+
+    def __init__(self, directory, timeout=3600):
+        """Initialize a WorkQueue object.
+
+        Args:
+            directory: The shared directory with the lock and done files.
+            timeout: A claim whose lock file has not been refreshed for this
+                many seconds is taken over by other workers. The lock files
+                are refreshed every tenth of this time. A worker that
+                notices that its claim has been taken over stops refreshing
+                it and does not mark the job as processed.
+        """
+        self.directory = directory
+        self.timeout = timeout
+        self.worker = "%s:%d" % (socket.gethostname(), os.getpid())
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job, suffix):
+        # Only characters that are safe for all filesystems:
+        return os.path.join(
+            self.directory, re.sub(r"[^\w\-.]", "_", job) + suffix
+        )
+
+    def _now(self):
+        """Get the current time of the filesystem of the queue directory
+
+        Returns:
+            The current time as timestamp (seconds).
+        """
+        # The lock files get their modification times from the filesystem
+        # (e.g. the NFS server). Compare them with a time from the same clock:
+        clock = os.path.join(
+            self.directory, ".clock.%s" % self.worker.replace(":", "_"))
+        with open(clock, "w"):
+            pass
+        now = os.stat(clock).st_mtime
+        os.remove(clock)
+        return now
+
+    def _owner(self, job):
+        """Get the worker that has claimed a job
+
+        Returns:
+            The name of the worker or None if the job is not claimed.
+        """
+        try:
+            with open(self._path(job, ".lock")) as file:
+                content = file.read().split()
+        except FileNotFoundError:
+            return None
+        return content[0] if content else None
+
+    def is_done(self, job):
+        """Check whether a job has been processed already"""
+        return os.path.exists(self._path(job, ".done"))
+
+    def claim(self, job):
+        """Try to claim a job
+
+        Args:
+            job: The name of the job.
+
+        Returns:
+            True if this worker may process the job now.
+        """
+        if self.is_done(job):
+            return False
+
+        lock = self._path(job, ".lock")
+        try:
+            # O_EXCL makes this atomic: only one worker can create the file
+            # (also on NFS >= v3 and Lustre).
+            handle = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if self._reclaim(lock):
+                return self.claim(job)
+            return False
+
+        with os.fdopen(handle, "w") as file:
+            file.write("%s %s\n" % (self.worker, datetime.now().isoformat()))
+        return True
+
+    def _reclaim(self, lock):
+        """Remove a lock file if its worker has not refreshed it for too long
+
+        Returns:
+            True if the lock file has been removed.
+        """
+        try:
+            with open(lock) as file:
+                owner = file.read()
+            age = self._now() - os.stat(lock).st_mtime
+        except FileNotFoundError:
+            # Released in the meantime:
+            return True
+
+        if age < self.timeout:
+            return False
+
+        # Several workers may want to reclaim the same lock. Only one of them
+        # succeeds in renaming it:
+        stale = "%s.%s.stale" % (lock, self.worker.replace(":", "_"))
+        try:
+            os.rename(lock, stale)
+        except FileNotFoundError:
+            return False
+
+        with open(stale) as file:
+            if file.read() != owner:
+                # Another worker had reclaimed the lock between our check and
+                # the renaming. Give it back (if nobody else took it):
+                try:
+                    os.link(stale, lock)
+                except FileExistsError:
+                    pass
+                os.remove(stale)
+                return False
+
+        logging.warning("Reclaim the stale claim %s (%s)" % (
+            lock, owner.strip()))
+        os.remove(stale)
+        return True
+
+    def refresh(self, job):
+        """Refresh the lock file of a claimed job
+
+        Args:
+            job: The name of the job.
+
+        Returns:
+            True if the job is still claimed by this worker.
+        """
+        if self._owner(job) != self.worker:
+            return False
+
+        try:
+            os.utime(self._path(job, ".lock"))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def release(self, job, done=True):
+        """Release a claimed job
+
+        Nothing happens if another worker has taken over the claim in the
+        meantime (see *timeout*).
+
+        Args:
+            job: The name of the job.
+            done: If true, the job is marked as processed. Otherwise, other
+                workers may claim it again.
+
+        Returns:
+            True if this worker still had the claim.
+        """
+        owner = self._owner(job)
+        if owner != self.worker:
+            logging.warning("Lost the claim of job %s to %s" % (job, owner))
+            return False
+
+        if done:
+            with open(self._path(job, ".done"), "w") as file:
+                file.write("%s %s\n" % (
+                    self.worker, datetime.now().isoformat()))
+        try:
+            os.remove(self._path(job, ".lock"))
+        except FileNotFoundError:
+            pass
+        return True
+
+    def process(self, jobs, func):
+        """Process all jobs that are not claimed by other workers
+
+        Args:
+            jobs: A list of job names.
+            func: A function that is called with the job name. If it raises
+                an exception, the job is released without being marked as
+                processed.
+
+        Returns:
+            The number of jobs processed by this worker.
+        """
+        processed = 0
+        for job in jobs:
+            if not self.claim(job):
+                continue
+
+            # Refresh the claim in the background, so other workers know that
+            # we are still alive:
+            stop = threading.Event()
+            refresher = threading.Thread(
+                target=self._refresh_until, args=(job, stop), daemon=True)
+            refresher.start()
+
+            logging.info("Process job %s" % job)
+            done = False
+            try:
+                func(job)
+                done = True
+            except Exception:
+                logging.error("Could not process job %s:" % job,
+                              exc_info=True)
+            finally:
+                stop.set()
+                refresher.join()
+                # If another worker has taken over the job meanwhile, it
+                # counts as processed by that worker:
+                if self.release(job, done) and done:
+                    processed += 1
+
+        return processed
+
+    def _refresh_until(self, job, stop):
+        while not stop.wait(self.timeout / 10):
+            if not self.refresh(job):
+                logging.warning(
+                    "Job %s has been claimed by another worker" % job)
+                return
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This script estimates how much the cloud statistics drift and how much faster
+they are if the Pinocchio images are decoded with a reduced resolution (see
+[Pinocchio][scale] in the config file).
+
+It creates synthetic cloud fields as JPEG images (with the example mask and
+calibration of this directory), decodes them with each scale and compares
+the statistics with those in full resolution. The table in the config file
+has been created with:
+
+    > PYTHONPATH=. python examples/scale_benchmark.py --images 50
+"""
+
+import argparse
+import os
+from os.path import dirname, join
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import PIL.Image
+from scipy.ndimage import gaussian_filter
+
+import cloud
+from cloud.pinocchio import ThermalCam
+
+EXAMPLES = dirname(os.path.abspath(__file__))
+
+# Temperatures of the synthetic scenes (in °C):
+SURFACE_TEMPERATURE = 28.
+CLEAR_SKY_TEMPERATURE = -40.
+WARMEST_CLOUD_TEMPERATURE = 26.
+COLDEST_CLOUD_TEMPERATURE = 0.
+
+
+def create_images(directory, n_images, shape, table, seed=0):
+    """Create JPEG images with synthetic cloud fields.
+
+    The clouds are smooth random fields of different sizes whose
+    temperatures cover all height levels. The grey values are the nearest
+    ones in the calibration table.
+
+    Args:
+        directory: Where to save the images.
+        n_images: Number of images.
+        shape: The height and width of the images.
+        table: The calibration table (the temperature of each grey value).
+        seed: Seed of the random number generator.
+
+    Returns:
+        A list with the filenames of the images.
+    """
+    rng = np.random.default_rng(seed)
+
+    files = []
+    for index in range(n_images):
+        field = gaussian_filter(
+            rng.normal(size=shape), sigma=rng.uniform(3, 20))
+        field = (field - field.mean()) / field.std()
+        cover = rng.uniform(-1, 1)
+        strength = np.clip((field - cover) / 2, 0, 1)
+
+        temperatures = np.where(
+            strength > 0,
+            COLDEST_CLOUD_TEMPERATURE + strength
+            * (WARMEST_CLOUD_TEMPERATURE - COLDEST_CLOUD_TEMPERATURE),
+            CLEAR_SKY_TEMPERATURE
+        ) + rng.normal(scale=0.5, size=shape)
+
+        grey = np.clip(
+            np.searchsorted(table, temperatures), 0, 255).astype(np.uint8)
+
+        # The decoder flips the images:
+        filename = join(directory, "image%04d.jpg" % index)
+        PIL.Image.fromarray(np.flipud(grey)).save(filename, quality=95)
+        files.append(filename)
+
+    return files
+
+
+def run_scale(files, scale, mask_file, calibration_file, levels):
+    """Decode all images with one scale and calculate their statistics.
+
+    Returns:
+        A tuple of the statistics (xarray.Dataset), the time for reading the
+        images and the time for the statistics (both in seconds).
+    """
+    handler = ThermalCam(calibration_file, scale=scale)
+    times = pd.date_range("2017-11-02", periods=len(files), freq="s")
+
+    timer = time.perf_counter()
+    builder = cloud.MovieBuilder(len(files))
+    for filename, timestamp in zip(files, times):
+        handler.read_frame(filename, builder, timestamp)
+    movie = builder.build(cloud.load_mask(mask_file, scale))
+    reading = time.perf_counter() - timer
+
+    movie = cloud.ThermalCamMovie(movie.data)
+    timer = time.perf_counter()
+    stats = movie.cloud_parameters(
+        lambda t: np.full(len(t), SURFACE_TEMPERATURE), levels)
+    statistics = time.perf_counter() - timer
+
+    return stats, reading, statistics
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the reduced resolutions of Pinocchio images."
+    )
+    parser.add_argument(
+        "--images", type=int, default=50,
+        help="Number of synthetic images (default: 50)."
+    )
+    parser.add_argument(
+        "--lapse-rate", type=float, default=-4,
+        help="The lapse rate [K / km] of the height levels (default: -4)."
+    )
+    args = parser.parse_args()
+
+    mask_file = join(EXAMPLES, "pinocchio-thermal-mask.png")
+    calibration_file = join(EXAMPLES, "pinocchio_calibration.csv")
+    # The same levels as in cloud.processing (2, 4 and 6 km):
+    levels = [args.lapse_rate * 2., args.lapse_rate * 4.,
+              args.lapse_rate * 6.]
+
+    table = ThermalCam(calibration_file).calibration_table
+    shape = cloud.load_mask(mask_file).shape
+
+    with tempfile.TemporaryDirectory() as directory:
+        files = create_images(directory, args.images, shape, table)
+        results = {
+            scale: run_scale(
+                files, scale, mask_file, calibration_file, levels)
+            for scale in (1, 2, 4, 8)
+        }
+
+    reference, reference_reading, reference_statistics = results[1]
+    print("scale  cloud_coverage  cloud_mean_temperature  "
+          "cloud_min/max_temperature  reading  statistics")
+    for scale, (stats, reading, statistics) in results.items():
+        if scale == 1:
+            continue
+
+        # The maximum drift of all images and levels:
+        drift = {
+            parameter: float(np.nanmax(np.abs(
+                stats[parameter].values - reference[parameter].values)))
+            for parameter in (
+                "cloud_coverage", "cloud_mean_temperature",
+                "cloud_min_temperature", "cloud_max_temperature")
+        }
+        print("%-6d %-15.3f %-23s %-26s %-8s %s" % (
+            scale, drift["cloud_coverage"],
+            "%.1f K" % drift["cloud_mean_temperature"],
+            "%.1f K / %.1f K" % (drift["cloud_min_temperature"],
+                                 drift["cloud_max_temperature"]),
+            "%.1fx" % (reference_reading / reading),
+            "%.1fx" % (reference_statistics / statistics),
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -12,7 +12,12 @@ This script can create two types of plots:
 """
 
 import argparse
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import logging.handlers
+import multiprocessing
+import traceback
 import warnings
 
 import matplotlib.pyplot as plt
@@ -24,26 +29,206 @@ import xarray as xr
 import cloud
 
 
-def sample(fileset, config, start, end, fields=None):
+class DataCache:
+    """Keeps the data of the filesets in memory while plotting.
+
+    The data of a fileset (and a set of fields) is loaded once for the whole
+    time period between *start* and *end*. Resampled versions of this data are
+    kept as well. All plots of this period (or any part of it) get their data
+    from here instead of reading the files again. If the cache grows over its
+    maximum size, the least recently used data is dropped.
+    """
+
+    def __init__(self, start, end, max_size=None):
+        """Initialize a DataCache object.
+
+        Args:
+            start: Start time of the cached period.
+            end: End time of the cached period.
+            max_size: Maximum size of the cache in bytes. If not given, the
+                cache may grow without limit.
+        """
+        self.start = pd.Timestamp(start)
+        self.end = pd.Timestamp(end)
+        self.max_size = max_size
+        self._items = OrderedDict()
+        # How to load the (not resampled) items again after dropping them:
+        self._loaders = {}
+
+    def covers(self, start, end):
+        """Check whether a time period lies in the cached period"""
+        return self.start <= start and end <= self.end
+
+    def _get(self, key, create):
+        """Get an item from the cache or create it.
+
+        Returns:
+            The item or None if there were no files for it.
+        """
+        if key in self._items:
+            self._items.move_to_end(key)
+        else:
+            try:
+                self._items[key] = create()
+            except NoFilesError:
+                # We do not want to search for missing files again and again
+                self._items[key] = None
+            self._shrink()
+
+        return self._items[key]
+
+    def _shrink(self):
+        """Drop the least recently used data until the cache is small enough
+        """
+        if self.max_size is None:
+            return
+
+        def size(item):
+            return 0 if item is None else item.nbytes
+
+        total = sum(size(item) for item in self._items.values())
+        while total > self.max_size and len(self._items) > 1:
+            _, item = self._items.popitem(last=False)
+            total -= size(item)
+
+    def load(self, fileset, fields=None, read_args=None):
+        """Load the data of a fileset for the whole cached period.
+
+        Args:
+            fileset: A FileSet object.
+            fields: Fields that you want to extract.
+            read_args: Additional keyword arguments for the reading method of
+                the fileset's file handler. If they contain *start* and *end*,
+                they are set to the cached period.
+
+        Returns:
+            A xarray.Dataset object sorted by time.
+        """
+        reader_args = {} if read_args is None else dict(read_args)
+        if fields is not None:
+            reader_args["fields"] = fields
+        for key, value in (("start", self.start), ("end", self.end)):
+            if key in reader_args:
+                reader_args[key] = value
+
+        def create():
+            logging.info("Load %s into the cache" % fileset.name)
+            data = xr.concat(fileset.collect(
+                self.start, self.end, read_args=reader_args
+            ), dim="time")
+            return data.sortby("time")
+
+        key = fileset.name, None if fields is None else tuple(fields)
+        self._loaders[key] = create
+        data = self._get(key, create)
+        if data is None:
+            raise NoFilesError(fileset, self.start, self.end)
+        return data
+
+    def load_resampled(self, fileset, resolution, fields=None,
+                       read_args=None):
+        """Like :meth:`load` but resampled to a new time resolution"""
+        def create():
+            return cloud.resample(
+                self.load(fileset, fields, read_args), resolution)
+
+        data = self._get(
+            (fileset.name, None if fields is None else tuple(fields),
+             resolution), create
+        )
+        if data is None:
+            raise NoFilesError(fileset, self.start, self.end)
+        return data
+
+    def subsets(self, periods):
+        """Get new caches with the loaded data of shorter periods
+
+        All data that has ever been loaded into this cache is passed on, also
+        if it has been dropped in the meantime. Such data is loaded once again
+        and kept (regardless of the maximum size) until all periods have been
+        sliced. Resampled data is not copied, it will be resampled again when
+        needed.
+
+        Args:
+            periods: A pandas.PeriodIndex object.
+
+        Yields:
+            A DataCache object for each period.
+        """
+        items = {}
+        for key, create in self._loaders.items():
+            if key in self._items:
+                items[key] = self._items[key]
+                continue
+
+            logging.info("Load %s again for the subsets of the cache" % (
+                key[0]))
+            try:
+                items[key] = create()
+            except NoFilesError:
+                items[key] = None
+
+        for period in periods:
+            cache = DataCache(period.start_time, period.end_time,
+                              self.max_size)
+            for key, data in items.items():
+                cache._items[key] = None if data is None \
+                    else data.sel(time=slice(cache.start, cache.end))
+            yield cache
+
+
+# If this is set to a DataCache object, sample() takes the data from it:
+data_cache = None
+
+
+def get_resolution(config, start, end):
+    """Get the time resolution of the plotted data
+
+    Args:
+        config: A dictionary-like object with configuration keys.
+        start: Start time of the plot
+        end: End time of the plot
+
+    Returns:
+        A string with the time resolution (e.g. "10T").
+    """
+    if (end - start) > pd.Timedelta("7 days"):
+        return config["Plots"]["weekly_plots_average"]
+    elif (end - start) > pd.Timedelta("24 hours"):
+        return config["Plots"]["daily_plots_average"]
+    else:
+        return config["Plots"]["hourly_plots_average"]
+
+
+def sample(fileset, config, start, end, fields=None, read_args=None):
     """Helper function to get a sample from the data and change its time
     resolution.
 
+    If the global data cache covers the requested period, the data is taken
+    from there.
+
     Args:
         fileset: A FileSet object.
         config: A dictionary-like object with configuration keys.
         start: Start time of the plot
         end: End time of the plot
         fields: Fields that you want to extract.
+        read_args: Additional keyword arguments for the reading method of the
+            fileset's file handler.
 
     Returns:
         An integer.
     """
-    if fields is None:
-        reader_args = {}
-    else:
-        reader_args = {
-            "fields": fields,
-        }
+    new_resolution = get_resolution(config, start, end)
+
+    if data_cache is not None and data_cache.covers(start, end):
+        data = data_cache.load_resampled(
+            fileset, new_resolution, fields, read_args)
+        return data.sel(time=slice(start, end))
+
+    reader_args = {} if read_args is None else dict(read_args)
+    if fields is not None:
+        reader_args["fields"] = fields
 
     data = xr.concat(fileset.collect(
         start, end, read_args=reader_args
@@ -54,18 +239,43 @@ def sample(fileset, config, start, end, fields=None):
 
     print(start, end)
 
-    if (end - start) > pd.Timedelta("7 days"):
-        new_resolution = config["Plots"]["weekly_plots_average"]
-    elif (end - start) > pd.Timedelta("24 hours"):
-        new_resolution = config["Plots"]["daily_plots_average"]
-    else:
-        new_resolution = config["Plots"]["hourly_plots_average"]
-
-    data = data.resample(new_resolution, dim="time")
+    data = cloud.resample(data, new_resolution)
     # data["time"] = data["time"].astype(datetime)
     return data
 
 
+def sample_stats(filesets, instrument, config, start, end):
+    """Get a sample from the cloud statistics of an instrument.
+
+    Uses the rollups of the cloud statistics if they are available.
+    Otherwise, the statistics are resampled via :func:`sample`.
+
+    Args:
+        filesets: A DatasetManager object.
+        instrument: The name of the instrument.
+        config: A dictionary-like object with configuration keys.
+        start: Start time of the plot
+        end: End time of the plot
+
+    Returns:
+        A xarray.Dataset object.
+    """
+    if instrument+"-rollups" in filesets:
+        try:
+            data = cloud.read_rollups(
+                filesets[instrument+"-rollups"], config, start, end,
+                get_resolution(config, start, end),
+            )
+            if data is not None:
+                return data
+        except NoFilesError:
+            logging.info(
+                "No rollups found for %s, use the statistics instead"
+                % instrument)
+
+    return sample(filesets[instrument+"-stats"], config, start, end)
+
+
 def plot_temperature(ax, start, end, filesets, config):
     """Plot temperature data on matplotlib axis.
 
@@ -79,7 +289,8 @@ def plot_temperature(ax, start, end, filesets, config):
     Returns:
         None
     """
-    data = sample(filesets[config["General"]["metadata"]], config, start, end)
+    data = sample(filesets[config["General"]["metadata"]], config, start, end,
+                  read_args={"start": start, "end": end})
     point_size = int(config["Plots"]["point_size"])
 
     ax.scatter(
@@ -106,7 +317,8 @@ def plot_pressure(ax, start, end, filesets, config):
     Returns:
         None
     """
-    data = sample(filesets[config["General"]["metadata"]], config, start, end)
+    data = sample(filesets[config["General"]["metadata"]], config, start, end,
+                  read_args={"start": start, "end": end})
     point_size = int(config["Plots"]["point_size"])
 
     ax.scatter(
@@ -130,7 +342,8 @@ def plot_humidity(ax, start, end, filesets, config):
     Returns:
         None
     """
-    data = sample(filesets[config["General"]["metadata"]], config, start, end)
+    data = sample(filesets[config["General"]["metadata"]], config, start, end,
+                  read_args={"start": start, "end": end})
     point_size = int(config["Plots"]["point_size"])
 
     ax.scatter(
@@ -154,7 +367,7 @@ def plot_cloud_coverage(ax, start, end, filesets, config, instrument):
     Returns:
         None
     """
-    data = sample(filesets[instrument+"-stats"], config, start, end)
+    data = sample_stats(filesets, instrument, config, start, end)
     point_size = int(config["Plots"]["point_size"])
 
     ax.scatter(
@@ -239,7 +452,7 @@ def plot_ceilometer(ax, start, end, filesets, config):
     ax.set_title("Ceilometer")
 
 
-def plot_overview(filesets, config, start, end, ):
+def plot_overview(filesets, config, start, end, writer=None):
     """Create overview plot
 
     Args:
@@ -247,9 +460,12 @@ def plot_overview(filesets, config, start, end, ):
         config: A dictionary-like object with configuration keys.
         start: Start time as string.
         end: End time as string.
+        writer: A concurrent.futures.ThreadPoolExecutor object. If given, the
+            plot is saved in its background thread.
 
     Returns:
-        None
+        A Future object of the saving if *writer* is given and there was
+        data to plot, otherwise None.
     """
 
     logging.info("Plot overview from %s to %s" % (start, end))
@@ -301,7 +517,10 @@ def plot_overview(filesets, config, start, end, ):
         (start, end), fill={"plot": "overview"}
     )
     logging.info("Save plot to %s" % filename)
-    filesets["plots"].write(fig, filename, in_background=True)
+    if writer is None:
+        filesets["plots"].write(fig, filename)
+        return None
+    return writer.submit(filesets["plots"].write, fig, filename)
 
 
 def plot_four_statistics(axes, data, config, instrument, add_labels=False):
@@ -368,9 +587,7 @@ def plot_comparison(filesets, config, start, end, ptype):
     no_data = True
     for instrument in instruments:
         try:
-            data = sample(
-                filesets[instrument+"-stats"], config, start, end
-            )
+            data = sample_stats(filesets, instrument, config, start, end)
             data = _prepare_parameters(data)
 
             plot_four_statistics(axes, data, config, instrument)
@@ -436,6 +653,10 @@ Examples:
     Same as above but instead of creating one plot for the full time period,
      we create one plot for every three hours. For this, we are using the 
     frequency (-f) option.
+
+    > ./%(prog)s -opf 1H "2017-11-03" "2017-11-10"
+    Create one overview plot for every hour. The plots are created in 
+    parallel processes (-p).
     """
 
     parser = argparse.ArgumentParser(
@@ -465,6 +686,12 @@ Examples:
         help='Create comparison plots for Dumbo and Pinocchio. Saves the plots'
              ' in the path that is set by [Plots][comparison] config option.'
     )
+    parser.add_argument(
+        '-p', '--parallel', action='store_true',
+        help='Create the plots of different periods in parallel processes '
+             '(their number is set by the [General][processes] config '
+             'option). Only used together with the --frequency option.'
+    )
     parser.add_argument(
         '-a', '--anomaly', action='store_true',
         help='Note: DEPRECATED at the moment! Create anomaly plots for '
@@ -488,23 +715,153 @@ def make_plots(filesets, config, args, start, end):
     Returns:
 
     """
-    if args.overview:
-        plot_overview(filesets, config,
-                      pd.Timestamp(start),
-                      pd.Timestamp(end), )
+    # The overview is saved in the background while the other plots are
+    # created. Afterwards, all figures are closed:
+    try:
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            overview = None
+            if args.overview:
+                overview = plot_overview(filesets, config,
+                                         pd.Timestamp(start),
+                                         pd.Timestamp(end), writer)
+
+            if args.comparison:
+                plot_comparison(filesets, config,
+                                pd.Timestamp(start),
+                                pd.Timestamp(end), "comparison")
+
+            if args.anomaly:
+                plot_comparison(filesets, config,
+                                pd.Timestamp(start),
+                                pd.Timestamp(end), "anomaly")
+
+            if overview is not None:
+                # Raises the exception of the writer (if any):
+                overview.result()
+    finally:
+        plt.close("all")
+
+
+def _init_worker(log_queue):
+    """Prepare a worker process for plotting.
+
+    All log messages are sent to the main process which writes them.
+    Matplotlib must not use an interactive backend.
+    """
+    logger = logging.getLogger()
+    logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    plt.switch_backend("Agg")
+
+
+def _try_make_plots(filesets, config, args, start, end, cache):
+    """Create the plots of one period and catch all errors.
+
+    This runs in the worker processes of :func:`make_plots_parallel` (and
+    for the first period in the main process).
+
+    Args:
+        filesets: A DatasetManager object.
+        config: A dictionary-like object with configuration keys.
+        args: An argparse object.
+        start: Start time of the period.
+        end: End time of the period.
+        cache: A DataCache object with the data of this period.
+
+    Returns:
+        None if everything went fine, otherwise the error message.
+    """
+    global data_cache
+    data_cache = cache
+
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            make_plots(filesets, config, args, start, end)
+        return None
+    except Exception:
+        return traceback.format_exc()
+
+
+def make_plots_parallel(filesets, config, args, periods, processes):
+    """Create the plots for several periods in parallel processes.
+
+    The plots of the first period are created in this process to fill the
+    data cache. Each worker gets then only the data of its period. An error
+    in one period does not abort the other ones.
+
+    Args:
+        filesets: A DatasetManager object.
+        config: A dictionary-like object with configuration keys.
+        args: An argparse object.
+        periods: A pandas.PeriodIndex object.
+        processes: Number of worker processes.
+
+    Returns:
+        None
+    """
+    failed = []
 
-    if args.comparison:
-        plot_comparison(filesets, config,
-                        pd.Timestamp(start),
-                        pd.Timestamp(end), "comparison")
+    def report(period, error):
+        if error is not None:
+            logging.error(
+                "Could not create the plots from %s to %s:\n%s" % (
+                    period.start_time, period.end_time, error)
+            )
+            failed.append(period)
 
-    if args.anomaly:
-        plot_comparison(filesets, config,
-                        pd.Timestamp(start),
-                        pd.Timestamp(end), "anomaly")
+    def wait(period, result):
+        try:
+            error = result.get()
+        except Exception:
+            error = traceback.format_exc()
+        report(period, error)
+
+    report(periods[0], _try_make_plots(
+        filesets, config, args, periods[0].start_time, periods[0].end_time,
+        data_cache
+    ))
+
+    # The log messages of all workers go through this queue:
+    log_queue = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(
+        log_queue, *logging.getLogger().handlers,
+        respect_handler_level=True,
+    )
+    listener.start()
+
+    pool = multiprocessing.Pool(
+        processes, initializer=_init_worker, initargs=(log_queue,)
+    )
+    try:
+        # Do not give the workers too much data at once:
+        pending = deque()
+        subsets = data_cache.subsets(periods[1:])
+        for period, cache in zip(periods[1:], subsets):
+            pending.append((period, pool.apply_async(
+                _try_make_plots,
+                (filesets, config, args,
+                 period.start_time, period.end_time, cache)
+            )))
+            if len(pending) >= 2 * processes:
+                wait(*pending.popleft())
+
+        while pending:
+            wait(*pending.popleft())
+    finally:
+        pool.close()
+        pool.join()
+        listener.stop()
+
+    if failed:
+        logging.warning(
+            "Could not create the plots for %d of %d periods" % (
+                len(failed), len(periods))
+        )
 
 
 def main():
+    global data_cache
+
     # Parse all command line arguments and load the config file and the
     # filesets:
     config, args, filesets = cloud.init_toolbox(
@@ -512,9 +869,26 @@ def main():
     )
 
     if args.frequency is not None:
-        for period in pd.period_range(
-                args.start, args.end, freq=args.frequency):
-
+        periods = pd.period_range(args.start, args.end, freq=args.frequency)
+        start, end = periods[0].start_time, periods[-1].end_time
+    else:
+        periods = None
+        start, end = args.start, args.end
+
+    # All plots take their data from this cache, i.e. each file is read only
+    # once:
+    max_size = None
+    if "cache_size" in config["Plots"]:
+        max_size = int(config["Plots"]["cache_size"]) * 1024**2
+    data_cache = DataCache(start, end, max_size)
+
+    if periods is not None and args.parallel:
+        make_plots_parallel(
+            filesets, config, args, periods,
+            int(config["General"]["processes"])
+        )
+    elif periods is not None:
+        for period in periods:
             make_plots(filesets, config, args,
                        period.start_time, period.end_time, )
     else:
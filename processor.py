@@ -19,11 +19,16 @@ import logging.config
 import os.path
 import shutil
 import tarfile
+import time
+
+import pandas as pd
+from typhon.files import NoFilesError
 
 import cloud
 
 
-def extract_raw_files(filesets, config, start, end, convert=False):
+def extract_raw_files(
+        filesets, config, start, end, convert=False, force=False):
     """Extract the archive files from Pinocchio
 
     Args:
@@ -33,24 +38,289 @@ def extract_raw_files(filesets, config, start, end, convert=False):
         end: End time as string.
         convert: If true, the files will be also converted and afterwards
             deleted.
+        force: If true, also archives that have been extracted already
+            (according to the manifest) are extracted again.
 
     Returns:
         None
     """
 
+    manifest = None
+    if "manifest" in config["General"]:
+        manifest = cloud.Manifest(os.path.join(
+            config["General"]["basedir"], config["General"]["manifest"]
+        ))
+
     for archive in filesets["Pinocchio-archive"].find(start, end):
+        tmpdir = os.path.splitext(archive)[0]
+        inputs = {"archive": cloud.file_stats([archive.path])}
+        if not convert and not force and manifest is not None \
+                and manifest.is_done("extract", archive.path, inputs):
+            logging.info("%s is extracted already" % archive.path)
+            continue
+
         logging.info("Extract all files from %s" % archive.path)
         archive_file = tarfile.open(archive, mode="r:gz")
-        tmpdir = os.path.splitext(archive)[0]
         archive_file.extractall(path=tmpdir)
 
+        if not convert and manifest is not None:
+            manifest.record("extract", archive.path, inputs, tmpdir)
+
         if convert:
-            cloud.convert_raw_files(filesets, "Pinocchio", config, start, end)
+            cloud.convert_raw_files(
+                filesets, "Pinocchio", config, start, end, force=force)
 
             logging.info("Delete extracted files.")
             shutil.rmtree(tmpdir)
 
 
+def process_new_files(filesets, config, instrument, start, end, archives):
+    """Convert new raw files of an instrument and calculate their statistics
+
+    Only bundles that are not up-to-date according to the manifest are
+    processed. The statistics are calculated directly from the converted
+    movies in memory.
+
+    Args:
+        filesets: A DatasetManager object.
+        config: A dictionary-like object with configuration keys.
+        instrument: The name of the instrument.
+        start: Start time as pandas.Timestamp.
+        end: End time as pandas.Timestamp.
+        archives: If true, the Pinocchio images are read from the archives.
+
+    Returns:
+        None
+    """
+    try:
+        if archives and instrument == "Pinocchio":
+            cloud.convert_archive_files(
+                filesets, config, start, end, statistics=True)
+        else:
+            cloud.convert_raw_files(
+                filesets, instrument, config, start, end, statistics=True)
+    except NoFilesError as err:
+        logging.info(str(err))
+
+
+def _watch_start(now, lookback, latency, newest=None):
+    """Get the start of the next check of the watch mode
+
+    Args:
+        now: The current time as pandas.Timestamp.
+        lookback: The period of the first check as pandas.Timedelta.
+        latency: How late files may arrive as pandas.Timedelta.
+        newest: The start of the newest processed bundle or None if nothing
+            has been processed yet.
+
+    Returns:
+        A pandas.Timestamp object at the start of a bundle.
+    """
+    if newest is None:
+        return (now - lookback).floor("1h")
+    return max(now - lookback, newest - latency).floor("1h")
+
+
+def watch(filesets, config, archives=False):
+    """Process new files continuously
+
+    Checks periodically for new raw files of the instruments in
+    [Watch][instruments] and converts them and calculates their statistics.
+    The bundles are processed as soon as their hour is over. The current,
+    incomplete bundle is processed every [Watch][latency] seconds. The first
+    check looks for files of the last [Watch][lookback] period, the next ones
+    start at the newest processed bundle (minus the latency for late files).
+    The filesets (incl. the calibration), masks and metadata stay loaded
+    between the checks.
+
+    Args:
+        filesets: A DatasetManager object.
+        config: A dictionary-like object with configuration keys.
+        archives: If true, the Pinocchio images are read from the archives.
+
+    Returns:
+        None
+    """
+
+    if "manifest" not in config["General"]:
+        raise ValueError(
+            "The watch mode needs a manifest! Set [General][manifest].")
+
+    instruments = [
+        instrument.strip()
+        for instrument in config["Watch"]["instruments"].split(",")
+    ]
+    interval = float(config["Watch"]["interval"])
+    latency = pd.Timedelta(seconds=float(config["Watch"]["latency"]))
+    lookback = pd.Timedelta(config["Watch"]["lookback"])
+
+    last_flush = dict.fromkeys(instruments)
+    newest = dict.fromkeys(instruments)
+
+    logging.info("Watch for new files of %s" % ", ".join(instruments))
+    while True:
+        now = pd.Timestamp.now("UTC").tz_localize(None)
+
+        for instrument in instruments:
+            start = _watch_start(now, lookback, latency, newest[instrument])
+
+            # Process only complete bundles unless the incomplete one has
+            # waited long enough:
+            end = now.floor("1h")
+            if last_flush[instrument] is None \
+                    or now - last_flush[instrument] >= latency:
+                end = now
+                last_flush[instrument] = now
+
+            try:
+                process_new_files(
+                    filesets, config, instrument, start, end, archives)
+            except Exception:
+                logging.error(
+                    "Could not process the files of %s:" % instrument,
+                    exc_info=True
+                )
+                continue
+
+            # The bundle with the last processed time (the end is exclusive):
+            newest[instrument] = (end - pd.Timedelta("1us")).floor("1h")
+
+        time.sleep(interval)
+
+
+def process(filesets, config, args, instruments, start, end, rollups=True):
+    """Run the actions from the command line for a period
+
+    Args:
+        filesets: A DatasetManager object.
+        config: A dictionary-like object with configuration keys.
+        args: The parsed command line arguments.
+        instruments: A list with the names of the instruments.
+        start: Start time.
+        end: End time.
+        rollups: If false, the rollups are not updated.
+
+    Returns:
+        None
+    """
+    # When converting and calculating the statistics, the statistics are
+    # calculated from the converted images in memory. We do not need to read
+    # the netCDF files again (a sweep reads them after the conversion):
+    fused = args.convert and args.stats and not args.sweep
+    archives = args.extract and "Pinocchio" in instruments
+
+    if archives and not args.convert:
+        extract_raw_files(filesets, config, start, end, force=args.force)
+    elif args.convert and len(instruments) > 1:
+        cloud.process_instruments(
+            filesets, instruments, config, start, end,
+            force=args.force, statistics=fused,
+            save_movies=not args.no_movies, archives=archives,
+            rollups=rollups,
+        )
+    elif archives:
+        # We do not need to extract the files to the disk if we convert
+        # them anyway:
+        cloud.convert_archive_files(
+            filesets, config, start, end, force=args.force,
+            statistics=fused, save_movies=not args.no_movies,
+            rollups=rollups,
+        )
+    elif args.convert:
+        cloud.convert_raw_files(
+            filesets, instruments[0], config, start, end,
+            force=args.force, statistics=fused,
+            save_movies=not args.no_movies, rollups=rollups,
+        )
+
+    if args.stats and not fused:
+        sweep = None
+        if args.sweep:
+            sweep = [{"lapse_rate": lapse_rate} for lapse_rate in args.sweep]
+        for instrument in instruments:
+            cloud.calculate_cloud_statistics(
+                filesets, instrument, config, start, end,
+                force=args.force, rollups=rollups, sweep=sweep,
+            )
+
+
+def process_queue(filesets, config, args):
+    """Process a period together with other workers via a shared work queue
+
+    The period is split into one job per instrument and bundle (one hour or -
+    when reading the Pinocchio archives - one day). Each worker (processor.py
+    started with --queue on several nodes or several times on one node)
+    claims the next free job from the queue directory ([Queue][directory]).
+    The rollups of a day are updated by the worker that finds all jobs of
+    this day done.
+
+    Args:
+        filesets: A DatasetManager object.
+        config: A dictionary-like object with configuration keys.
+        args: The parsed command line arguments.
+
+    Returns:
+        None
+    """
+    queue = cloud.WorkQueue(
+        os.path.join(
+            config["General"]["basedir"], config["Queue"]["directory"]),
+        timeout=float(config["Queue"]["timeout"]),
+    )
+    start, end = pd.Timestamp(args.start), pd.Timestamp(args.end)
+
+    jobs = {}
+    for instrument in args.instrument:
+        period = pd.Timedelta(
+            "1D" if args.extract and instrument == "Pinocchio" else "1H")
+        for job_start in pd.date_range(start.floor(period), end, freq=period):
+            if job_start >= end:
+                break
+
+            # FileSet.find treats the end as exclusive, hence a file at the
+            # border of two jobs is processed only by the later one:
+            jobs["%s_%s" % (instrument, job_start.strftime("%Y%m%dT%H%M%S"))] \
+                = instrument, max(start, job_start), \
+                min(end, job_start + period)
+
+    def process_job(job):
+        instrument, job_start, job_end = jobs[job]
+        try:
+            process(
+                filesets, config, args, [instrument], job_start, job_end,
+                rollups=False
+            )
+        except NoFilesError as err:
+            # Nothing to do for this job:
+            logging.info(str(err))
+
+    logging.info("Process %d jobs from the queue in %s" % (
+        len(jobs), queue.directory))
+    queue.process(list(jobs), process_job)
+
+    if not args.stats or args.sweep:
+        return
+
+    for instrument in args.instrument:
+        for day in pd.date_range(start.floor("D"), end, freq="D"):
+            if day >= end:
+                break
+
+            next_day = day + pd.Timedelta("1D")
+            if not all(
+                    queue.is_done(job)
+                    for job, (job_instrument, job_start, _) in jobs.items()
+                    if job_instrument == instrument
+                    and day <= job_start < next_day):
+                continue
+
+            queue.process(
+                ["%s_rollups_%s" % (instrument, day.strftime("%Y%m%d"))],
+                lambda job: cloud.update_rollups(
+                    filesets, instrument, config, day, next_day),
+            )
+
+
 def get_cmd_line_parser():
     description = """Process Pinocchio or Dumbo images.\n
     
@@ -76,9 +346,36 @@ def get_cmd_line_parser():
     > ./%(prog)s -cs -i Dumbo "2017-11-02" "2017-11-03"
     Process all Dumbo files from the 2nd November 2017.
     
+    > ./%(prog)s -xcs -i Pinocchio -i Dumbo "2017-11-02" "2017-11-03"
+    Process the files of both instruments in one run. They share the worker
+    pool (see [General][processes]) and the air temperature is read only 
+    once.
+    
+    > ./%(prog)s -csn -i Dumbo "2017-11-02" "2017-11-03"
+    Calculate the cloud statistics of all Dumbo files from the 2nd November
+    2017 without saving the converted netCDF files.
+    
     > ./%(prog)s -s "2017-11-02 12:00:00" "2017-11-02 16:00:00"
     Calculate the cloud statistics only (you need existing netCDF files that 
     you have converted earlier).
+    
+    > ./%(prog)s -s "2017-11-02" "2017-11-03" --sweep -4 --sweep -5 --sweep -6.5
+    Calculate the cloud statistics for three lapse rates at once. Each movie
+    is read only once. The statistics are saved with an additional dimension
+    config to the path in [instrument][sweep].
+    
+    > ./%(prog)s -qcs -i Pinocchio -i Dumbo "2017-11-02" "2017-11-11"
+    Start this on several nodes (or several times on one node): the workers
+    share the hourly jobs of this period via lock files in [Queue][directory]
+    (on a shared filesystem).
+    
+    > ./%(prog)s -w -x
+    Watch for new files (see [Watch]) and process them as soon as they 
+    arrive.
+    
+    If [General][manifest] is set, all bundles that have been processed 
+    already (with the same input files and settings) are skipped. Hence, you 
+    can simply rerun an aborted run. Use -f to process everything again.
     """
 
     parser = argparse.ArgumentParser(
@@ -89,26 +386,67 @@ def get_cmd_line_parser():
     )
     parser.add_argument(
         '-i', '--instrument', type=str, choices=["Pinocchio", "Dumbo"],
-        default="Pinocchio",
-        help='The instrument which files should be processed.'
+        action="append",
+        help='The instrument which files should be processed (default: '
+             'Pinocchio). Repeat it to process several instruments (e.g. -i '
+             'Pinocchio -i Dumbo). Combined with --convert, their files are '
+             'processed in one shared pool of workers.'
     )
     parser.add_argument(
         '-x', '--extract', action='store_true',
         help='The raw images will be extracted from the original archives. '
-             'Note: This option will be ignored for instruments other than '
-             'Pinocchio. Uses the [Pinocchio][archive_files] config option.'
+             'If combined with --convert, the images are read directly from '
+             'the archives without writing them to the disk. Note: This '
+             'option will be ignored for instruments other than Pinocchio. '
+             'Uses the [Pinocchio][archive_files] config option.'
     )
     parser.add_argument(
         '-c', '--convert', action='store_true',
         help='The raw images will be converted to netCDF files. Uses the '
              '[instrument][files_in_archive] config option.'
     )
+    parser.add_argument(
+        '-f', '--force', action='store_true',
+        help='Process all bundles again, even those that are up-to-date '
+             'according to the manifest (set via [General][manifest]).'
+    )
+    parser.add_argument(
+        '-w', '--watch', action='store_true',
+        help='Run continuously: check for new raw files of the instruments '
+             'in [Watch][instruments], convert them and calculate their '
+             'statistics. Combine it with -x to read the Pinocchio images '
+             'from the archives. Start and end date are ignored. Needs '
+             '[General][manifest].'
+    )
+    parser.add_argument(
+        '-q', '--queue', action='store_true',
+        help='Split the period into jobs of one bundle per instrument and '
+             'process them together with other workers. The jobs are claimed'
+             ' via lock files in [Queue][directory], which has to be on a '
+             'filesystem that all workers can access.'
+    )
     parser.add_argument(
         '-s', '--stats', action='store_true',
         help='Calculate cloud statistics for each image. This action needs the'
              ' air temperature from the DShip dataset (set via '
              '[DShip][files]). Saves the statistics to the path in '
-             '[instrument][stats].'
+             '[instrument][stats]. If combined with --convert, the '
+             'statistics are calculated directly from the converted images '
+             'in memory.'
+    )
+    parser.add_argument(
+        '-n', '--no-movies', action='store_true',
+        help='Do not save the converted netCDF files. Only possible if '
+             'combined with --convert and --stats.'
+    )
+    parser.add_argument(
+        '--sweep', type=float, action="append", metavar="LAPSE_RATE",
+        help='Calculate the cloud statistics for this lapse rate [K / km] '
+             'instead of [General][lapse_rate]. Repeat it to calculate them '
+             'for several lapse rates in one pass over each movie (e.g. '
+             '--sweep -4 --sweep -5). Only used with --stats. The statistics '
+             'are saved to the path in [instrument][sweep]. Needs the '
+             'converted netCDF files (do not combine it with --no-movies).'
     )
 
     return parser
@@ -120,31 +458,34 @@ def main():
     config, args, filesets = cloud.init_toolbox(
         get_cmd_line_parser()
     )
+    # Each instrument only once and in the given order:
+    args.instrument = list(dict.fromkeys(args.instrument or ["Pinocchio"]))
 
     actions = [
         ["Start date:", str(args.start)],
         ["End date:", str(args.end)],
-        ["Instrument:", str(args.instrument)],
+        ["Instrument:", ", ".join(args.instrument)],
         ["Extract:", str(args.extract)],
         ["Convert:", str(args.convert)],
         ["Statistics:", str(args.stats)],
+        ["Save movies:", str(not args.no_movies)],
+        ["Sweep:", str(args.sweep)],
+        ["Force:", str(args.force)],
     ]
 
+    if args.watch:
+        watch(filesets, config, archives=args.extract)
+        return
+
     logging.info("Script configuration:")
     for i, action in enumerate(actions):
         print("    {:<15} {:<12}".format(*action))
 
-    if args.extract and args.instrument == "Pinocchio":
-        extract_raw_files(filesets, config, args.start, args.end, args.convert)
-    elif args.convert:
-        cloud.convert_raw_files(
-            filesets, args.instrument, config, args.start, args.end
-        )
+    if args.queue:
+        process_queue(filesets, config, args)
+        return
 
-    if args.stats:
-        cloud.calculate_cloud_statistics(
-            filesets, args.instrument, config, args.start, args.end
-        )
+    process(filesets, config, args, args.instrument, args.start, args.end)
 
 
 if __name__ == "__main__":
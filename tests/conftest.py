@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The cloud package is not installed, it is imported from the repository:
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
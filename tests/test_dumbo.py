@@ -0,0 +1,99 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+import cloud.dumbo
+from cloud.dumbo import parse_ascii_file, ThermalCamASCII
+
+
+def write_ascii_file(path, image, title="orig.bmp\t02.11.2017 12:34:56"):
+    """Write an image in the format of the Dumbo raw files"""
+    lines = [title, "\t".join(["row"] + [str(i) for i in range(384)])]
+    for number, row in enumerate(image, 1):
+        lines.append("\t".join(
+            [str(number)] + [("%.2f" % value).replace(".", ",")
+                             for value in row]
+        ))
+    path.write_text("\r\n".join(lines) + "\r\n", encoding="latin-1")
+    return str(path)
+
+
+@pytest.fixture
+def image():
+    return np.round(
+        np.random.default_rng(0).uniform(-40, 30, (4, 384)), 2)
+
+
+def test_parse_ascii_file(tmp_path, image):
+    filename = write_ascii_file(tmp_path / "frame.asc", image)
+
+    timestamp, parsed = parse_ascii_file(filename)
+
+    assert timestamp == datetime(2017, 11, 2, 12, 34, 56)
+    np.testing.assert_allclose(parsed, image)
+
+
+def test_truncated_file(tmp_path, image):
+    filename = write_ascii_file(tmp_path / "frame.asc", image)
+    with open(filename, "rb") as file:
+        content = file.read()
+    # The last row is cut in the middle:
+    with open(filename, "wb") as file:
+        file.write(content[:-1000])
+
+    with pytest.raises(ValueError, match="frame.asc"):
+        parse_ascii_file(filename)
+
+
+def test_invalid_value(tmp_path, image):
+    filename = write_ascii_file(tmp_path / "frame.asc", image)
+    with open(filename, "rb") as file:
+        content = file.read()
+    with open(filename, "wb") as file:
+        # One value in the first row is no number:
+        file.write(content.replace(b",", b",x", 1))
+
+    with pytest.raises(ValueError, match="frame.asc"):
+        parse_ascii_file(filename)
+
+
+def test_invalid_timestamp_uses_given_time(tmp_path, image):
+    filename = write_ascii_file(tmp_path / "frame.asc", image, "no time")
+    time = datetime(2017, 11, 3)
+
+    builder = cloud.MovieBuilder(1)
+    ThermalCamASCII().read_frame(filename, builder, time)
+
+    assert builder.times == [time]
+
+
+def test_read(tmp_path, image):
+    filename = write_ascii_file(tmp_path / "frame.asc", image)
+
+    data = ThermalCamASCII().read(filename)
+
+    assert data["images"].shape == (1, 4, 384)
+    np.testing.assert_allclose(data["images"][0], image)
+    assert data["time"].values[0] == np.datetime64("2017-11-02T12:34:56")
+
+
+def test_cache(tmp_path, image, monkeypatch):
+    filename = write_ascii_file(tmp_path / "frame.asc", image)
+    handler = ThermalCamASCII(cache=True)
+    handler.read(filename)
+    assert (tmp_path / "frame.asc.npy").exists()
+
+    # The second time, the file is not parsed again:
+    def fail(filename):
+        raise AssertionError("The file should be read from the cache")
+    monkeypatch.setattr(cloud.dumbo, "parse_ascii_file", fail)
+    data = handler.read(filename)
+    np.testing.assert_allclose(data["images"][0], image)
+    assert data["time"].values[0] == np.datetime64("2017-11-02T12:34:56")
+
+    # A changed file is parsed again:
+    monkeypatch.undo()
+    write_ascii_file(tmp_path / "frame.asc", image[:2])
+    data = handler.read(filename)
+    np.testing.assert_allclose(data["images"][0], image[:2])
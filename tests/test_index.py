@@ -0,0 +1,150 @@
+from datetime import datetime
+import os
+
+import pytest
+from typhon.files import expects_file_info, FileHandler, FileInfo
+
+from cloud.index import FileIndex, IndexedFileSet
+
+
+class TimeHandler(FileHandler):
+    """Reads the time coverage from the content of the files"""
+
+    def __init__(self, **kwargs):
+        super(TimeHandler, self).__init__(**kwargs)
+        self.opened = []
+
+    @expects_file_info()
+    def get_info(self, filename, **kwargs):
+        self.opened.append(filename.path)
+        with open(filename.path) as file:
+            time = datetime.strptime(file.read().strip(), "%Y-%m-%d %H:%M")
+        return FileInfo(filename.path, [time, time])
+
+
+def write_file(directory, name, time):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    with open(path, "w") as file:
+        file.write(time)
+    return path
+
+
+@pytest.fixture
+def files(tmp_path):
+    directory = str(tmp_path / "data" / "20171102")
+    return [
+        write_file(directory, "1000.txt", "2017-11-02 10:00"),
+        write_file(directory, "1100.txt", "2017-11-02 11:00"),
+        write_file(directory, "1200.txt", "2017-11-02 12:00"),
+    ]
+
+
+def make_fileset(tmp_path, index, recheck=False):
+    return IndexedFileSet(
+        str(tmp_path / "data" / "{year}{month}{day}" / "{hour}{minute}.txt"),
+        name="test", handler=TimeHandler(), info_via="handler", index=index,
+        recheck=recheck,
+    )
+
+
+def find(fileset):
+    return sorted(
+        (info.path, info.times[0])
+        for info in fileset.find("2017-11-02", "2017-11-03")
+    )
+
+
+def test_file_index(tmp_path, files):
+    index = FileIndex(str(tmp_path / "index.sqlite"))
+    info = FileInfo(files[0], [datetime(2017, 11, 2, 10),
+                               datetime(2017, 11, 2, 10, 30)])
+    index.set_file("test", info, os.stat(files[0]))
+
+    indexed = index.get_file("test", files[0], os.stat(files[0]))
+    assert indexed.times == info.times
+
+    # A changed file is not taken from the index:
+    with open(files[0], "a") as file:
+        file.write("\n")
+    assert index.get_file("test", files[0], os.stat(files[0])) is None
+
+    # Files that are not in the directory anymore are removed:
+    index.set_directory("test", os.path.dirname(files[0]), 1, [])
+    assert not list(index.find(
+        "test", os.path.dirname(files[0]), datetime(2017, 1, 1),
+        datetime(2018, 1, 1)))
+
+
+def test_files_are_opened_once(tmp_path, files):
+    filename = str(tmp_path / "index.sqlite")
+    fileset = make_fileset(tmp_path, FileIndex(filename))
+    found = find(fileset)
+    assert len(found) == 3
+    assert len(fileset.handler.opened) == 3
+
+    # A new process with the same index does not open the files again:
+    fileset = make_fileset(tmp_path, FileIndex(filename))
+    assert find(fileset) == found
+    assert fileset.handler.opened == []
+
+
+def test_one_commit_per_directory(tmp_path, files, monkeypatch):
+    commits = []
+    commit = FileIndex.commit
+    monkeypatch.setattr(
+        FileIndex, "commit", lambda self: commits.append(commit(self)))
+    index = FileIndex(str(tmp_path / "index.sqlite"))
+
+    assert len(find(make_fileset(tmp_path, index))) == 3
+
+    assert len(commits) == 1
+    assert not index.connection.in_transaction
+    assert index.connection.execute(
+        "PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def modify_in_place(path, time):
+    """Modify a file without changing the mtime of its directory"""
+    directory = os.stat(os.path.dirname(path))
+    with open(path, "w") as file:
+        file.write(time)
+    os.utime(path, ns=(1, 1))
+    os.utime(os.path.dirname(path),
+             ns=(directory.st_atime_ns, directory.st_mtime_ns))
+
+
+def test_unchanged_directory_is_trusted(tmp_path, files):
+    filename = str(tmp_path / "index.sqlite")
+    find(make_fileset(tmp_path, FileIndex(filename)))
+
+    modify_in_place(files[1], "2017-11-02 11:30")
+
+    fileset = make_fileset(tmp_path, FileIndex(filename))
+    found = dict(find(fileset))
+    assert fileset.handler.opened == []
+    assert found[files[1]] == datetime(2017, 11, 2, 11)
+
+
+def test_modified_file_is_read_again(tmp_path, files):
+    filename = str(tmp_path / "index.sqlite")
+    find(make_fileset(tmp_path, FileIndex(filename)))
+
+    modify_in_place(files[1], "2017-11-02 11:30")
+
+    fileset = make_fileset(tmp_path, FileIndex(filename), recheck=True)
+    found = dict(find(fileset))
+    assert fileset.handler.opened == [files[1]]
+    assert found[files[1]] == datetime(2017, 11, 2, 11, 30)
+
+
+def test_files_not_on_disk_bypass_the_index(tmp_path, files):
+    fileset = make_fileset(
+        tmp_path, FileIndex(str(tmp_path / "index.sqlite")))
+
+    # E.g. a member of an archive:
+    path = str(tmp_path / "data" / "20171102" / "1315.txt")
+    info = fileset.get_info(FileInfo(path), retrieve_via="filename")
+
+    assert info.times[0] == datetime(2017, 11, 2, 13, 15)
+    assert fileset.handler.opened == []
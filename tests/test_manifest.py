@@ -0,0 +1,64 @@
+import os
+import pickle
+
+from cloud.manifest import file_stats, Manifest
+
+
+def test_file_stats(tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_text("abc")
+
+    (stats, missing) = file_stats([str(path), str(tmp_path / "missing")])
+
+    assert stats[:2] == (str(path), 3)
+    assert missing == (str(tmp_path / "missing"), None, None)
+
+
+def test_bundle_is_done(tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.sqlite"))
+    output = tmp_path / "output.nc"
+    output.write_text("")
+    inputs = {"files": [("a.jpg", 10, 1)], "lapse_rate": -4.}
+
+    assert not manifest.is_done("convert", "Pinocchio-10:00", inputs)
+    manifest.record("convert", "Pinocchio-10:00", inputs, str(output))
+
+    assert manifest.is_done("convert", "Pinocchio-10:00", inputs)
+    # Other stages and bundles are not affected:
+    assert not manifest.is_done("stats", "Pinocchio-10:00", inputs)
+    assert not manifest.is_done("convert", "Pinocchio-11:00", inputs)
+
+
+def test_changed_inputs(tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.sqlite"))
+    inputs = {"files": [("a.jpg", 10, 1)], "lapse_rate": -4.}
+    manifest.record("convert", "bundle", inputs)
+
+    assert not manifest.is_done(
+        "convert", "bundle", {"files": [("a.jpg", 10, 2)], "lapse_rate": -4.})
+    assert not manifest.is_done(
+        "convert", "bundle", {"files": [("a.jpg", 10, 1)], "lapse_rate": -5.})
+    # The order of the keys does not matter:
+    assert manifest.is_done(
+        "convert", "bundle", {"lapse_rate": -4., "files": [("a.jpg", 10, 1)]})
+
+
+def test_missing_output(tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.sqlite"))
+    output = tmp_path / "output.nc"
+    output.write_text("")
+    manifest.record("convert", "bundle", {}, str(output))
+
+    os.remove(str(output))
+
+    assert not manifest.is_done("convert", "bundle", {})
+
+
+def test_shared_between_processes(tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.sqlite"))
+    manifest.record("convert", "bundle", {"a": 1})
+
+    # The connection is not pickled but opened again:
+    copy = pickle.loads(pickle.dumps(manifest))
+
+    assert copy.is_done("convert", "bundle", {"a": 1})
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+from typhon.files import FileInfo
+import xarray as xr
+
+from cloud.metadata import ShipMSM
+
+
+def dship_data():
+    time = pd.date_range("2017-11-02", periods=48, freq="30min")
+    return xr.Dataset(
+        {
+            "air_temperature": ("time", np.linspace(20., 30., len(time))),
+            "air_pressure": ("time", np.linspace(1000., 1010., len(time))),
+            "station": ("time", np.array(["MSM"] * len(time), dtype=object)),
+        },
+        coords={"time": time},
+    )
+
+
+@pytest.fixture
+def dship_file(tmp_path, monkeypatch):
+    """A DShip file and the parser that counts how often it is called"""
+    filename = tmp_path / "dship.dat"
+    filename.write_text("DShip data")
+    parsed = []
+
+    def parse(self, filename):
+        parsed.append(filename.path)
+        return dship_data()
+
+    monkeypatch.setattr(ShipMSM, "_parse", parse)
+    return FileInfo(str(filename)), parsed
+
+
+@pytest.mark.parametrize("fields, start, end", [
+    (None, None, None),
+    (["air_temperature"], "2017-11-02 06:00", "2017-11-02 12:00"),
+    (["station"], "2017-11-02 06:10", None),
+])
+def test_cache_equals_direct_read(tmp_path, dship_file, fields, start, end):
+    info, _ = dship_file
+    expected = ShipMSM().read(info, fields, start, end)
+
+    cached = ShipMSM(str(tmp_path / "cache")).read(info, fields, start, end)
+
+    xr.testing.assert_identical(cached, expected)
+
+
+def test_cache_is_built_once(tmp_path, dship_file):
+    info, parsed = dship_file
+    ShipMSM(str(tmp_path / "cache")).read(info)
+
+    # Another process reads only the cache:
+    ShipMSM(str(tmp_path / "cache")).read(info, ["air_pressure"])
+    assert len(parsed) == 1
+
+    # A changed file is parsed again:
+    with open(info.path, "a") as file:
+        file.write("more data")
+    ShipMSM(str(tmp_path / "cache")).read(info, ["air_pressure"])
+    assert len(parsed) == 2
@@ -0,0 +1,96 @@
+from argparse import Namespace
+import logging
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+import monitor
+from monitor import DataCache
+
+START, END = pd.Timestamp("2017-11-02"), pd.Timestamp("2017-11-03")
+
+
+class FakeFileSet:
+    """Yields one dataset with hourly values and counts the reads"""
+
+    def __init__(self, name):
+        self.name = name
+        self.reads = 0
+
+    def collect(self, start, end, read_args=None):
+        self.reads += 1
+        time = pd.date_range(start, end, freq="1h")
+        yield xr.Dataset(
+            {"value": ("time", np.arange(len(time), dtype=float))},
+            coords={"time": time},
+        )
+
+
+def cached_keys(cache):
+    return [key[0] for key in cache._items]
+
+
+def test_least_recently_used_data_is_dropped():
+    filesets = {name: FakeFileSet(name) for name in "abc"}
+    size = DataCache(START, END).load(FakeFileSet("size")).nbytes
+    cache = DataCache(START, END, max_size=2.5 * size)
+
+    for name in "abc":
+        cache.load(filesets[name])
+    assert cached_keys(cache) == ["b", "c"]
+
+    # b becomes the most recently used data, hence c is dropped for a:
+    cache.load(filesets["b"])
+    cache.load(filesets["a"])
+
+    assert cached_keys(cache) == ["b", "a"]
+    assert {name: fileset.reads for name, fileset in filesets.items()} \
+        == {"a": 2, "b": 1, "c": 1}
+    assert sum(item.nbytes for item in cache._items.values()) \
+        <= cache.max_size
+
+
+def test_data_larger_than_the_cache_is_kept():
+    fileset = FakeFileSet("a")
+    cache = DataCache(START, END, max_size=1)
+
+    data = cache.load(fileset)
+
+    assert cache.load(fileset) is data
+    assert fileset.reads == 1
+
+
+def test_failed_saving_raises_and_closes_the_figures(monkeypatch):
+    def plot_overview(filesets, config, start, end, writer):
+        plt.figure()
+
+        def write():
+            raise IOError("disk full")
+        return writer.submit(write)
+
+    monkeypatch.setattr(monitor, "plot_overview", plot_overview)
+    args = Namespace(overview=True, comparison=False, anomaly=False)
+
+    with pytest.raises(IOError, match="disk full"):
+        monitor.make_plots({}, {}, args, START, END)
+    assert not plt.get_fignums()
+
+
+def test_failed_first_period_is_logged(monkeypatch, caplog):
+    def make_plots(filesets, config, args, start, end):
+        raise ValueError("no data")
+
+    monkeypatch.setattr(monitor, "make_plots", make_plots)
+    monkeypatch.setattr(monitor, "data_cache", DataCache(START, END))
+    periods = pd.period_range(START, periods=1, freq="D")
+
+    with caplog.at_level(logging.WARNING):
+        monitor.make_plots_parallel({}, {}, None, periods, 1)
+
+    assert "no data" in caplog.text
+    assert "for 1 of 1 periods" in caplog.text
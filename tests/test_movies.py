@@ -0,0 +1,398 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+from typhon.files import FileInfo
+import xarray as xr
+
+import cloud
+import cloud.movies
+from cloud.movies import level_statistics
+from cloud.processing import _cloud_parameters, _cloud_parameters_chunked
+
+SURFACE_TEMPERATURE = 28.
+LEVELS = [-8., -16., -24.]
+
+
+def surface_temperatures(time):
+    return np.full(len(time), SURFACE_TEMPERATURE)
+
+
+def random_images(n_frames=12, shape=(20, 30), seed=0):
+    """Cloud-like temperatures between the clear sky and the surface"""
+    rng = np.random.default_rng(seed)
+    images = rng.uniform(-40, 27, (n_frames,) + shape).astype(np.float32)
+    images[:, :2, :] = np.nan
+    return images
+
+
+def random_movie(n_frames=12, shape=(20, 30), seed=0):
+    return xr.Dataset(
+        {"images": (("time", "height", "width"),
+                    random_images(n_frames, shape, seed))},
+        coords={"time": pd.date_range(
+            "2017-11-02", periods=n_frames, freq="10s")},
+    )
+
+
+def per_level_parameters(movie, levels):
+    """The cloud parameters calculated with one masked copy per level"""
+    n_frames = len(movie.data["time"])
+    methods = {
+        "cloud_coverage": movie.cloud_coverage,
+        "cloud_mean_temperature": movie.cloud_mean_temperature,
+        "cloud_min_temperature": movie.cloud_min_temperature,
+        "cloud_max_temperature": movie.cloud_max_temperature,
+    }
+    results = {parameter: [] for parameter in methods}
+    for level, decrement in enumerate(levels):
+        upper = None
+        if level > 0:
+            upper = np.full(n_frames, SURFACE_TEMPERATURE + levels[level-1])
+        movie.find_clouds(
+            np.full(n_frames, SURFACE_TEMPERATURE + decrement), upper)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for parameter, method in methods.items():
+                results[parameter].append(np.asarray(method()))
+
+    return {
+        parameter: np.column_stack(values)
+        for parameter, values in results.items()
+    }
+
+
+def test_cloud_parameters_equal_the_per_level_calculation():
+    data = random_movie()
+    # A frame without clouds:
+    data["images"][0] = -40.
+    expected = per_level_parameters(
+        cloud.ThermalCamMovie(data.copy()), LEVELS)
+
+    stats = cloud.ThermalCamMovie(data).cloud_parameters(
+        surface_temperatures, LEVELS)
+
+    for parameter, values in expected.items():
+        # The former mean was summed up in float32:
+        np.testing.assert_allclose(
+            stats[parameter].values, values, rtol=1e-6, err_msg=parameter)
+        assert stats[parameter].dtype == values.dtype, parameter
+
+
+def test_level_statistics_in_chunks(monkeypatch):
+    pixels = random_images()
+    thresholds = SURFACE_TEMPERATURE + np.tile(LEVELS, (len(pixels), 1))
+    expected = level_statistics(pixels, thresholds)
+
+    # Only a few frames per chunk:
+    monkeypatch.setattr(cloud.movies, "KERNEL_CHUNK_PIXELS", 1500)
+    results = level_statistics(pixels, thresholds)
+
+    for parameter, values in expected.items():
+        np.testing.assert_allclose(results[parameter], values)
+
+
+def test_level_statistics():
+    pixels = np.array([[[10., 20.], [-30., np.nan]]])
+    results = level_statistics(pixels, np.array([[15., 0.]]))
+
+    # 20 °C lies in the first level, 10 °C in the second one:
+    np.testing.assert_allclose(results["cloud_coverage"], [[1 / 3, 1 / 3]])
+    np.testing.assert_allclose(
+        results["cloud_mean_temperature"], [[20., 10.]])
+
+
+def random_mask(shape=(20, 30)):
+    mask = np.ones(shape, dtype=bool)
+    mask[:2, :] = False
+    mask[:, -3:] = False
+    return mask
+
+
+def test_packed_statistics_equal_masked_ones():
+    mask = random_mask()
+    masked = cloud.ThermalCamMovie(random_movie())
+    masked.apply_mask(mask)
+    packed = cloud.ThermalCamMovie(random_movie())
+
+    packed.apply_mask(mask, packed=True)
+
+    assert packed.is_packed
+    assert packed.data["images"].shape == (12, mask.sum())
+    xr.testing.assert_equal(
+        packed.cloud_parameters(surface_temperatures, LEVELS),
+        masked.cloud_parameters(surface_temperatures, LEVELS),
+    )
+
+    packed.unpack()
+    assert not packed.is_packed
+    np.testing.assert_array_equal(
+        packed.data["images"].values, masked.data["images"].values)
+
+
+def test_chunked_statistics(tmp_path):
+    movie = random_movie()
+    filename = str(tmp_path / "movie.nc")
+    movie.to_netcdf(filename)
+    config = {"General": {"lapse_rate": "-4"}}
+
+    expected = _cloud_parameters(movie, surface_temperatures, config)
+    frame_size = 4 * 20 * 30
+    results = _cloud_parameters_chunked(
+        FileInfo(filename), surface_temperatures, config, 5 * frame_size)
+
+    assert results.sizes["time"] == 12
+    xr.testing.assert_allclose(results, expected)
+
+
+def test_movie_builder_sorts_and_masks():
+    builder = cloud.MovieBuilder(3)
+    times = pd.to_datetime(["2017-11-02 10:02", "2017-11-02 10:00",
+                            "2017-11-02 10:01"])
+    for value, time in zip((2., 0., 1.), times):
+        builder.reserve((2, 2))[...] = value
+        builder.append(time)
+    mask = np.array([[True, False], [True, True]])
+
+    movie = builder.build(mask)
+
+    images = movie.data["images"].values
+    np.testing.assert_array_equal(images[:, 0, 0], [0., 1., 2.])
+    assert np.isnan(images[:, 0, 1]).all()
+    assert movie.data["time"].to_index().is_monotonic_increasing
+
+
+def test_movie_builder_packed():
+    builder = cloud.MovieBuilder(1)
+    builder.reserve((2, 2))[...] = [[1., 2.], [3., 4.]]
+    builder.append(pd.Timestamp("2017-11-02"))
+
+    movie = builder.build(np.array([[True, False], [True, True]]),
+                          packed=True)
+
+    assert movie.is_packed
+    np.testing.assert_array_equal(
+        movie.data["images"].values, [[1., 3., 4.]])
+
+
+def test_movie_builder_checks_frames():
+    builder = cloud.MovieBuilder(1)
+    builder.reserve((2, 2))
+    with pytest.raises(ValueError):
+        builder.reserve((3, 2))
+    builder.append(pd.Timestamp("2017-11-02"))
+    with pytest.raises(ValueError):
+        builder.reserve((2, 2))
+
+
+def test_movie_builder_slots():
+    builder = cloud.MovieBuilder(3)
+    slots = [builder.slot(index) for index in range(3)]
+    # The frames are decoded in any order, the second one fails:
+    for index in (2, 0):
+        slots[index].reserve((1, 1))[...] = index
+        slots[index].append(pd.Timestamp("2017-11-02 10:00:0%d" % index))
+
+    for slot in slots:
+        if slot.time is not None:
+            builder.append(slot.time, slot.index)
+
+    assert len(builder) == 2
+    np.testing.assert_array_equal(
+        builder.build().data["images"].values[:, 0, 0], [0., 2.])
+
+
+@pytest.mark.parametrize("dtype", ["int16", "uint8"])
+def test_encoding_round_trip(tmp_path, dtype):
+    movie = cloud.Movie(random_movie())
+    movie.set_encoding(dtype, (-50, 50))
+    scale_factor = movie.data["images"].encoding["scale_factor"]
+    filename = str(tmp_path / "movie.nc")
+
+    movie.data.to_netcdf(filename)
+
+    with xr.open_dataset(filename) as saved:
+        images = saved["images"].values
+    expected = random_images()
+    np.testing.assert_array_equal(np.isnan(images), np.isnan(expected))
+    np.testing.assert_allclose(
+        images, expected, rtol=0, atol=scale_factor / 2 + 1e-5)
+
+
+def test_pixel_sample_covers_the_mask():
+    mask = random_mask((64, 64))
+
+    sample = cloud.PixelSample(mask, 0.1, grid=4)
+
+    rows, columns = np.divmod(sample.indices, 64)
+    assert mask[rows, columns].all()
+    assert len(sample) == pytest.approx(0.1 * mask.sum(), rel=0.05)
+    # Each block of the grid is in the sample:
+    blocks = set(zip(rows // 16, columns // 16))
+    assert len(blocks) == 16
+
+    # The same sample is drawn each time:
+    np.testing.assert_array_equal(
+        cloud.PixelSample(mask, 0.1, grid=4).indices, sample.indices)
+
+
+def test_pixel_sample_from_packed_movie():
+    mask = random_mask()
+    movie = cloud.Movie(random_movie())
+    sample = cloud.PixelSample(mask, 0.2)
+    expected = sample.take(movie.data["images"])
+
+    movie.pack(mask)
+
+    np.testing.assert_array_equal(
+        sample.take(movie.data["images"]), expected)
+
+
+def test_approximate_statistics():
+    movie = cloud.ThermalCamMovie(random_movie(shape=(40, 60)))
+    mask = random_mask((40, 60))
+    movie.apply_mask(mask)
+    exact = movie.cloud_parameters(surface_temperatures, LEVELS)
+
+    approximated = movie.cloud_parameters(
+        surface_temperatures, LEVELS, sample=cloud.PixelSample(mask, 0.2))
+
+    for parameter in ("cloud_coverage", "cloud_mean_temperature"):
+        error = approximated[parameter + "_error"]
+        assert (error > 0).all()
+        # Within twice the half width of the 95% confidence interval:
+        assert (abs(approximated[parameter] - exact[parameter])
+                < 2 * error).all()
+
+
+def test_sample_of_all_pixels_is_exact():
+    mask = random_mask()
+    movie = cloud.ThermalCamMovie(random_movie())
+    movie.apply_mask(mask)
+    exact = movie.cloud_parameters(surface_temperatures, LEVELS)
+
+    approximated = movie.cloud_parameters(
+        surface_temperatures, LEVELS, sample=cloud.PixelSample(mask, 1))
+
+    xr.testing.assert_allclose(
+        approximated[list(exact.data_vars)], exact)
+    np.testing.assert_allclose(approximated["cloud_coverage_error"], 0)
+
+
+BINS = (-100., 60., 0.5)
+
+
+def test_temperature_histograms():
+    pixels = np.array([[[-150., -100., 59.9], [60., np.nan, 10.2]]])
+
+    histograms = cloud.temperature_histograms(pixels, BINS)
+
+    assert histograms.shape == (1, 320 + 2)
+    # Underflow and overflow bin:
+    assert histograms[0, 0] == 1
+    assert histograms[0, -1] == 1
+    assert histograms[0, 1] == 1
+    assert histograms[0, -2] == 1
+    assert histograms[0, 1 + 220] == 1
+    assert histograms.sum() == 5
+
+
+def test_histogram_statistics():
+    pixels = random_images()
+    thresholds = SURFACE_TEMPERATURE + np.tile(LEVELS, (len(pixels), 1))
+    exact = level_statistics(pixels, thresholds)
+
+    results = cloud.histogram_statistics(
+        cloud.temperature_histograms(pixels, BINS), BINS, thresholds)
+
+    # The thresholds lie on bin edges, hence the coverage is exact:
+    np.testing.assert_allclose(
+        results["cloud_coverage"], exact["cloud_coverage"])
+    for parameter in ("cloud_mean_temperature", "cloud_min_temperature",
+                      "cloud_max_temperature"):
+        np.testing.assert_allclose(
+            results[parameter], exact[parameter], atol=BINS[2] / 2)
+
+
+def test_histogram_statistics_out_of_range():
+    pixels = random_images(n_frames=1)
+    pixels[0, 5, 5] = 100.
+    thresholds = SURFACE_TEMPERATURE + np.array([LEVELS])
+    exact = level_statistics(pixels, thresholds)
+
+    results = cloud.histogram_statistics(
+        cloud.temperature_histograms(pixels, BINS), BINS, thresholds)
+
+    np.testing.assert_allclose(
+        results["cloud_coverage"], exact["cloud_coverage"])
+    # The temperature of the hot pixel is unknown:
+    assert np.isnan(results["cloud_max_temperature"][0, 0])
+    assert np.isnan(results["cloud_mean_temperature"][0, 0])
+    assert not np.isnan(results["cloud_min_temperature"][0, 0])
+    # The other levels are not affected:
+    np.testing.assert_allclose(
+        results["cloud_max_temperature"][0, 1:],
+        exact["cloud_max_temperature"][0, 1:], atol=BINS[2] / 2)
+
+
+def test_recalculate_from_saved_histograms(tmp_path):
+    movie = cloud.ThermalCamMovie(random_movie())
+    stats = movie.cloud_parameters(
+        surface_temperatures, LEVELS, histogram_bins=BINS)
+    filename = str(tmp_path / "stats.nc")
+    stats.to_netcdf(filename)
+
+    with xr.open_dataset(filename) as saved:
+        assert np.isneginf(saved["temperature_bin"][0])
+        results = cloud.histogram_cloud_parameters(
+            saved.load(), surface_temperatures, LEVELS)
+
+    np.testing.assert_allclose(
+        results["cloud_coverage"], stats["cloud_coverage"])
+    np.testing.assert_allclose(
+        results["cloud_max_temperature"], stats["cloud_max_temperature"],
+        atol=BINS[2] / 2)
+
+
+SWEEP = [[-8., -16., -24.], [-10., -20., -30.], [-13., -26., -39.]]
+
+
+def test_sweep_equals_single_configurations():
+    pixels = random_images()
+    # Some pixels lie exactly on the thresholds:
+    pixels[:, 5, :3] = SURFACE_TEMPERATURE + np.array(SWEEP)[:, 1]
+    surface = np.full(len(pixels), SURFACE_TEMPERATURE)
+
+    results = cloud.sweep_statistics(pixels, surface, SWEEP)
+
+    for config, levels in enumerate(SWEEP):
+        expected = level_statistics(
+            pixels, surface[:, None] + np.array(levels)[None, :])
+        for parameter, values in expected.items():
+            np.testing.assert_allclose(
+                results[parameter][:, config], values,
+                err_msg="%s of config %d" % (parameter, config))
+
+
+def test_sweep_with_sample():
+    pixels = random_images()
+    surface = np.full(len(pixels), SURFACE_TEMPERATURE)
+
+    results = cloud.sweep_statistics(pixels, surface, SWEEP, 0.5)
+
+    for config, levels in enumerate(SWEEP):
+        expected = level_statistics(
+            pixels, surface[:, None] + np.array(levels)[None, :], 0.5)
+        for parameter, values in expected.items():
+            np.testing.assert_allclose(results[parameter][:, config], values)
+
+
+def test_cloud_parameters_of_sweep():
+    movie = cloud.ThermalCamMovie(random_movie())
+
+    stats = movie.cloud_parameters(surface_temperatures, SWEEP)
+
+    assert stats["cloud_coverage"].dims == ("time", "config", "level")
+    single = movie.cloud_parameters(surface_temperatures, SWEEP[1])
+    xr.testing.assert_allclose(stats.isel(config=1, drop=True), single)
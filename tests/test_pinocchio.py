@@ -0,0 +1,157 @@
+from datetime import datetime
+import io
+import os
+import struct
+import tarfile
+
+import numpy as np
+import PIL.Image
+from typhon.files import FileInfo
+
+import cloud
+from cloud.pinocchio import (
+    brightness_to_temperature, read_exif_time, ThermalCam)
+
+EXAMPLES = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples")
+CALIBRATION = os.path.join(EXAMPLES, "pinocchio_calibration.csv")
+
+EXIF_IFD = 0x8769
+DATE_TIME_ORIGINAL = 0x9003
+
+
+def write_jpeg(path, time=None, shape=(48, 64)):
+    grey = np.random.default_rng(0).integers(
+        0, 256, shape, dtype=np.uint8)
+    exif = PIL.Image.Exif()
+    if time is not None:
+        exif.get_ifd(EXIF_IFD)[DATE_TIME_ORIGINAL] = \
+            time.strftime("%Y:%m:%d %H:%M:%S")
+    PIL.Image.fromarray(grey).save(str(path), exif=exif)
+    return str(path)
+
+
+def test_exif_round_trip(tmp_path):
+    time = datetime(2017, 11, 2, 12, 34, 56)
+    filename = write_jpeg(tmp_path / "image.jpg", time)
+
+    with open(filename, "rb") as file:
+        assert read_exif_time(file) == time
+
+
+def test_no_exif_time(tmp_path):
+    filename = write_jpeg(tmp_path / "image.jpg")
+
+    with open(filename, "rb") as file:
+        assert read_exif_time(file) is None
+
+    assert read_exif_time(io.BytesIO(b"no image")) is None
+    # A truncated header:
+    with open(filename, "rb") as file:
+        assert read_exif_time(io.BytesIO(file.read(10))) is None
+
+
+def test_exif_with_cyclic_ifds():
+    # The only entry of the IFD is an ExifOffset pointing to the IFD itself:
+    tiff = b"II*\0" + struct.pack("<I", 8) + struct.pack("<H", 1) \
+        + struct.pack("<HHII", EXIF_IFD, 4, 1, 8)
+    assert len(tiff) == 22
+    segment = b"Exif\0\0" + tiff
+    jpeg = b"\xff\xd8\xff\xe1" + struct.pack(">H", len(segment) + 2) \
+        + segment
+
+    assert read_exif_time(io.BytesIO(jpeg)) is None
+
+
+def test_filename_time_as_fallback(tmp_path):
+    filename = write_jpeg(tmp_path / "image.jpg")
+    times = [datetime(2017, 11, 2, 10), datetime(2017, 11, 2, 10)]
+
+    info = ThermalCam(CALIBRATION).get_info(FileInfo(filename, times))
+
+    assert info.times == times
+
+
+def test_read_frame_takes_exif_time(tmp_path):
+    time = datetime(2017, 11, 2, 12, 34, 56)
+    filename = write_jpeg(tmp_path / "image.jpg", time)
+
+    builder = cloud.MovieBuilder(1)
+    with open(filename, "rb") as file:
+        # Files from archives are file objects:
+        ThermalCam(CALIBRATION).read_frame(
+            file, builder, datetime(2017, 1, 1))
+
+    assert builder.times == [time]
+    assert builder.images.shape == (1, 48, 64)
+
+
+def test_calibration_table_equals_the_formula():
+    handler = ThermalCam(CALIBRATION)
+    grey = np.arange(256, dtype=np.float32)
+
+    expected = brightness_to_temperature(
+        grey, handler.calibration_coefficients)
+
+    assert handler.calibration_table.dtype == np.float32
+    np.testing.assert_allclose(
+        handler.calibration_table, expected, rtol=1e-6)
+
+
+def test_read_frame_from_the_current_position(tmp_path):
+    filename = write_jpeg(tmp_path / "image.jpg", datetime(2017, 11, 2))
+    expected = ThermalCam(CALIBRATION).read_image(filename)
+
+    with open(filename, "rb") as file:
+        file_object = io.BytesIO(b"header" + file.read())
+    file_object.seek(6)
+    builder = cloud.MovieBuilder(1)
+    ThermalCam(CALIBRATION).read_frame(file_object, builder)
+
+    # The file object belongs to the caller:
+    assert not file_object.closed
+    np.testing.assert_array_equal(
+        builder.images, expected["images"].values)
+
+
+def test_read_frame_from_archive_stream(tmp_path):
+    filename = write_jpeg(tmp_path / "image.jpg", datetime(2017, 11, 2))
+    expected = ThermalCam(CALIBRATION).read_image(filename)
+    with tarfile.open(str(tmp_path / "archive.tar.gz"), "w:gz") as archive:
+        archive.add(filename, "image.jpg")
+
+    builder = cloud.MovieBuilder(1)
+    with tarfile.open(str(tmp_path / "archive.tar.gz"), "r|gz") as archive:
+        for member in archive:
+            ThermalCam(CALIBRATION).read_frame(
+                archive.extractfile(member), builder)
+
+    np.testing.assert_array_equal(
+        builder.images, expected["images"].values)
+
+
+def test_reduced_resolution(tmp_path):
+    # Constant blocks of the JPEG block size stay the same when scaled:
+    blocks = np.random.default_rng(0).integers(0, 256, (6, 8))
+    grey = np.kron(blocks, np.ones((8, 8))).astype(np.uint8)
+    filename = str(tmp_path / "image.jpg")
+    PIL.Image.fromarray(grey).save(filename, quality=95)
+
+    full = ThermalCam(CALIBRATION).read_image(filename)["images"].values
+    half = ThermalCam(CALIBRATION, scale=2).read_image(
+        filename)["images"].values
+
+    assert half.shape == (1, 24, 32)
+    np.testing.assert_allclose(half, full[:, ::2, ::2], atol=1.)
+
+
+def test_reduced_mask():
+    mask = cloud.load_mask(
+        os.path.join(EXAMPLES, "pinocchio-thermal-mask.png"))
+
+    reduced = cloud.load_mask(
+        os.path.join(EXAMPLES, "pinocchio-thermal-mask.png"), 4)
+
+    assert reduced.shape == (mask.shape[0] // 4, mask.shape[1] // 4)
+    # A reduced pixel is only valid if all its pixels are valid:
+    assert reduced.sum() <= mask.sum() // 16
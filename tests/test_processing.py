@@ -0,0 +1,203 @@
+import os
+import tarfile
+
+import numpy as np
+import pandas as pd
+import PIL.Image
+import pytest
+from typhon.files import FileInfo, FileSet
+import xarray as xr
+
+import cloud
+from cloud.pinocchio import ThermalCam
+from cloud.processing import (
+    _cloud_parameters, _convert_archive, _convert_files, _read_frames,
+    _rollup, read_rollups)
+
+EXAMPLES = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples")
+CALIBRATION = os.path.join(EXAMPLES, "pinocchio_calibration.csv")
+
+CONFIG = {"General": {"lapse_rate": "-4"}}
+
+EXIF_IFD = 0x8769
+DATE_TIME_ORIGINAL = 0x9003
+
+
+def surface_temperatures(time):
+    return np.full(len(time), 28.)
+
+
+def write_jpeg(path, time, seed, shape=(48, 64)):
+    """A random grey image with its time in the EXIF header"""
+    grey = np.random.default_rng(seed).integers(
+        0, 256, shape, dtype=np.uint8)
+    exif = PIL.Image.Exif()
+    exif.get_ifd(EXIF_IFD)[DATE_TIME_ORIGINAL] = \
+        time.strftime("%Y:%m:%d %H:%M:%S")
+    PIL.Image.fromarray(grey).save(path, exif=exif)
+
+
+@pytest.fixture
+def raw(tmp_path):
+    """A fileset with some Pinocchio images of one hour"""
+    directory = tmp_path / "raw"
+    directory.mkdir()
+    times = pd.date_range("2017-11-02 10:00", periods=8, freq="1min")
+    for seed, time in enumerate(times):
+        write_jpeg(str(directory / time.strftime("tm%y%m%d%H%M%S.jpg")),
+                   time, seed)
+
+    return FileSet(
+        str(directory / "tm{year2}{month}{day}{hour}{minute}{second}.jpg"),
+        name="Pinocchio-raw", handler=ThermalCam(CALIBRATION),
+    )
+
+
+def find_files(raw):
+    return sorted(raw.find("2017-11-02", "2017-11-03"),
+                  key=lambda info: info.times[0])
+
+
+def test_fused_statistics_equal_those_of_the_saved_movie(tmp_path, raw):
+    movies = FileSet(
+        str(tmp_path / "netcdf" / "tm{year2}{month}{day}{hour}.nc"),
+        name="Pinocchio-netcdf",
+    )
+    statistics = {
+        "output": FileSet(str(tmp_path / "stats" / "tm{hour}-{end_hour}.nc"),
+                          name="Pinocchio-stats"),
+        "temperatures": surface_temperatures,
+        "config": CONFIG,
+    }
+
+    movie_file, stats_file = _convert_files(
+        find_files(raw), raw, None, output=movies, statistics=statistics)
+
+    with xr.open_dataset(movie_file) as movie:
+        assert movie.sizes["time"] == 8
+        expected = _cloud_parameters(
+            movie.load(), surface_temperatures, CONFIG)
+    with xr.open_dataset(stats_file) as fused:
+        xr.testing.assert_allclose(fused.load(), expected)
+
+
+def test_statistics_without_movie(tmp_path, raw):
+    statistics = {
+        "output": FileSet(str(tmp_path / "stats" / "tm{hour}-{end_hour}.nc"),
+                          name="Pinocchio-stats"),
+        "temperatures": surface_temperatures,
+        "config": CONFIG,
+    }
+
+    movie_file, stats_file = _convert_files(
+        find_files(raw), raw, None, statistics=statistics)
+
+    assert movie_file is None
+    assert os.path.isfile(stats_file)
+    assert not (tmp_path / "netcdf").exists()
+
+
+def test_prefetched_frames_equal_serial_ones(raw):
+    files = find_files(raw)
+    # A broken image in between:
+    with open(files[3].path, "wb") as file:
+        file.write(b"no image")
+
+    serial = cloud.MovieBuilder(len(files))
+    _read_frames(files, raw, serial)
+    prefetched = cloud.MovieBuilder(len(files))
+    _read_frames(files, raw, prefetched, prefetch=(3, 2))
+
+    assert len(prefetched) == len(serial) == 7
+    assert prefetched.times == serial.times
+    np.testing.assert_array_equal(prefetched.images[:7], serial.images[:7])
+
+
+def test_archive_with_split_bundle(tmp_path, raw):
+    files = find_files(raw)
+    # The images of the first bundle (10:00-10:05) are split by those of the
+    # second one:
+    archive = str(tmp_path / "raw.gz")
+    with tarfile.open(archive, "w:gz") as archive_file:
+        for index in (0, 1, 5, 6, 7, 2, 3, 4):
+            archive_file.add(
+                files[index].path, os.path.basename(files[index].path))
+
+    movies = FileSet(
+        str(tmp_path / "netcdf" / "tm{year2}{month}{day}{hour}{minute}.nc"),
+        name="Pinocchio-netcdf",
+    )
+    written = []
+
+    def write(data, filename, **kwargs):
+        written.append(data.sizes["time"])
+        FileSet.write(movies, data, filename, **kwargs)
+
+    movies.write = write
+    converted = _convert_archive(
+        FileInfo(archive), raw, movies, None, pd.Timestamp("2017-11-02"),
+        pd.Timestamp("2017-11-03"), "5min")
+
+    assert sorted(converted) == [
+        pd.Timestamp("2017-11-02 10:00"), pd.Timestamp("2017-11-02 10:05")]
+    # Each movie is written once with all its images:
+    assert sorted(written) == [3, 5]
+    for bundle in (files[:5], files[5:]):
+        expected, _ = _convert_files(
+            bundle, raw, None, output=FileSet(
+                str(tmp_path / "expected" / "tm{minute}.nc")))
+        with xr.open_dataset(movies.get_filename(bundle[0].times)) as movie, \
+                xr.open_dataset(expected) as expected:
+            xr.testing.assert_identical(movie.load(), expected.load())
+
+
+def stats_data():
+    """Statistics of every minute with a gap and some missing values"""
+    time = pd.date_range("2017-11-02 10:00", "2017-11-02 12:59", freq="1min")
+    time = time[(time.hour != 11) | (time.minute >= 30)]
+    values = np.random.default_rng(0).random((len(time), 3))
+    values[::7, 1] = np.nan
+    return xr.Dataset(
+        {"cloud_coverage": (("time", "level"), values, {"units": "1"})},
+        coords={"time": time, "level": [0, 1, 2]},
+    )
+
+
+def grouped(data, resolution, how):
+    return getattr(data.groupby(data.time.dt.floor(resolution)), how)()
+
+
+def test_rollup_equals_direct_aggregation():
+    data = stats_data()
+
+    rollup = _rollup(data, "10min")
+
+    assert rollup.time.size == 15
+    xr.testing.assert_allclose(
+        rollup["cloud_coverage"], grouped(data, "10min", "mean")[
+            "cloud_coverage"].rename(floor="time"))
+    for how in ("count", "min", "max"):
+        xr.testing.assert_allclose(
+            rollup["cloud_coverage_" + how],
+            grouped(data, "10min", how)["cloud_coverage"].rename(
+                floor="time"))
+    assert rollup["cloud_coverage"].attrs == {"units": "1"}
+
+
+def test_coarser_rollups_are_weighted_by_count(tmp_path):
+    data = stats_data()
+    rollups = FileSet(
+        str(tmp_path / "rollups" / "{resolution}" / "{year}{month}{day}.nc"))
+    rollups.write(_rollup(data, "10min"), rollups.get_filename(
+        (pd.Timestamp("2017-11-02"), pd.Timestamp("2017-11-03")),
+        fill={"resolution": "10min"}))
+
+    result = read_rollups(
+        rollups, {"General": {"rollups": "10min"}}, "2017-11-02",
+        "2017-11-03", "1h")
+
+    expected = grouped(data, "1h", "mean")["cloud_coverage"].rename(
+        floor="time")
+    xr.testing.assert_allclose(
+        result["cloud_coverage"].sel(time=expected.time), expected)
@@ -0,0 +1,61 @@
+import pandas as pd
+import pytest
+
+import processor
+from processor import get_cmd_line_parser
+
+
+def test_sweep_before_dates():
+    args = get_cmd_line_parser().parse_args(
+        ["-s", "--sweep", "-4", "--sweep", "-6.5", "2017-11-02",
+         "2017-11-03"])
+
+    assert args.sweep == [-4., -6.5]
+    assert (args.start, args.end) == ("2017-11-02", "2017-11-03")
+
+
+def test_sweep_after_dates():
+    args = get_cmd_line_parser().parse_args(
+        ["-s", "2017-11-02", "2017-11-03", "--sweep", "-5"])
+
+    assert args.sweep == [-5.]
+    assert args.start == "2017-11-02"
+
+
+def test_no_sweep():
+    args = get_cmd_line_parser().parse_args(["-s", "2017-11-02"])
+
+    assert args.sweep is None
+
+
+class StopWatching(Exception):
+    pass
+
+
+def test_watch_starts_at_the_newest_bundle(monkeypatch):
+    config = {
+        "General": {"manifest": "manifest.db"},
+        "Watch": {"instruments": "Dumbo", "interval": "60",
+                  "latency": "600", "lookback": "1D"},
+    }
+    checks = []
+
+    def process_new_files(filesets, config, instrument, start, end,
+                          archives):
+        checks.append((start, end))
+
+    def sleep(seconds):
+        if len(checks) == 2:
+            raise StopWatching()
+
+    monkeypatch.setattr(processor, "process_new_files", process_new_files)
+    monkeypatch.setattr(processor.time, "sleep", sleep)
+
+    with pytest.raises(StopWatching):
+        processor.watch(None, config)
+
+    (first_start, first_end), (start, _) = checks
+    assert first_start == (first_end - pd.Timedelta("1D")).floor("1h")
+    # The next check starts at the newest processed bundle minus the latency:
+    assert start == (
+        first_end.floor("1h") - pd.Timedelta("10min")).floor("1h")
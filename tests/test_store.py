@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from cloud.store import ZarrFileSet
+
+
+def make_stores(fileset, *bundle_starts):
+    for bundle_start in bundle_starts:
+        os.makedirs(fileset.get_filename([pd.Timestamp(bundle_start)]))
+
+
+def hourly_data(start):
+    time = pd.date_range(start, periods=6, freq="10min")
+    return xr.Dataset(
+        {"cloud_coverage": ("time", np.linspace(0., 1., len(time)))},
+        coords={"time": time},
+    )
+
+
+def test_find_excludes_the_end(tmp_path):
+    fileset = ZarrFileSet(str(tmp_path), bundle="1h")
+    make_stores(fileset, "2017-11-02 10:00", "2017-11-02 11:00",
+                "2017-11-02 12:00")
+
+    found = list(fileset.find("2017-11-02 10:30", "2017-11-02 12:00"))
+
+    assert [info.times[0] for info in found] == [
+        pd.Timestamp("2017-11-02 10:00"), pd.Timestamp("2017-11-02 11:00")]
+
+
+def test_find_without_stores(tmp_path):
+    fileset = ZarrFileSet(str(tmp_path), bundle="1h")
+    make_stores(fileset, "2017-11-02 11:00")
+
+    assert list(fileset.find(
+        "2017-11-02 10:00", "2017-11-02 11:00", no_files_error=False)) == []
+
+
+def test_written_store_is_read_again(tmp_path):
+    pytest.importorskip("zarr")
+    fileset = ZarrFileSet(str(tmp_path), bundle="1h")
+    data = hourly_data("2017-11-02 10:00")
+
+    fileset.write(data, fileset.get_filename([data.time.values[0]]))
+    # A second write replaces the store:
+    fileset.write(data * 2, fileset.get_filename([data.time.values[0]]))
+
+    (info, ) = fileset.find("2017-11-02", "2017-11-03")
+    xr.testing.assert_identical(fileset.read(info), data * 2)
+    assert os.listdir(os.path.dirname(info.path)) == ["100000.zarr"]
+
+
+def test_read_period(tmp_path):
+    pytest.importorskip("zarr")
+    fileset = ZarrFileSet(str(tmp_path), bundle="1h")
+    data = xr.concat(
+        [hourly_data("2017-11-02 10:00"), hourly_data("2017-11-02 11:00")],
+        dim="time")
+    for _, hour in data.groupby("time.hour"):
+        fileset.write(hour, fileset.get_filename([hour.time.values[0]]))
+
+    period = fileset.read_period("2017-11-02 10:20", "2017-11-02 11:20")
+
+    xr.testing.assert_identical(
+        period, data.sel(time=slice("2017-11-02 10:20", "2017-11-02 11:20")))
@@ -0,0 +1,112 @@
+import os
+import time
+
+import pytest
+
+from cloud.workqueue import WorkQueue
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Two workers that share one queue directory"""
+    first = WorkQueue(str(tmp_path), timeout=60)
+    second = WorkQueue(str(tmp_path), timeout=60)
+    first.worker, second.worker = "node1:1", "node2:2"
+    return first, second
+
+
+def make_stale(queue, job):
+    lock = queue._path(job, ".lock")
+    past = os.stat(lock).st_mtime - 2 * queue.timeout
+    os.utime(lock, (past, past))
+
+
+def test_only_one_worker_claims_a_job(workers):
+    first, second = workers
+
+    assert first.claim("job")
+    assert not second.claim("job")
+
+    assert first.release("job")
+    assert first.is_done("job")
+    assert not second.claim("job")
+
+
+def test_released_job_without_success_can_be_claimed(workers):
+    first, second = workers
+    first.claim("job")
+
+    first.release("job", done=False)
+
+    assert not first.is_done("job")
+    assert second.claim("job")
+
+
+def test_stale_claim_is_reclaimed(workers):
+    first, second = workers
+    first.claim("job")
+
+    make_stale(first, "job")
+
+    assert second.claim("job")
+    assert second._owner("job") == second.worker
+
+
+def test_fresh_claim_is_not_reclaimed(workers):
+    first, second = workers
+    first.claim("job")
+    make_stale(first, "job")
+
+    assert first.refresh("job")
+
+    assert not second.claim("job")
+
+
+def test_lost_claim(workers):
+    first, second = workers
+    first.claim("job")
+    make_stale(first, "job")
+    second.claim("job")
+
+    # The first worker was only slow. It must not touch the new claim:
+    assert not first.refresh("job")
+    assert not first.release("job")
+    assert not first.is_done("job")
+    assert second._owner("job") == second.worker
+
+    assert second.release("job")
+    assert second.is_done("job")
+
+
+def test_released_claim(workers):
+    first, _ = workers
+    first.claim("job")
+    os.remove(first._path("job", ".lock"))
+
+    assert not first.refresh("job")
+    assert not first.release("job")
+
+
+def test_process(workers):
+    first, second = workers
+    second.claim("b")
+    processed = []
+
+    def func(job):
+        if job == "c":
+            raise ValueError("This job fails")
+        processed.append(job)
+
+    assert first.process(["a", "b", "c"], func) == 1
+    assert processed == ["a"]
+    assert first.is_done("a")
+    assert not first.is_done("c")
+    # The failed job can be tried again:
+    assert second.claim("c")
+
+
+def test_age_uses_the_clock_of_the_filesystem(workers):
+    first, _ = workers
+
+    assert abs(first._now() - time.time()) < 5
+    assert os.listdir(first.directory) == []